@@ -0,0 +1,177 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Awaitable, Callable
+
+import numpy as np
+import torch
+import voyageai
+from FlagEmbedding import BGEM3FlagModel
+from pathway.xpacks.llm import embedders
+
+from config import EMBEDDER_MAX_BATCH_SIZE, EMBEDDER_MAX_WAIT
+
+
+class _LoopQueue:
+    def __init__(self):
+        self.pending = []
+        self.timer = None
+        # The loop only keeps weak references to tasks, the batches in flight
+        # are kept here until they are done
+        self.tasks = set()
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-input calls into batched calls.
+
+    `submit` queues one input and waits for its result. The queue is flushed
+    into one call to `embed_batch` as soon as it holds `max_batch_size` inputs,
+    or `max_wait` seconds after the first input was queued, whichever comes
+    first. Queues are kept per event loop, as futures cannot be shared across
+    loops.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[list[str]], Awaitable[list[np.ndarray]]],
+        max_batch_size: int = EMBEDDER_MAX_BATCH_SIZE,
+        max_wait: float = EMBEDDER_MAX_WAIT,
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queues: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    async def submit(self, input: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(loop)
+        if queue is None:
+            queue = self._queues[loop] = _LoopQueue()
+
+        future = loop.create_future()
+        queue.pending.append((input, future))
+        if len(queue.pending) >= self.max_batch_size:
+            self._flush(queue)
+        elif queue.timer is None:
+            queue.timer = loop.call_later(self.max_wait, self._flush, queue)
+        return await future
+
+    def _flush(self, queue: _LoopQueue):
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        while len(queue.pending) > 0:
+            batch = queue.pending[: self.max_batch_size]
+            queue.pending = queue.pending[self.max_batch_size :]
+            task = asyncio.ensure_future(self._run(batch))
+            queue.tasks.add(task)
+            task.add_done_callback(queue.tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.embed_batch([input for input, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+class VoyageEmbedder(embedders.OpenAIEmbedder):
+    """
+    Pathway wrapper for Voyage AI Embedding services.
+
+    Concurrent calls are sent to Voyage AI in batches through a single client.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.vo = voyageai.Client(api_key=os.getenv("VOYAGE_API_KEY"))
+        self.batcher = MicroBatcher(self._embed_batch)
+
+    async def _embed_batch(self, inputs: list[str]) -> list[np.ndarray]:
+        ret = await asyncio.to_thread(
+            self.vo.embed, inputs, model="voyage-3", input_type="document"
+        )
+        return [np.array(embedding) for embedding in ret.embeddings]
+
+    async def __wrapped__(self, input, **kwargs) -> np.ndarray:
+        """Embed the documents
+
+        Args:
+            - input: mandatory, the string to embed.
+            - **kwargs: optional parameters, if unset defaults from the constructor
+              will be taken.
+        """
+        return await self.batcher.submit(input or ".")
+
+
+class Bge_m3_embedder(embedders.OpenAIEmbedder):
+    """
+    Custom Pathway embedder for BGE-M3 model with flexible embedding handling.
+
+    Key Considerations:
+    - Ensures compatibility with Pathway's vector store
+    - Handles various input scenarios
+    - Provides flexible embedding output
+    - Encodes concurrent calls in batches, in a worker thread so that the
+      event loop is not blocked
+    """
+
+    def __init__(self, model_name="BAAI/bge-m3", *args, **kwargs):
+        """
+        Initialize the BGE-M3 embedder.
+
+        Args:
+            model_name (str): Hugging Face model identifier
+            *args: Additional positional arguments for OpenAIEmbedder
+            **kwargs: Additional keyword arguments for OpenAIEmbedder
+        """
+        super().__init__(*args, **kwargs)
+
+        # Load BGE-M3 model
+        self.bgem3_model = BGEM3FlagModel(
+            model_name,
+            use_fp16=torch.cuda.is_available(),  # Use FP16 if CUDA available
+        )
+        # One batch on the model at a time
+        self._model_lock = threading.Lock()
+        self.batcher = MicroBatcher(self._embed_batch)
+
+    def _encode(self, inputs: list[str]):
+        with self._model_lock:
+            return self.bgem3_model.encode(inputs, return_dense=True)
+
+    async def _embed_batch(self, inputs: list[str]) -> list[np.ndarray]:
+        embeddings_dict = await asyncio.to_thread(self._encode, inputs)
+        # Convert to float32 numpy arrays
+        return [
+            np.array(embedding, dtype=np.float32)
+            for embedding in embeddings_dict["dense_vecs"]
+        ]
+
+    async def __wrapped__(self, input, **kwargs) -> np.ndarray:
+        """
+        Embed input text with flexible handling.
+
+        Args:
+            input (str): Text to embed
+            **kwargs: Additional embedding parameters
+
+        Returns:
+            np.ndarray: Embedding vector
+        """
+        # Handle empty or whitespace inputs
+        if not input or input.isspace():
+            input = "."
+
+        try:
+            return await self.batcher.submit(input)
+        except Exception as e:
+            print(f"Embedding error: {e}")
+            raise
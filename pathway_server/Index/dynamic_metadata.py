@@ -4,7 +4,11 @@ from database import *
 from config import *
 from pydantic import BaseModel, Field
 from typing import Literal, List, Set
+import asyncio
 import os
+import random
+import threading
+import time
 
 client = instructor.from_anthropic(anthropic.Anthropic())
 
@@ -282,36 +286,68 @@ If the above number is ~ 1-2, then do not worry about the new topics you are ass
 Return in OtherDynamicMetadataSchema format."""
 
 
+def _finance_messages(doc: str, chunk_prompt: str):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": DOCUMENT_CONTEXT_PROMPT.format(doc_content=doc),
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {
+                    "type": "text",
+                    "text": GLOBAL_SET_OF_FINANCE_TERMS_PROMPT.format(
+                        finance_terms="\n".join(GLOBAL_SET_OF_FINANCE_TERMS)
+                    ),
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {
+                    "type": "text",
+                    "text": chunk_prompt,
+                },
+            ],
+        }
+    ]
+
+
+def _others_messages(doc: str, chunk: str, set_of_topics: Set[str]):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": DOCUMENT_CONTEXT_PROMPT.format(doc_content=doc),
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {
+                    "type": "text",
+                    "text": SET_OF_TERMS_USED_TILL_NOW.format(
+                        topics="\n".join(set_of_topics)
+                    ),
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {
+                    "type": "text",
+                    "text": OTHER_CHUNK_CONTEXT_PROMPT.format(
+                        chunk_content=chunk, num_topics=len(set_of_topics)
+                    ),
+                },
+            ],
+        }
+    ]
+
+
 def situate_context_finance(doc: str, chunk: str, typetext: str, type: str):
     response = client.chat.completions.create_with_completion(
         model="claude-3-haiku-20240307",
         max_tokens=4096,
         temperature=0.0,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": DOCUMENT_CONTEXT_PROMPT.format(doc_content=doc),
-                        "cache_control": {"type": "ephemeral"},
-                    },
-                    {
-                        "type": "text",
-                        "text": GLOBAL_SET_OF_FINANCE_TERMS_PROMPT.format(
-                            finance_terms="\n".join(GLOBAL_SET_OF_FINANCE_TERMS)
-                        ),
-                        "cache_control": {"type": "ephemeral"},
-                    },
-                    {
-                        "type": "text",
-                        "text": FINANCE_CHUNK_CONTEXT_PROMPT.format(
-                            chunk_content=chunk
-                        ),
-                    },
-                ],
-            }
-        ],
+        messages=_finance_messages(
+            doc, FINANCE_CHUNK_CONTEXT_PROMPT.format(chunk_content=chunk)
+        ),
         extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
         response_model=FinanceDynamicMetadataSchema,
     )
@@ -329,31 +365,12 @@ def situate_context_finance_table(
         model="claude-3-haiku-20240307",
         max_tokens=4096,
         temperature=0.0,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": DOCUMENT_CONTEXT_PROMPT.format(doc_content=doc),
-                        "cache_control": {"type": "ephemeral"},
-                    },
-                    {
-                        "type": "text",
-                        "text": GLOBAL_SET_OF_FINANCE_TERMS_PROMPT.format(
-                            finance_terms="\n".join(GLOBAL_SET_OF_FINANCE_TERMS)
-                        ),
-                        "cache_control": {"type": "ephemeral"},
-                    },
-                    {
-                        "type": "text",
-                        "text": FINANCE_TABLE_CHUNK_CONTEXT_PROMPT.format(
-                            chunk_content=chunk, chunk_before_table=prev_chunk
-                        ),
-                    },
-                ],
-            }
-        ],
+        messages=_finance_messages(
+            doc,
+            FINANCE_TABLE_CHUNK_CONTEXT_PROMPT.format(
+                chunk_content=chunk, chunk_before_table=prev_chunk
+            ),
+        ),
         extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
         response_model=TableValuesSchema,
     )
@@ -369,37 +386,301 @@ def situate_context_others(doc: str, chunk: str, set_of_topics: Set[str]):
         model="claude-3-haiku-20240307",
         max_tokens=4096,
         temperature=0.0,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": DOCUMENT_CONTEXT_PROMPT.format(doc_content=doc),
-                        "cache_control": {"type": "ephemeral"},
-                    },
-                    {
-                        "type": "text",
-                        "text": SET_OF_TERMS_USED_TILL_NOW.format(
-                            topics="\n".join(set_of_topics)
-                        ),
-                        "cache_control": {"type": "ephemeral"},
-                    },
-                    {
-                        "type": "text",
-                        "text": OTHER_CHUNK_CONTEXT_PROMPT.format(
-                            chunk_content=chunk, num_topics=len(set_of_topics)
-                        ),
-                    },
-                ],
-            }
-        ],
+        messages=_others_messages(doc, chunk, set_of_topics),
+        extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+        response_model=OtherDynamicMetadataSchema,
+    )
+    return response
+
+
+async def asituate_context_finance(
+    aclient, doc: str, chunk: str, typetext: str, type: str
+):
+    response = await aclient.chat.completions.create_with_completion(
+        model="claude-3-haiku-20240307",
+        max_tokens=4096,
+        temperature=0.0,
+        messages=_finance_messages(
+            doc, FINANCE_CHUNK_CONTEXT_PROMPT.format(chunk_content=chunk)
+        ),
+        extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+        response_model=FinanceDynamicMetadataSchema,
+    )
+    # The validation may call the LLM again, keep it off the event loop
+    validated_response = await asyncio.to_thread(
+        validate_and_process_finance_response, response[0], typetext, type
+    )
+    return [validated_response]
+
+
+async def asituate_context_finance_table(
+    aclient, doc: str, chunk: str, prev_chunk: str, typetext: str, type: str
+):
+    response = await aclient.chat.completions.create_with_completion(
+        model="claude-3-haiku-20240307",
+        max_tokens=4096,
+        temperature=0.0,
+        messages=_finance_messages(
+            doc,
+            FINANCE_TABLE_CHUNK_CONTEXT_PROMPT.format(
+                chunk_content=chunk, chunk_before_table=prev_chunk
+            ),
+        ),
+        extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+        response_model=TableValuesSchema,
+    )
+    validated_response = await asyncio.to_thread(
+        validate_and_process_finance_response, response[0], typetext, type
+    )
+    return [validated_response]
+
+
+async def asituate_context_others(
+    aclient, doc: str, chunk: str, set_of_topics: Set[str]
+):
+    response = await aclient.chat.completions.create_with_completion(
+        model="claude-3-haiku-20240307",
+        max_tokens=4096,
+        temperature=0.0,
+        messages=_others_messages(doc, chunk, set_of_topics),
         extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
         response_model=OtherDynamicMetadataSchema,
     )
     return response
 
 
+class RateLimiter:
+    """
+    Spaces out the calls made to one provider so that at most `rate` of them
+    start per second, across every thread and event loop of the process.
+    """
+
+    def __init__(self, rate: float | None):
+        self.interval = 1 / rate if rate else 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+RATE_LIMITERS = {
+    provider: RateLimiter(rate)
+    for provider, rate in CONTEXTUALIZATION_RATE_LIMITS.items()
+}
+
+
+async def call_with_backoff(provider: str, func, *args, **kwargs):
+    """
+    Call the coroutine function `func` up to `MAX_RETRIES_ANTHROPIC` times,
+    respecting the rate limit of `provider` and sleeping a random ("full
+    jitter") exponential backoff between attempts. The last error is raised.
+    """
+    for retries in range(MAX_RETRIES_ANTHROPIC):
+        await RATE_LIMITERS[provider].acquire()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            print(f"Error in generating succinct context values: {e}")
+            if retries == MAX_RETRIES_ANTHROPIC - 1:
+                raise
+            print(f"Retrying for the {retries+1} time.")
+            backoff = min(
+                CONTEXTUALIZATION_BACKOFF_MAX,
+                CONTEXTUALIZATION_BACKOFF_BASE * 2**retries,
+            )
+            await asyncio.sleep(random.uniform(0, backoff))
+
+
+# Schema of the responses stored in the near-duplicate index, by node kind
+RESPONSE_SCHEMAS = {
+    "table": TableValuesSchema,
+    "finance": FinanceDynamicMetadataSchema,
+    "others": OtherDynamicMetadataSchema,
+}
+
+
+async def acontextualize_nodes(
+    doc,
+    nodes,
+    type: str,
+    set_of_topics: Set[str],
+    near_duplicates=None,
+    company_name: str | None = None,
+    year: str | None = None,
+):
+    """
+    Generate the succinct context and topic of every node of a document, with
+    at most `CONTEXTUALIZATION_CONCURRENCY` LLM calls in flight.
+
+    Tables of finance documents get the node right before them as context,
+    exactly as when the nodes are processed one by one. Other documents see
+    the topics assigned so far when their call starts, so nodes processed
+    concurrently may not see each other's topics.
+
+    The async Anthropic client is created for this call and closed at the
+    end: its connection pool is bound to the event loop of the call, and
+    `contextualize_nodes` runs every document on a new one.
+
+    If `near_duplicates` (a `NearDuplicateIndex`) is given, nodes duplicating
+    an already contextualised chunk of the same company and document type
+    reuse its response instead of calling the LLM, and every node is assigned
+    a duplicate group. A response written for the filing of another year
+    names that filing, so only its topic, 10-K item and table values are
+    reused, with a context made for this document by
+    `make_succinct_context_for_chunk`. The topics of other documents come
+    from their own set of topics, so their nodes are always contextualised
+    by the LLM, only sharing the duplicate group.
+
+    Returns:
+        One response per node, in the order of `nodes`, or None for the nodes
+        whose context could not be generated within the retries, and the
+        duplicate group of every node (all None without `near_duplicates`).
+    """
+    anthropic_client = anthropic.AsyncAnthropic()
+    aclient = instructor.from_anthropic(anthropic_client)
+    semaphore = asyncio.Semaphore(CONTEXTUALIZATION_CONCURRENCY)
+    is_finance = type == "10-K" or type == "10-Q" or type == "Finance"
+    dup_groups = [None] * len(nodes)
+
+    async def contextualize(i, node):
+        is_table = is_finance and "table" in node.variant
+        kind = "table" if is_table else "finance" if is_finance else "others"
+
+        duplicate = None
+        if near_duplicates is not None:
+            # sqlite calls, which may wait for the lock of the other servers
+            duplicate = await asyncio.to_thread(
+                near_duplicates.find,
+                node.text,
+                is_table=is_table,
+                company_name=company_name,
+                type=type,
+                year=year,
+            )
+        response = None
+        if duplicate is not None:
+            dup_groups[i] = duplicate["dup_group"]
+            stored = duplicate["response"]
+            if stored.pop("kind") == kind and kind != "others":
+                if duplicate["year"] == (None if year is None else str(year)):
+                    response = RESPONSE_SCHEMAS[kind](**stored)
+                    set_of_topics.add(response.topic)
+                    return response
+                response = RESPONSE_SCHEMAS[kind](
+                    **{
+                        **stored,
+                        "succint_context": make_succinct_context_for_chunk(
+                            company_name, year, type, stored.get("item_10K")
+                        ),
+                    }
+                )
+
+        if response is None:
+            response = await generate(i, node, is_table)
+            if response is None:
+                return None
+        set_of_topics.add(response.topic)
+        if near_duplicates is not None:
+            dup_groups[i] = await asyncio.to_thread(
+                near_duplicates.add,
+                node.text,
+                {"kind": kind, **response.model_dump()},
+                is_table=is_table,
+                dup_group=dup_groups[i],
+                company_name=company_name,
+                type=type,
+                year=year,
+            )
+        return response
+
+    async def generate(i, node, is_table):
+        """The LLM response of a node, None if it failed within the retries."""
+        async with semaphore:
+            try:
+                if is_table:
+                    response = await call_with_backoff(
+                        "anthropic",
+                        asituate_context_finance_table,
+                        aclient,
+                        doc=doc,
+                        chunk=node.text,
+                        prev_chunk=nodes[i - 1] if i > 0 else None,
+                        typetext="table",
+                        type=type,
+                    )
+                elif is_finance:
+                    response = await call_with_backoff(
+                        "anthropic",
+                        asituate_context_finance,
+                        aclient,
+                        doc=doc,
+                        chunk=node.text,
+                        typetext="text",
+                        type=type,
+                    )
+                else:
+                    response = await call_with_backoff(
+                        "anthropic",
+                        asituate_context_others,
+                        aclient,
+                        doc=doc,
+                        chunk=node.text,
+                        set_of_topics=set(set_of_topics),
+                    )
+            except Exception:
+                print(
+                    "Max retries reached. Skipping this chunk for succinct context generation."
+                )
+                return None
+        return response[0]
+
+    try:
+        responses = await asyncio.gather(
+            *[contextualize(i, node) for i, node in enumerate(nodes)]
+        )
+    finally:
+        await anthropic_client.close()
+    return responses, dup_groups
+
+
+def contextualize_nodes(
+    doc,
+    nodes,
+    type: str,
+    set_of_topics: Set[str],
+    near_duplicates=None,
+    company_name: str | None = None,
+    year: str | None = None,
+):
+    """Blocking entry point of `acontextualize_nodes`, for the parser UDFs."""
+    return asyncio.run(
+        acontextualize_nodes(
+            doc, nodes, type, set_of_topics, near_duplicates, company_name, year
+        )
+    )
+
+
+def make_succinct_context_for_chunk(
+    company_name: str, year: str, type: str, item_10K: str | None = None
+):
+    """
+    Context of a chunk reusing the response generated for the same chunk in
+    the filing of another year, whose context names that filing.
+    """
+    context = make_succinct_context_for_value(company_name, year, type).replace(
+        "This value is from", "This chunk is from"
+    )
+    if item_10K and item_10K != "Other":
+        context += f" It is part of {item_10K}."
+    return context
+
+
 def make_succinct_context_for_value(company_name: str, year: str, type: str):
     if type == "10-K" or type == "10-Q":
         if company_name and year:
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+
+from config import (
+    NEAR_DUPLICATE_INDEX_FILE,
+    NEAR_DUPLICATE_INDEX_TIMEOUT,
+    NEAR_DUPLICATE_MIN_WORDS,
+    NEAR_DUPLICATE_THRESHOLD,
+)
+
+NUM_PERMUTATIONS = 64
+# LSH: signatures are split in bands of `ROWS_PER_BAND` values, chunks sharing
+# a band are compared. 16 bands of 4 rows find pairs of Jaccard similarity 0.8
+# with probability > 0.99 while rarely pairing chunks below 0.3.
+ROWS_PER_BAND = 4
+NUM_BANDS = NUM_PERMUTATIONS // ROWS_PER_BAND
+SHINGLE_SIZE = 3
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(42)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERMUTATIONS)
+]
+
+
+def _words(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def minhash(text: str) -> list[int]:
+    """MinHash signature of the word 3-shingles of `text`."""
+    words = _words(text)
+    shingles = {
+        int.from_bytes(
+            hashlib.blake2b(
+                " ".join(words[i : i + SHINGLE_SIZE]).encode("utf-8"), digest_size=8
+            ).digest(),
+            "big",
+        )
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    }
+    return [
+        min((a * shingle + b) % _MERSENNE_PRIME for shingle in shingles)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def similarity(signature1: list[int], signature2: list[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(x == y for x, y in zip(signature1, signature2)) / NUM_PERMUTATIONS
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(" ".join(_words(text)).encode("utf-8")).hexdigest()
+
+
+def _year(year) -> str | None:
+    return None if year is None else str(year)
+
+
+def _bands(signature: list[int]) -> list[str]:
+    return [
+        f"{i}:"
+        + hashlib.blake2b(
+            json.dumps(signature[i * ROWS_PER_BAND : (i + 1) * ROWS_PER_BAND]).encode(
+                "utf-8"
+            ),
+            digest_size=8,
+        ).hexdigest()
+        for i in range(NUM_BANDS)
+    ]
+
+
+class NearDuplicateIndex:
+    """
+    Persistent index of the chunks contextualised so far, used to find
+    near-duplicates of a new chunk (e.g. boilerplate repeated verbatim in the
+    10-Ks of consecutive years) and reuse the LLM response generated for it.
+
+    Chunks are near-duplicates when the Jaccard similarity of their word
+    3-shingles, estimated with MinHash, is at least `NEAR_DUPLICATE_THRESHOLD`.
+    Tables must match exactly (up to whitespace and case), as near-identical
+    tables usually differ in their values. Chunks shorter than
+    `NEAR_DUPLICATE_MIN_WORDS` words are never deduplicated.
+
+    Every chunk gets a group id, shared by all of its near-duplicates, which is
+    stored in the `dup_group` metadata so that retrieval can collapse them.
+
+    Chunks are stored with the company, document type and year of their
+    document, and only match the chunks of the same company and type: the
+    response of a chunk situates it in its own filing, see
+    `acontextualize_nodes` for the reuse across years.
+
+    The database is shared by the server processes, in WAL mode. A database
+    error (e.g. still locked after `timeout` seconds) is logged and treated
+    as no duplicate, or the chunk is not stored, so that the index never
+    fails the ingestion of a document.
+    """
+
+    def __init__(
+        self,
+        db_file: str = NEAR_DUPLICATE_INDEX_FILE,
+        threshold: float = NEAR_DUPLICATE_THRESHOLD,
+        min_words: int = NEAR_DUPLICATE_MIN_WORDS,
+        timeout: float = NEAR_DUPLICATE_INDEX_TIMEOUT,
+    ):
+        self.threshold = threshold
+        self.min_words = min_words
+        self._lock = threading.Lock()
+        if os.path.dirname(db_file):
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self._conn = sqlite3.connect(
+            db_file, timeout=timeout, check_same_thread=False
+        )
+        # Readers do not block the writer of another process
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dup_group TEXT,
+                text_hash TEXT,
+                is_table INTEGER,
+                signature TEXT,
+                response TEXT,
+                company_name TEXT,
+                type TEXT,
+                year TEXT
+            )
+            """
+        )
+        # Indexes created before the chunks were scoped to their document
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        for column in ("company_name", "type", "year"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} TEXT")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bands (band TEXT, chunk_id INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_band ON bands (band)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS chunks_text_hash ON chunks (text_hash)"
+        )
+        self._conn.commit()
+
+    def find(
+        self,
+        text: str,
+        is_table: bool = False,
+        company_name: str | None = None,
+        type: str | None = None,
+        year: str | None = None,
+    ) -> dict | None:
+        """
+        The stored chunk of the same company and document type that `text`
+        duplicates, as a dict with its `dup_group`, the `response` stored for
+        it and the `year` of its document, or None. An exact copy from the
+        same `year` is preferred.
+        """
+        if len(_words(text)) < self.min_words:
+            return None
+        try:
+            return self._find(text, is_table, company_name, type, year)
+        except sqlite3.Error as e:
+            print(f"Error looking up the near-duplicates of a chunk: {e}")
+            return None
+
+    def _find(self, text, is_table, company_name, type, year) -> dict | None:
+        year = _year(year)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dup_group, response, year FROM chunks WHERE text_hash = ? "
+                "AND company_name IS ? AND type IS ? ORDER BY year IS ? DESC LIMIT 1",
+                (text_hash(text), company_name, type, year),
+            ).fetchone()
+        if row is not None:
+            return {
+                "dup_group": row[0],
+                "response": json.loads(row[1]),
+                "year": row[2],
+            }
+        if is_table:
+            return None
+
+        signature = minhash(text)
+        bands = _bands(signature)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT chunks.id, chunks.dup_group, chunks.signature, "
+                "chunks.response, chunks.year FROM bands "
+                "JOIN chunks ON chunks.id = bands.chunk_id "
+                "WHERE chunks.is_table = 0 AND chunks.company_name IS ? "
+                "AND chunks.type IS ? AND bands.band IN ("
+                + ", ".join("?" * len(bands))
+                + ")",
+                [company_name, type, *bands],
+            ).fetchall()
+
+        best = None
+        best_similarity = self.threshold
+        for _, dup_group, other, response, other_year in rows:
+            score = similarity(signature, json.loads(other))
+            if score >= best_similarity:
+                best = {
+                    "dup_group": dup_group,
+                    "response": json.loads(response),
+                    "year": other_year,
+                }
+                best_similarity = score
+        return best
+
+    def add(
+        self,
+        text: str,
+        response: dict,
+        is_table: bool = False,
+        dup_group: str | None = None,
+        company_name: str | None = None,
+        type: str | None = None,
+        year: str | None = None,
+    ) -> str:
+        """
+        Store a chunk and its response with the company, type and year of
+        its document, returning its group id. A copy of a chunk already stored
+        in the group for the same document is not stored again, so that
+        re-ingesting a filing does not grow the index.
+        """
+        if dup_group is None:
+            dup_group = text_hash(text)[:16]
+        if len(_words(text)) < self.min_words:
+            return dup_group
+        signature = minhash(text)
+        with self._lock:
+            try:
+                self._insert(
+                    text,
+                    response,
+                    is_table,
+                    dup_group,
+                    company_name,
+                    type,
+                    year,
+                    signature,
+                )
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                print(f"Error storing a chunk in the near-duplicate index: {e}")
+        return dup_group
+
+    def _insert(
+        self, text, response, is_table, dup_group, company_name, type, year, signature
+    ) -> None:
+        stored = self._conn.execute(
+            "SELECT 1 FROM chunks WHERE text_hash = ? AND dup_group = ? "
+            "AND company_name IS ? AND type IS ? AND year IS ? LIMIT 1",
+            (text_hash(text), dup_group, company_name, type, _year(year)),
+        ).fetchone()
+        if stored is not None:
+            return
+        cursor = self._conn.execute(
+            "INSERT INTO chunks (dup_group, text_hash, is_table, signature, "
+            "response, company_name, type, year) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                dup_group,
+                text_hash(text),
+                int(is_table),
+                json.dumps(signature),
+                json.dumps(response),
+                company_name,
+                type,
+                _year(year),
+            ),
+        )
+        self._conn.executemany(
+            "INSERT INTO bands VALUES (?, ?)",
+            [(band, cursor.lastrowid) for band in _bands(signature)],
+        )
+        self._conn.commit()
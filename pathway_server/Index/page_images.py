@@ -0,0 +1,130 @@
+import base64
+import io
+from collections import OrderedDict
+
+from PIL import Image
+
+from config import PAGE_RASTER_CACHE_MAX_PAGES
+
+
+class PageRasterCache:
+    """
+    Renders the pages of one PDF document lazily and at most once.
+
+    The PyMuPDF conversion of the document and the bitmap of every page are
+    kept until `clear` is called (or the `with` block exits), so extracting the
+    images of many nodes of the same page only crops the cached bitmap.
+
+    Usage:
+        with PageRasterCache(doc) as pages:
+            image = extract_node_image(doc, node, pages)
+    """
+
+    def __init__(self, doc, max_pages: int | None = PAGE_RASTER_CACHE_MAX_PAGES):
+        self.doc = doc
+        self.max_pages = max_pages
+        self._pdoc = None
+        self._pages: OrderedDict = OrderedDict()
+        self._encoded_pages: dict = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.clear()
+
+    def get_page(self, page_num: int) -> Image.Image:
+        """Bitmap of page `page_num`, rendered on first use."""
+        if page_num in self._pages:
+            self._pages.move_to_end(page_num)
+            return self._pages[page_num]
+
+        if self._pdoc is None:
+            self._pdoc = self.doc.to_pymupdf_doc()
+        pix = self._pdoc[page_num].get_pixmap()
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+        self._pages[page_num] = img
+        if self.max_pages is not None and len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return img
+
+    def page_image(self, page_num: int) -> str:
+        """Base64 encoded PNG of the whole page."""
+        if page_num not in self._encoded_pages:
+            self._encoded_pages[page_num] = encode_image(self.get_page(page_num))
+        return self._encoded_pages[page_num]
+
+    def node_image(self, page_num: int, bbox) -> str:
+        """Base64 encoded PNG of `bbox` cropped from the page."""
+        # Note: PyMuPDF and PIL might have slightly different coordinate systems
+        cropped_img = self.get_page(page_num).crop(
+            (int(bbox.x0), int(bbox.y0), int(bbox.x1), int(bbox.y1))
+        )
+        return encode_image(cropped_img)
+
+    def clear(self):
+        self._pages.clear()
+        self._encoded_pages.clear()
+        self._pdoc = None
+
+
+def encode_image(img: Image.Image) -> str:
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def extract_page_image(doc, node, pages: PageRasterCache | None = None):
+    """
+    Extract the full page image containing the specified node from the PDF.
+
+    Args:
+        doc (openparse.Pdf): The PDF document
+        node (Node): The node used to identify the page
+        pages (PageRasterCache): Rendered pages of `doc`, a temporary cache is
+            used if not given
+
+    Returns:
+        str: Base64 encoded full page image, or None if extraction fails
+    """
+    try:
+        # Check if node has bbox and elements
+        if not node.elements or not node.elements[0].bbox:
+            return None
+
+        if pages is None:
+            pages = PageRasterCache(doc)
+        return pages.page_image(node.elements[0].bbox.page)
+
+    except Exception as e:
+        print(f"Error extracting page image: {e}")
+        return None
+
+
+def extract_node_image(doc, node, pages: PageRasterCache | None = None):
+    """
+    Extract the image for a specific node using its bounding box from the PDF.
+
+    Args:
+        doc (openparse.Pdf): The PDF document
+        node (Node): The node to extract the image for
+        pages (PageRasterCache): Rendered pages of `doc`, a temporary cache is
+            used if not given
+
+    Returns:
+        str: Base64 encoded image of the node, or None if extraction fails
+    """
+    try:
+        # Check if node has bbox and elements
+        if not node.elements or not node.elements[0].bbox:
+            return None
+
+        if pages is None:
+            pages = PageRasterCache(doc)
+        bbox = node.elements[0].bbox
+        return pages.node_image(bbox.page, bbox)
+
+    except Exception as e:
+        print(f"Error extracting node image: {e}")
+        return None
@@ -11,6 +11,9 @@ from pathway.xpacks.llm.vector_store import VectorStoreServer
 import openparse
 from pypdf import PdfReader
 from .static_metadata import *
+from .batch_embedders import Bge_m3_embedder, VoyageEmbedder
+from .page_images import PageRasterCache, extract_node_image, extract_page_image
+from image_store import image_store
 import json
 from openai import OpenAI
 from FlagEmbedding import BGEM3FlagModel
@@ -29,90 +32,6 @@ db.reset_database()
 client = OpenAI()
 llm = ChatOpenAI(model="gpt-4o")
 
-class VoyageEmbedder(embedders.OpenAIEmbedder):
-    """Pathway wrapper for Voyage AI Embedding services."""
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    async def __wrapped__(self, input, **kwargs) -> np.ndarray:
-        """Embed the documents
-
-        Args:
-            - input: mandatory, the string to embed.
-            - **kwargs: optional parameters, if unset defaults from the constructor
-              will be taken.
-        """
-        kwargs = {**self.kwargs, **kwargs}
-        vo = voyageai.Client(api_key=os.getenv("VOYAGE_API_KEY"))   
-        ret = vo.embed([input or "."], model="voyage-3", input_type="document")
-        return np.array(ret.embeddings[0])
-
-class Bge_m3_embedder(embedders.OpenAIEmbedder):
-    """
-    Custom Pathway embedder for BGE-M3 model with flexible embedding handling.
-    
-    Key Considerations:
-    - Ensures compatibility with Pathway's vector store
-    - Handles various input scenarios
-    - Provides flexible embedding output
-    """
-    
-    def __init__(self, 
-                 model_name='BAAI/bge-m3', 
-                 *args, 
-                 **kwargs):
-        """
-        Initialize the BGE-M3 embedder.
-        
-        Args:
-            model_name (str): Hugging Face model identifier
-            *args: Additional positional arguments for OpenAIEmbedder
-            **kwargs: Additional keyword arguments for OpenAIEmbedder
-        """
-        super().__init__(*args, **kwargs)
-        
-        # Load BGE-M3 model
-        self.bgem3_model = BGEM3FlagModel(
-            model_name,
-            use_fp16=torch.cuda.is_available()  # Use FP16 if CUDA available
-        )
-
-    async def __wrapped__(self, input, **kwargs) -> np.ndarray:
-        """
-        Embed input text with flexible handling.
-        
-        Args:
-            input (str): Text to embed
-            **kwargs: Additional embedding parameters
-        
-        Returns:
-            np.ndarray: Embedding vector
-        """
-        # Handle empty or whitespace inputs
-        if not input or input.isspace():
-            input = "."
-        
-        try:
-            # Encode input with dense vector return
-            embeddings_dict = self.bgem3_model.encode(
-                [input], 
-                return_dense=True
-            )
-            
-            # Extract dense vector and ensure correct type
-            embedding = embeddings_dict['dense_vecs'][0]
-            
-            # Convert to float32 numpy array
-            embedding_array = np.array(embedding, dtype=np.float32)
-            
-            return embedding_array
-        
-        except Exception as e:
-            print(f"Embedding error: {e}")
-            # Return None or raise the exception based on your error handling preference
-            raise
-
 def make_succinct_context_for_value(company_name: str, year: str, type: str):
     if type == "10-K" or type == "10-Q":
         if company_name and year:
@@ -133,99 +52,6 @@ def make_succinct_context_for_value(company_name: str, year: str, type: str):
         else:
             return "This value is from a finance-related document."
 
-def extract_page_image(doc, node):
-    """
-    Extract the full page image containing the specified node from the PDF.
-    
-    Args:
-        doc (openparse.Pdf): The PDF document
-        node (Node): The node used to identify the page
-    
-    Returns:
-        str: Base64 encoded full page image, or None if extraction fails
-    """
-    try:
-        # Convert to PyMuPDF document if not already done
-        pdoc = doc.to_pymupdf_doc()
-        
-        # Check if node has bbox and elements
-        if not node.elements or not node.elements[0].bbox:
-            return None
-        
-        # Get the page number from the first element's bbox
-        page_num = node.elements[0].bbox.page
-        
-        # Extract the full page
-        page = pdoc[page_num]
-        
-        # Render full page as pixmap
-        pix = page.get_pixmap()
-        
-        # Convert to PIL Image
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        
-        # Convert to base64
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
-    
-    except Exception as e:
-        print(f"Error extracting page image: {e}")
-        return None
-    
-def extract_node_image(doc, node):
-    """
-    Extract the image for a specific node using its bounding box from the PDF.
-    
-    Args:
-        doc (openparse.Pdf): The PDF document
-        node (Node): The node to extract the image for
-    
-    Returns:
-        str: Base64 encoded image of the node, or None if extraction fails
-    """
-    try:
-        # Convert to PyMuPDF document if not already done
-        pdoc = doc.to_pymupdf_doc()
-        
-        # Check if node has bbox and elements
-        if not node.elements or not node.elements[0].bbox:
-            return None
-        
-        # Get the page number from the first element's bbox
-        page_num = node.elements[0].bbox.page
-        
-        # Extract the full page
-        page = pdoc[page_num]
-        
-        # Get the bounding box coordinates
-        bbox = node.elements[0].bbox
-        
-        # Render full page as pixmap
-        pix = page.get_pixmap()
-        
-        # Convert to PIL Image
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        
-        # Crop the image based on bbox
-        # Note: PyMuPDF and PIL might have slightly different coordinate systems
-        # Adjust coordinates if needed
-        cropped_img = img.crop((
-            int(bbox.x0), 
-            int(bbox.y0), 
-            int(bbox.x1), 
-            int(bbox.y1)
-        ))
-        
-        # Convert to base64
-        buffered = io.BytesIO()
-        cropped_img.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
-    
-    except Exception as e:
-        print(f"Error extracting node image: {e}")
-        return None
-
 Whole_chunk = """You are a values extractor and describer
 You are given an image of a page from a 10-K document. You need to find out Table name, row name, column name, and the value of each and every cell in the each table(s)(if present) in the image and describe each and every value in the KeyValueSchema format.
 
@@ -305,6 +131,9 @@ class CustomOpenParse(OpenParse):
         key_val_docs = []
 
         queried_pages = set()
+
+        # every page is rendered once and dropped when the document is done
+        pages = PageRasterCache(doc)
         
         
         
@@ -314,7 +143,7 @@ class CustomOpenParse(OpenParse):
             # TABLE VALUE EXTRACTION
             for node in nodes:
                 if "table" in node.variant and node.bbox[0].page not in queried_pages:
-                    base64_image = extract_page_image(doc, node)
+                    base64_image = extract_page_image(doc, node, pages)
                     if base64_image is not None:
                         response = client.beta.chat.completions.parse(
                           model="gpt-4o",
@@ -340,6 +169,8 @@ class CustomOpenParse(OpenParse):
                         if response.choices[0].message.parsed:
                             keyvals = response.choices[0].message.parsed.listofstr
                             if keyvals:
+                                # metadata only keeps the reference of the page image
+                                image_ref = image_store.put_base64(base64_image)
                                 key_val_docs.extend([
                                     (
                                         make_succinct_context_for_value(company_name, year, type) + " " + key_value,
@@ -352,7 +183,7 @@ class CustomOpenParse(OpenParse):
                                             "item_10K": "Other",
                                             "is_table_value": "True",
                                             "table": "True",
-                                            "image": base64_image,
+                                            "image": image_ref,
                                             "page_no": node.bbox[0].page if len(node.bbox) > 0 else -1,
                                         },
                                     )
@@ -375,7 +206,9 @@ class CustomOpenParse(OpenParse):
                                 "item_10K": "Other",
                                 "is_table_value": "False",
                                 "table": "True" if "table" in node.variant else "False",
-                                "image": extract_node_image(doc, node),
+                                "image": image_store.put_base64(
+                                    extract_node_image(doc, node, pages)
+                                ),
                                 "page_no": node.bbox[0].page if len(node.bbox) > 0 else -1,
                             },
                         )
@@ -395,12 +228,16 @@ class CustomOpenParse(OpenParse):
                                 "item_10K": None,
                                 "is_table_value": "False",
                                 "table": "True" if "table" in node.variant else "False",
-                                "image": extract_node_image(doc, node),
+                                "image": image_store.put_base64(
+                                    extract_node_image(doc, node, pages)
+                                ),
                                 "page_no": node.bbox[0].page if len(node.bbox) > 0 else -1,
                             },
                         )
                     )
 
+        pages.clear()
+
         # write to database, if error occurs then just move on 
         report = {
             'company_name': company_name, 
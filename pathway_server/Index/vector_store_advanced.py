@@ -13,6 +13,11 @@ import openparse
 from pypdf import PdfReader
 from .static_metadata import *
 from .dynamic_metadata import *
+from .batch_embedders import Bge_m3_embedder, VoyageEmbedder
+from .near_duplicates import NearDuplicateIndex
+from .page_images import PageRasterCache, extract_node_image
+from image_store import image_store
+from ingest_manifest import get_parser_version, ingest_manifest
 import voyageai
 import numpy as np
 import base64
@@ -24,142 +29,7 @@ import torch
 db = FinancialDatabase()
 db.reset_database()
 
-class VoyageEmbedder(embedders.OpenAIEmbedder):
-    """Pathway wrapper for Voyage AI Embedding services."""
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    async def __wrapped__(self, input, **kwargs) -> np.ndarray:
-        """Embed the documents
-
-        Args:
-            - input: mandatory, the string to embed.
-            - **kwargs: optional parameters, if unset defaults from the constructor
-              will be taken.
-        """
-        kwargs = {**self.kwargs, **kwargs}
-        vo = voyageai.Client(api_key=os.getenv("VOYAGE_API_KEY"))   
-        ret = vo.embed([input or "."], model="voyage-3", input_type="document")
-        return np.array(ret.embeddings[0])
-
-class Bge_m3_embedder(embedders.OpenAIEmbedder):
-    """
-    Custom Pathway embedder for BGE-M3 model with flexible embedding handling.
-    
-    Key Considerations:
-    - Ensures compatibility with Pathway's vector store
-    - Handles various input scenarios
-    - Provides flexible embedding output
-    """
-    
-    def __init__(self, 
-                 model_name='BAAI/bge-m3', 
-                 *args, 
-                 **kwargs):
-        """
-        Initialize the BGE-M3 embedder.
-        
-        Args:
-            model_name (str): Hugging Face model identifier
-            *args: Additional positional arguments for OpenAIEmbedder
-            **kwargs: Additional keyword arguments for OpenAIEmbedder
-        """
-        super().__init__(*args, **kwargs)
-        
-        # Load BGE-M3 model
-        self.bgem3_model = BGEM3FlagModel(
-            model_name,
-            use_fp16=torch.cuda.is_available()  # Use FP16 if CUDA available
-        )
-
-    async def __wrapped__(self, input, **kwargs) -> np.ndarray:
-        """
-        Embed input text with flexible handling.
-        
-        Args:
-            input (str): Text to embed
-            **kwargs: Additional embedding parameters
-        
-        Returns:
-            np.ndarray: Embedding vector
-        """
-        # Handle empty or whitespace inputs
-        if not input or input.isspace():
-            input = "."
-        
-        try:
-            # Encode input with dense vector return
-            embeddings_dict = self.bgem3_model.encode(
-                [input], 
-                return_dense=True
-            )
-            
-            # Extract dense vector and ensure correct type
-            embedding = embeddings_dict['dense_vecs'][0]
-            
-            # Convert to float32 numpy array
-            embedding_array = np.array(embedding, dtype=np.float32)
-            
-            return embedding_array
-        
-        except Exception as e:
-            print(f"Embedding error: {e}")
-            # Return None or raise the exception based on your error handling preference
-            raise
-  
-def extract_node_image(doc, node):
-    """
-    Extract the image for a specific node using its bounding box from the PDF.
-    
-    Args:
-        doc (openparse.Pdf): The PDF document
-        node (Node): The node to extract the image for
-    
-    Returns:
-        str: Base64 encoded image of the node, or None if extraction fails
-    """
-    try:
-        # Convert to PyMuPDF document if not already done
-        pdoc = doc.to_pymupdf_doc()
-        
-        # Check if node has bbox and elements
-        if not node.elements or not node.elements[0].bbox:
-            return None
-        
-        # Get the page number from the first element's bbox
-        page_num = node.elements[0].bbox.page
-        
-        # Extract the full page
-        page = pdoc[page_num]
-        
-        # Get the bounding box coordinates
-        bbox = node.elements[0].bbox
-        
-        # Render full page as pixmap
-        pix = page.get_pixmap()
-        
-        # Convert to PIL Image
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        
-        # Crop the image based on bbox
-        # Note: PyMuPDF and PIL might have slightly different coordinate systems
-        # Adjust coordinates if needed
-        cropped_img = img.crop((
-            int(bbox.x0), 
-            int(bbox.y0), 
-            int(bbox.x1), 
-            int(bbox.y1)
-        ))
-        
-        # Convert to base64
-        buffered = io.BytesIO()
-        cropped_img.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
-    
-    except Exception as e:
-        print(f"Error extracting node image: {e}")
-        return None
+near_duplicates = NearDuplicateIndex() if NEAR_DUPLICATE_DETECTION else None
 
 Whole_chunk = """You are a values extractor and describer
 You are given an image of a page from a 10-K document. You need to find out Table name, row name, column name, and the value of each and every cell in the each table(s)(if present) in the image and describe each and every value in the KeyValueSchema format.
@@ -216,11 +86,43 @@ class CustomOpenParse(OpenParse):
     Custom OpenParse class with modified __wrapped__ behavior.
     """
 
+    # Identifies the parser in the ingest manifest, see `get_parser_version`
+    parser_name = "open_parse_contextualized"
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.parser_version = get_parser_version(
+            type(self),
+            kwargs,
+            DOCUMENT_CONTEXT_PROMPT,
+            GLOBAL_SET_OF_FINANCE_TERMS_PROMPT,
+            FINANCE_CHUNK_CONTEXT_PROMPT,
+            FINANCE_TABLE_CHUNK_CONTEXT_PROMPT,
+            SET_OF_TERMS_USED_TILL_NOW,
+            OTHER_CHUNK_CONTEXT_PROMPT,
+        )
+
+    def insert_report(self, report):
+        # write to database, if error occurs then just move on
+        try:
+            db.insert_report(report)
+        except:
+            print("=============================================")
+            print("Error in inserting the report in the database.")
+            print("=============================================")
+            print("Report: ", report)
+            pass
 
     def __wrapped__(self, contents: bytes) -> list[tuple[str, dict]]:
 
+        # Reuse the chunks of an identical file parsed before, by any server.
+        # The report still goes to the database, which is reset on startup.
+        entry = ingest_manifest.get(contents, self.parser_version)
+        if entry is not None:
+            report = entry["report"]
+            self.insert_report({**report, "topics": set(report["topics"])})
+            return entry["docs"]
+
         reader = PdfReader(stream=BytesIO(contents))
         doc = openparse.Pdf(file=reader)
 
@@ -240,223 +142,67 @@ class CustomOpenParse(OpenParse):
         # list for storing all the key value pairs extracted from the document
         key_val_docs = []
 
-        # Extract the dynamic metadata from the document
-        if type == "10-K" or type == "10-Q" or type == "Finance":
-            prev_node = None
-            for node in nodes:
-                if "table" in node.variant:
-                    for retries in range(MAX_RETRIES_ANTHROPIC):
-                        try:
-                            response = situate_context_finance_table(
-                                doc=doc,
-                                chunk=node.text,
-                                prev_chunk=prev_node,
-                                typetext="table",
-                                type=type,
-                            )
-                            response = response[0]
-                            set_of_topics.add(response.topic)
-                            key_vals = [
-                                (
-                                    make_succinct_context_for_value(
-                                        company_name, year, type
-                                    )
-                                    + " "
-                                    + key_value,
-                                    {
-                                        "type": type,
-                                        "company_name": company_name,
-                                        "year": year,
-                                        "quarter": quarter,
-                                        "topic": response.topic,
-                                        "item_10K": response.item_10K,
-                                        "is_table_value": "True",
-                                        "table": "True",
-                                        "image": extract_node_image(doc, node),
-                                        "page_no": (
-                                            node.bbox[0].page
-                                            if len(node.bbox) > 0
-                                            else -1
-                                        ),
-                                    },
-                                )
-                                for key_value in response.listofstr
-                            ]
-                            key_val_docs.extend(key_vals)
-                            docs.append(
-                                (
-                                    response.succint_context + " " + node.text,
-                                    {
-                                        "type": type,
-                                        "company_name": company_name,
-                                        "year": year,
-                                        "quarter": quarter,
-                                        "topic": response.topic,
-                                        "item_10K": response.item_10K,
-                                        "is_table_value": "False",
-                                        "table": "True",
-                                        "image": extract_node_image(doc, node),
-                                        "page_no": (
-                                            node.bbox[0].page
-                                            if len(node.bbox) > 0
-                                            else -1
-                                        ),
-                                    },
-                                )
-                            )
-                            break
-                        except Exception as e:
-                            print(f"Error in extracting table values: {e}")
-                            print(f"Retrying for the {retries+1} time.")
-                            if retries == MAX_RETRIES_ANTHROPIC - 1:
-                                print(
-                                    "Max retries reached. Skipping this chunk for Succinct context extraction."
-                                )
-                                docs.append(
-                                    (
-                                        node.text,
-                                        {
-                                            "type": type,
-                                            "company_name": company_name,
-                                            "year": year,
-                                            "quarter": quarter,
-                                            "topic": "Other",
-                                            "item_10K": "Other",
-                                            "is_table_value": "False",
-                                            "table": "True",
-                                            "image": extract_node_image(doc, node),
-                                            "page_no": (
-                                                node.bbox[0].page
-                                                if len(node.bbox) > 0
-                                                else -1
-                                            ),
-                                        },
-                                    )
-                                )
-                                break
-                            continue
-                else:
-                    for retries in range(MAX_RETRIES_ANTHROPIC):
-                        try:
-                            response = situate_context_finance(
-                                doc=doc, chunk=node.text, typetext="text", type=type
-                            )
-                            response = response[0]
-                            set_of_topics.add(response.topic)
-                            docs.append(
-                                (
-                                    response.succint_context + " " + node.text,
-                                    {
-                                        "type": type,
-                                        "company_name": company_name,
-                                        "year": year,
-                                        "quarter": quarter,
-                                        "topic": response.topic,
-                                        "item_10K": response.item_10K,
-                                        "is_table_value": "False",
-                                        "table": "False",
-                                        "image": extract_node_image(doc, node),
-                                        "page_no": (
-                                            node.bbox[0].page
-                                            if len(node.bbox) > 0
-                                            else -1
-                                        ),
-                                    },
-                                )
-                            )
-                            break
-                        except Exception as e:
-                            print(f"Error in generating succinct context values: {e}")
-                            print(f"Retrying for the {retries+1} time.")
-                            if retries == MAX_RETRIES_ANTHROPIC - 1:
-                                print(
-                                    "Max retries reached. Skipping this chunk for succinct context generation."
-                                )
-                                docs.append(
-                                    (
-                                        node.text,
-                                        {
-                                            "type": type,
-                                            "company_name": company_name,
-                                            "year": year,
-                                            "quarter": quarter,
-                                            "topic": "Other",
-                                            "item_10K": "Other",
-                                            "is_table_value": "False",
-                                            "table": "False",
-                                            "image": extract_node_image(doc, node),
-                                            "page_no": (
-                                                node.bbox[0].page
-                                                if len(node.bbox) > 0
-                                                else -1
-                                            ),
-                                        },
-                                    )
-                                )
-                                break
-                            continue
-                prev_node = node
-        else:
-            for node in nodes:
-                for retries in range(MAX_RETRIES_ANTHROPIC):
-                    try:
-                        response = situate_context_others(
-                            doc=doc, chunk=node.text, set_of_topics=set_of_topics
-                        )
-                        response = response[0]
-                        set_of_topics.add(response.topic)
-                        docs.append(
-                            (
-                                response.succint_context + " " + node.text,
-                                {
-                                    "type": type,
-                                    "company_name": company_name,
-                                    "year": year,
-                                    "quarter": quarter,
-                                    "topic": response.topic,
-                                    "item_10K": None,
-                                    "is_table_value": "False",
-                                    "table": "False",
-                                    "image": extract_node_image(doc, node),
-                                    "page_no": (
-                                        node.bbox[0].page if len(node.bbox) > 0 else -1
-                                    ),
-                                },
-                            )
-                        )
-                        break
-                    except Exception as e:
-                        print(f"Error in generating succinct context values: {e}")
-                        print(f"Retrying for the {retries+1} time.")
-                        if retries == MAX_RETRIES_ANTHROPIC - 1:
-                            print(
-                                "Max retries reached. Skipping this chunk for succinct context generation."
-                            )
-                            docs.append(
-                                (
-                                    node.text,
-                                    {
-                                        "type": type,
-                                        "company_name": company_name,
-                                        "year": year,
-                                        "quarter": quarter,
-                                        "topic": "Other",
-                                        "item_10K": None,
-                                        "is_table_value": "False",
-                                        "table": "False",
-                                        "image": extract_node_image(doc, node),
-                                        "page_no": (
-                                            node.bbox[0].page
-                                            if len(node.bbox) > 0
-                                            else -1
-                                        ),
-                                    },
-                                )
-                            )
-                            break
-                        continue
+        # Extract the dynamic metadata from the document, all the nodes being
+        # contextualised concurrently. `responses[i]` is None if the context
+        # of `nodes[i]` could not be generated.
+        is_finance = type == "10-K" or type == "10-Q" or type == "Finance"
+        responses, dup_groups = contextualize_nodes(
+            doc,
+            nodes,
+            type,
+            set_of_topics,
+            near_duplicates,
+            company_name=company_name,
+            year=year,
+        )
+
+        # every page is rendered once and dropped when the document is done
+        pages = PageRasterCache(doc)
+        for node, response, dup_group in zip(nodes, responses, dup_groups):
+            is_table = is_finance and "table" in node.variant
+            metadata = {
+                "type": type,
+                "company_name": company_name,
+                "year": year,
+                "quarter": quarter,
+                "topic": "Other" if response is None else response.topic,
+                "item_10K": None,
+                "is_table_value": "False",
+                "table": "True" if is_table else "False",
+                # the image itself goes to the image store, see `image_store`
+                "image": image_store.put_base64(extract_node_image(doc, node, pages)),
+                "page_no": node.bbox[0].page if len(node.bbox) > 0 else -1,
+                # shared with the near-duplicates of this chunk in other filings
+                "dup_group": dup_group,
+            }
+            if is_finance:
+                metadata["item_10K"] = (
+                    "Other" if response is None else response.item_10K
+                )
+
+            if response is None:
+                docs.append((node.text, metadata))
+                continue
+
+            docs.append((response.succint_context + " " + node.text, metadata))
+            if is_table:
+                key_val_docs.extend(
+                    (
+                        make_succinct_context_for_value(company_name, year, type)
+                        + " "
+                        + key_value,
+                        {
+                            **metadata,
+                            "is_table_value": "True",
+                            "dup_group": (
+                                None if dup_group is None else f"{dup_group}:{j}"
+                            ),
+                        },
+                    )
+                    for j, key_value in enumerate(response.listofstr)
+                )
+        pages.clear()
 
-        # write to database, if error occurs then just move on
         report = {
             "company_name": company_name,
             "year": year,
@@ -464,18 +210,17 @@ class CustomOpenParse(OpenParse):
             "type": type,
             "topics": set_of_topics,
         }
-        try:
-            db.insert_report(report)
-        except:
-            print("=============================================")
-            print("Error in inserting the report in the database.")
-            print("=============================================")
-            print("Report: ", report)
-            pass
+        self.insert_report(report)
 
         # concat docs with key_val_docs
         docs.extend(key_val_docs)
 
+        ingest_manifest.put(
+            contents,
+            self.parser_version,
+            {"docs": docs, "report": {**report, "topics": sorted(set_of_topics)}},
+        )
+
         # COMMENT OUT TO SEE THE CHUNKS IN A SEPERATE JSON FILE
 
         # json_data = [{"label": item[0], "data": item[1]} for item in docs]
@@ -3,12 +3,95 @@ from langchain.callbacks.tracers import ConsoleCallbackHandler
 
 INITIAL_MODEL_PROVIDER = "openai"
 
+# On-disk cache of the structured LLM responses of the call sites that opt in
+# with `llm.with_cache(call_site)`. Entries expire after the TTL (seconds) of
+# their call site, the least recently used are evicted above MAX_ENTRIES.
+LLM_RESPONSE_CACHE = True
+LLM_RESPONSE_CACHE_FILE = "MultiCache/llm_responses.db"
+LLM_RESPONSE_CACHE_MAX_ENTRIES = 100000
+# Seconds to wait for the lock of the database shared by the server processes
+LLM_RESPONSE_CACHE_TIMEOUT = 5.0
+# A hit only updates the last access time (for the LRU eviction) once it is
+# older than this many seconds, and the size is checked every N insertions,
+# so that hits and insertions rarely write or scan the database
+LLM_RESPONSE_CACHE_ACCESS_RESOLUTION = 300
+LLM_RESPONSE_CACHE_EVICTION_INTERVAL = 100
+LLM_RESPONSE_CACHE_TTLS = {
+    "default": 24 * 3600,
+    "check_safety": 7 * 24 * 3600,
+    "split_path_decider_1": 7 * 24 * 3600,
+    "split_path_decider_2": 7 * 24 * 3600,
+    # the prompt lists the companies in the database, so new filings change the key
+    "extract_metadata": 24 * 3600,
+    "document_grader": 24 * 3600,
+    "question_decomposer_v5": 24 * 3600,
+}
+
+# Health of the LLM providers (llm/provider_health.py). Error rate and latency
+# are moving averages with weight ALPHA for the latest call. A provider backs
+# off after FAILURES_BEFORE_BACKOFF consecutive failures or a rate limit, for
+# BACKOFF_BASE seconds doubled at every failed probe (up to BACKOFF_MAX); the
+# providers backing off are probed every PROBE_INTERVAL seconds.
+LLM_HEALTH_EWMA_ALPHA = 0.2
+LLM_HEALTH_MAX_ERROR_RATE = 0.5  # above, the provider is tried after the healthy ones
+LLM_HEALTH_SLOW_LATENCY = 30  # seconds, above the provider is tried after the healthy ones
+LLM_HEALTH_FAILURES_BEFORE_BACKOFF = 3
+LLM_HEALTH_BACKOFF_BASE = 10
+LLM_HEALTH_BACKOFF_MAX = 300
+LLM_HEALTH_PROBE_INTERVAL = 5
+
+# Identical LLM calls (provider, schema, prompt) in flight at the same time share
+# one upstream call (llm/single_flight.py)
+LLM_SINGLE_FLIGHT = True
+
+# Token budget of the retrieved context put in the prompt of each call site
+# (context_packer.py). Items overlapping a more relevant one on more than
+# OVERLAP_THRESHOLD of their word 5-grams are dropped.
+CONTEXT_TOKEN_ENCODING = "o200k_base"  # tokenizer of gpt-4o-mini
+CONTEXT_TOKEN_BUDGETS = {
+    "default": 8000,
+    "generate_answer_with_citation_state": 12000,
+    "combine_answer_v3": 6000,
+}
+CONTEXT_OVERLAP_THRESHOLD = 0.8
+
 BASE_DATA_DIRECTORY = "MultiData/base_data"
 
 VECTOR_STORE_HOST = "127.0.0.1"
 VECTOR_STORE_PORT = 7000
 VECTOR_STORE_TIMEOUT = 30
 
+# Keep-alive connection pool shared by all vector store clients
+VECTOR_STORE_POOL_CONNECTIONS = 10  # number of hosts to keep pools for
+VECTOR_STORE_POOL_MAXSIZE = 32  # max connections kept open per host
+VECTOR_STORE_POOL_BLOCK = False  # block instead of opening extra connections
+# Max concurrent connections of the asyncio retrieval client (per event loop)
+ASYNC_VECTOR_STORE_CONNECTION_LIMIT = 256
+# Circuit breaker of the vector and cache stores: open after that many
+# consecutive failures, then let probe requests through after the timeout
+VECTOR_STORE_CIRCUIT_BREAKER_FAILURES = 3
+VECTOR_STORE_CIRCUIT_BREAKER_RESET_TIMEOUT = 30  # seconds
+VECTOR_STORE_CIRCUIT_BREAKER_PROBES = 1
+# In-process cache of retrieval results, invalidated when /v1/statistics of
+# the store changes (checked at most every VALIDATION_INTERVAL seconds)
+VECTOR_STORE_CACHE = True
+VECTOR_STORE_CACHE_MAXSIZE = 1024  # number of (query, k, filter) entries
+VECTOR_STORE_CACHE_TTL = 600  # seconds
+VECTOR_STORE_CACHE_VALIDATION_INTERVAL = 5  # seconds
+# Background health checks of the multiserver retriever (seconds)
+VECTOR_STORE_HEALTH_CHECK_INTERVAL = 5
+VECTOR_STORE_HEALTH_CHECK_TIMEOUT = 2
+# Hedged requests of the multiserver retriever: when both servers are up, ask
+# the second one too if the first has not answered after the given percentile
+# of its recent latencies (or VECTOR_STORE_HEDGE_DELAY seconds until
+# VECTOR_STORE_HEDGE_MIN_SAMPLES latencies were measured)
+VECTOR_STORE_HEDGING = False
+VECTOR_STORE_HEDGE_PERCENTILE = 95
+VECTOR_STORE_HEDGE_DELAY = 0.5
+VECTOR_STORE_HEDGE_MIN_SAMPLES = 20
+VECTOR_STORE_HEDGE_WINDOW = 200  # number of latencies kept per server
+VECTOR_STORE_HEDGE_MAX_WORKERS = 16
+
 FAST_VECTOR_STORE_HOST = "127.0.0.1"
 FAST_VECTOR_STORE_PORT = 7000
 FAST_VECTOR_STORE_TIMEOUT = 10
@@ -32,6 +115,16 @@ CACHE_STORE_PORT = 8010
 
 MULTI_SERVER_HOST = "127.0.0.1"
 MULTI_SERVER_PORT = 8080
+# Proxy in front of the two slow servers (seconds)
+MULTI_SERVER_TIMEOUT = 30
+MULTI_SERVER_CONNECTION_LIMIT = 256  # max connections kept open to the servers
+MULTI_SERVER_HEALTH_CHECK_INTERVAL = 5
+MULTI_SERVER_HEALTH_CHECK_TIMEOUT = 2
+# How the proxy picks a server when both are up: "random", "least_loaded" or "ewma"
+MULTI_SERVER_ROUTING_POLICY = "least_loaded"
+MULTI_SERVER_EWMA_ALPHA = 0.3  # weight of the latest latency sample
+# Latency (seconds) recorded for a request that timed out, failed or got a 5xx
+MULTI_SERVER_ERROR_PENALTY = MULTI_SERVER_TIMEOUT
 
 # Depth of decomposer
 DECOMPOSER_DEPTH = 3
@@ -40,10 +133,19 @@ DECOMPOSER_DEPTH = 3
 NUM_DOCS_TO_RETRIEVE = 5
 NUM_DOCS_TO_RETRIEVE_TABLE = 2
 NUM_DOCS_TO_RETRIEVE_KV = 30
+# retrieve_documents_with_quant_qual fetches this many times the sum of the
+# above in one search and slices it into text / table / key-value documents
+QUANT_QUAL_OVERFETCH_FACTOR = 2
 
 # Number of retries for anthropic
 MAX_RETRIES_ANTHROPIC = 5
 
+# Contextualisation of the chunks of a document while indexing
+CONTEXTUALIZATION_CONCURRENCY = 16  # LLM calls in flight per document
+CONTEXTUALIZATION_RATE_LIMITS = {"anthropic": 8}  # calls started per second
+CONTEXTUALIZATION_BACKOFF_BASE = 1  # seconds, doubled on every retry
+CONTEXTUALIZATION_BACKOFF_MAX = 30  # seconds
+
 # Number of previous messages to consider for conversational awareness
 NUM_PREV_MESSAGES = 5
 
@@ -72,6 +174,80 @@ MAX_QUESTIONS_GENERATED_BY_PERSONAS_SUPERVISOR = 5
 
 TOKENIZER_CACHE_DIR = "hub/"
 
+# Pages of a PDF kept rendered while extracting the node images of a document
+# (None keeps all of them until the document is done)
+PAGE_RASTER_CACHE_MAX_PAGES = None
+# Content-addressed store of the chunk images, the chunk metadata only holds
+# the SHA-256 of the image
+IMAGE_STORE_DIR = "MultiCache/images"
+
+# Micro-batching of the Voyage and BGE-M3 embedders: concurrent calls are
+# embedded together once that many are queued or after MAX_WAIT seconds
+EMBEDDER_MAX_BATCH_SIZE = 64
+EMBEDDER_MAX_WAIT = 0.01
+
+# Chunks of every parsed PDF keyed by content hash, shared by all the servers.
+# Bump INGEST_PARSER_VERSION whenever the parsing code changes.
+INGEST_MANIFEST = True
+INGEST_MANIFEST_DIR = "MultiCache/ingest_manifest"
+INGEST_PARSER_VERSION = 1
+# Worker processes parsing PDFs concurrently (0 parses in threads instead),
+# and documents queued for them before the parser UDF is held back
+INGESTION_WORKERS = 4
+INGESTION_MAX_PENDING = 8
+# Level of the per-file ingestion progress logs, emitted even though the
+# servers configure the root logger at WARN
+INGESTION_LOG_LEVEL = "INFO"
+
+# Near-duplicate chunks across filings (MinHash of the word 3-shingles): reuse the
+# contextualisation of the first one seen and tag all of them with the same
+# `dup_group`, which retrieval collapses unless the year filter tells them apart
+NEAR_DUPLICATE_DETECTION = True
+NEAR_DUPLICATE_INDEX_FILE = "MultiCache/near_duplicates.db"
+NEAR_DUPLICATE_THRESHOLD = 0.8  # estimated Jaccard similarity
+NEAR_DUPLICATE_MIN_WORDS = 20
+# Seconds to wait for the lock of the index shared by the server processes
+NEAR_DUPLICATE_INDEX_TIMEOUT = 5.0
+RETRIEVAL_COLLAPSE_NEAR_DUPLICATES = True
+
+# KNN index of the document stores: "quantized" (QuantizedVectorIndex, below),
+# "brute_force" (exact) or "hnsw" (approximate, usearch). Measure recall and
+# latency on the corpus with experiments/indexing/knn_benchmark.py before
+# switching.
+# "quantized" is the default as it is the only kind with company/year
+# partitions (INDEX_PARTITION_KEYS, below): a filtered query only scans the
+# selected partitions, while "brute_force" and "hnsw" evaluate the filter in
+# the Pathway engine against every candidate. The trade-offs: its first pass
+# is approximate (re-scored exactly, see QUANTIZED_INDEX_OVERSAMPLE), and it
+# is fed outside the engine, so a query may not see the updates of the same
+# time (see knn_index.QuantizedKnn). Use "brute_force" for exact results that
+# are always consistent with the documents.
+KNN_INDEX = "quantized"
+KNN_DIMENSIONS = 1536
+# Initial capacity, raised to HEADROOM times the chunks in the ingest manifest
+KNN_RESERVED_SPACE = 1000
+KNN_RESERVED_SPACE_HEADROOM = 1.5
+HNSW_CONNECTIVITY = 16  # M, edges per node of the graph
+HNSW_EXPANSION_ADD = 128  # ef_construction
+HNSW_EXPANSION_SEARCH = 64  # ef, higher is slower but more accurate
+
+# Quantised vector index (quantized_index.py): "int8" or "binary" codes in RAM
+# for the first pass, then exact float re-scoring of the k * OVERSAMPLE best
+# candidates. Measure it with experiments/indexing/quantization_benchmark.py
+QUANTIZED_INDEX_KIND = "int8"
+QUANTIZED_INDEX_OVERSAMPLE = 4
+# Directory of the memory-mapped float vectors of the quantised indexes (one
+# file per index, removed on exit), so that only the codes stay resident.
+# None keeps them in RAM, which then takes more memory than brute force
+QUANTIZED_INDEX_VECTORS_DIR = "MultiCache/knn_vectors"
+# Fraction of removed rows above which a quantised index is compacted
+QUANTIZED_INDEX_COMPACT_THRESHOLD = 0.25
+# Metadata keys with posting lists in the quantised index, so that filtered
+# searches only scan the rows of the selected (company, year) partitions.
+# Only used with KNN_INDEX = "quantized" (the default), the other kinds filter
+# in the engine
+INDEX_PARTITION_KEYS = ("company_name", "year")
+
 CHAIN_DEBUG_CONFIG: RunnableConfig = {"callbacks": [ConsoleCallbackHandler()]}
 
 EVAL_QUERY_BATCH_SIZE = 10
@@ -129,6 +305,7 @@ WORKFLOW_SETTINGS = {
         "item_10K",
         "modified_at",
         "owner",
+        "retrieval_rank",
         "seen_at",
         "table",
         "topic",
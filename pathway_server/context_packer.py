@@ -0,0 +1,151 @@
+import re
+from typing import Any, Callable
+
+import tiktoken
+
+import config
+from utils import log_message
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(config.CONTEXT_TOKEN_ENCODING)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """`text` cut to its first `max_tokens` tokens."""
+    tokens = _get_encoding().encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return _get_encoding().decode(tokens[: max(max_tokens, 0)])
+
+
+def _truncate_text(item: Any, max_tokens: int) -> Any:
+    """Default `truncate` of `pack_context`: cuts strings, keeps other items whole."""
+    return truncate_tokens(item, max_tokens) if isinstance(item, str) else item
+
+
+def _words(text: str) -> list[str]:
+    return _WORD_PATTERN.findall(text.lower())
+
+
+def _shingles(words: list[str], size: int = 5) -> set[tuple[str, ...]]:
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def _relevance_order(
+    question: str, texts: list[str], ranks: list[int]
+) -> list[int]:
+    """
+    Indices of `texts` by decreasing relevance to `question`: the reciprocal
+    rank fusion of their retrieval `ranks` and of their coverage of the
+    question's words.
+    """
+    question_words = set(_words(question))
+    coverage = [
+        len(question_words & set(_words(text))) / max(len(question_words), 1)
+        for text in texts
+    ]
+    lexical_rank = {
+        i: rank
+        for rank, i in enumerate(
+            sorted(range(len(texts)), key=lambda i: coverage[i], reverse=True)
+        )
+    }
+    return sorted(
+        range(len(texts)),
+        key=lambda i: 1 / (60 + ranks[i]) + 1 / (60 + lexical_rank[i]),
+        reverse=True,
+    )
+
+
+def pack_context(
+    call_site: str,
+    question: str,
+    items: list[Any],
+    text: Callable[[Any], str] = str,
+    render: Callable[[Any], str] = repr,
+    rank: Callable[[Any], int] | None = None,
+    truncate: Callable[[Any, int], Any] = _truncate_text,
+) -> list[Any]:
+    """
+    The `items` (retrieved documents, question/answer pairs...) to put in the
+    prompt of `call_site`, most relevant first, within its token budget
+    (`config.CONTEXT_TOKEN_BUDGETS`).
+
+    Items are ordered by relevance to `question`, then an item is dropped if
+    most of its word 5-grams (`config.CONTEXT_OVERLAP_THRESHOLD`) are in a
+    more relevant item kept, e.g. overlapping chunks or the same chunk
+    retrieved for a question and its HyDE rewrite. The others are kept whole
+    while they fit in the budget, counting the tokens of `render(item)` as it
+    appears in the prompt; `text(item)` is the text compared.
+
+    `rank(item)` is the rank of an item in the result list it was retrieved
+    in, so that the items of a list (e.g. the tables) are not ranked below
+    all those of the lists before it. By default it is the position in
+    `items`, for items from a single list.
+
+    The most relevant item is always kept, so that the prompt never goes out
+    without context: if it does not fit in the budget on its own, it is
+    replaced by `truncate(item, max_tokens)`, the item with its text cut to
+    `max_tokens` tokens (by default, strings are cut and other items are
+    kept whole).
+
+    The budget and what was dropped are logged for every call.
+    """
+    budget = config.CONTEXT_TOKEN_BUDGETS.get(
+        call_site, config.CONTEXT_TOKEN_BUDGETS["default"]
+    )
+    texts = [text(item) for item in items]
+    ranks = (
+        list(range(len(items))) if rank is None else [rank(item) for item in items]
+    )
+    kept = []
+    kept_shingles = []
+    duplicates = 0
+    over_budget = 0
+    truncated = 0
+    tokens = 0
+    total_tokens = 0
+    for i in _relevance_order(question, texts, ranks):
+        item_tokens = count_tokens(render(items[i]))
+        total_tokens += item_tokens
+        shingles = _shingles(_words(texts[i]))
+        if any(
+            len(shingles & other) >= config.CONTEXT_OVERLAP_THRESHOLD * len(shingles)
+            for other in kept_shingles
+        ):
+            duplicates += 1
+            continue
+        item = items[i]
+        if tokens + item_tokens > budget:
+            if len(kept) > 0:
+                over_budget += 1
+                continue
+            # the tokens of `render(item)` that are not in its text
+            overhead = item_tokens - count_tokens(texts[i])
+            item = truncate(item, max(budget - overhead, 0))
+            item_tokens = count_tokens(render(item))
+            truncated += 1
+        kept.append(item)
+        kept_shingles.append(shingles)
+        tokens += item_tokens
+    log_message(
+        f"Context of {call_site}: {len(kept)}/{len(items)} items, "
+        f"{tokens}/{budget} tokens (from {total_tokens}), "
+        f"{duplicates} overlapping and {over_budget} over budget dropped, "
+        f"{truncated} truncated"
+    )
+    return kept
@@ -0,0 +1,93 @@
+from functools import partial
+
+import pathway as pw
+from pathway.xpacks.llm.document_store import DocumentStore
+from pathway.xpacks.llm.servers import DocumentStoreServer
+
+
+class RetrieveBatchQuerySchema(pw.Schema):
+    queries: pw.Json = pw.column_definition(
+        description="List of objects with `query`, `k` and optional "
+        "`metadata_filter` / `filepath_globpattern` keys",
+        example=[{"query": "What is the revenue of apple?", "k": 5}],
+    )
+
+
+@pw.udf
+def _index_queries(queries: pw.Json) -> pw.Json:
+    return pw.Json(
+        [{**query, "index": index} for index, query in enumerate(queries.value)]
+    )
+
+
+@pw.udf
+def _collect_results(results: tuple | None) -> pw.Json:
+    if results is None:
+        return pw.Json([])
+    return pw.Json([result.value for _, result in results])
+
+
+def retrieve_batch_query(
+    document_store: DocumentStore, batch_queries: pw.Table
+) -> pw.Table:
+    """
+    Answer many retrieval queries sent in one request.
+
+    Every request is flattened into one row per query so that all of them go
+    through the embedder and the KNN index in the same engine batch, then the
+    results are regrouped per request in the order the queries were sent.
+    """
+    flat = batch_queries.select(
+        request_id=pw.this.id, item=_index_queries(pw.this.queries)
+    ).flatten(pw.this.item)
+    flat = flat.select(
+        request_id=pw.this.request_id,
+        index=pw.this.item["index"].as_int(),
+        query=pw.this.item["query"].as_str(),
+        k=pw.this.item["k"].as_int(),
+        metadata_filter=pw.this.item.get("metadata_filter").as_str(),
+        filepath_globpattern=pw.this.item.get("filepath_globpattern").as_str(),
+    )
+
+    results = document_store.retrieve_query(flat).with_universe_of(flat)
+    flat = flat.with_columns(result=results.result)
+
+    grouped = (
+        flat.groupby(pw.this.request_id)
+        .reduce(
+            pw.this.request_id,
+            results=pw.reducers.sorted_tuple(
+                pw.make_tuple(pw.this.index, pw.this.result)
+            ),
+        )
+        .with_id(pw.this.request_id)
+    )
+
+    return batch_queries.select(
+        result=_collect_results(
+            grouped.ix(batch_queries.id, optional=True).results
+        )
+    )
+
+
+class BatchDocumentStoreServer(DocumentStoreServer):
+    """
+    DocumentStoreServer that additionally serves `/v1/retrieve_batch`, taking
+    a list of queries and returning one list of results per query.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        document_store: DocumentStore,
+        **rest_kwargs,
+    ):
+        super().__init__(host, port, document_store, **rest_kwargs)
+
+        self.serve(
+            "/v1/retrieve_batch",
+            RetrieveBatchQuerySchema,
+            partial(retrieve_batch_query, document_store),
+            **rest_kwargs,
+        )
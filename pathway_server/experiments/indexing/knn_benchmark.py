@@ -0,0 +1,155 @@
+"""
+Recall@k and latency of the HNSW index (usearch) against brute-force search,
+on the chunks of our own corpus.
+
+The chunks are read from the ingest manifest, so the PDFs must have been
+parsed by one of the servers first. Embeddings are computed once with OpenAI
+and saved to `--embeddings`; later runs reuse the file. A random sample of
+`--queries` chunks is held out of the index and used as queries, and every
+HNSW configuration is compared with the exact top-k of brute-force search.
+
+Usage (from pathway_server/):
+    python -m experiments.indexing.knn_benchmark --k 5 10 --ef 16 32 64 128
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from usearch.index import Index
+
+import config
+
+load_dotenv()
+
+
+def load_chunks(manifest_dir: str, parser_version: str | None) -> list[str]:
+    pattern = os.path.join(manifest_dir, parser_version or "*", "*.json")
+    texts = set()
+    for path in glob.glob(pattern):
+        with open(path, "r") as f:
+            texts.update(text for text, _ in json.load(f)["docs"])
+    return sorted(texts)
+
+
+def load_embeddings(path: str, model: str, manifest_dir: str, parser_version):
+    if os.path.exists(path):
+        return np.load(path)
+
+    from langchain_openai.embeddings import OpenAIEmbeddings
+
+    texts = load_chunks(manifest_dir, parser_version)
+    if len(texts) == 0:
+        raise SystemExit(f"No chunks found in {manifest_dir}")
+    print(f"Embedding {len(texts)} chunks with {model}...")
+    embeddings = np.array(
+        OpenAIEmbeddings(model=model).embed_documents(texts), dtype=np.float32
+    )
+    np.save(path, embeddings)
+    return embeddings
+
+
+def brute_force_search(vectors: np.ndarray, queries: np.ndarray, k: int):
+    """Exact cosine top-k, the way BruteForceKnnFactory ranks documents."""
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        scores = vectors @ (query / np.linalg.norm(query))
+        top = np.argpartition(-scores, k)[:k]
+        results.append(top[np.argsort(-scores[top])])
+        latencies.append(time.perf_counter() - start)
+    return np.array(results), np.array(latencies)
+
+
+def hnsw_search(index: Index, queries: np.ndarray, k: int):
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        matches = index.search(query, k)
+        results.append(matches.keys)
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies)
+
+
+def recall(results, exact: np.ndarray) -> float:
+    return float(
+        np.mean([len(set(r) & set(e)) / len(e) for r, e in zip(results, exact)])
+    )
+
+
+def report(name: str, k: int, latencies: np.ndarray, recall_at_k: float):
+    print(
+        f"{name:<28} recall@{k:<3} {recall_at_k:6.3f}   "
+        f"mean {1000 * latencies.mean():7.2f} ms   "
+        f"p95 {1000 * np.percentile(latencies, 95):7.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--manifest-dir", default=config.INGEST_MANIFEST_DIR)
+    parser.add_argument("--parser-version", default=None)
+    parser.add_argument("--embeddings", default="MultiCache/knn_benchmark.npy")
+    parser.add_argument("--model", default="text-embedding-3-small")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10])
+    parser.add_argument("--m", type=int, nargs="+", default=[config.HNSW_CONNECTIVITY])
+    parser.add_argument(
+        "--ef-construction", type=int, default=config.HNSW_EXPANSION_ADD
+    )
+    parser.add_argument(
+        "--ef", type=int, nargs="+", default=[16, 32, config.HNSW_EXPANSION_SEARCH, 128]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embeddings = load_embeddings(
+        args.embeddings, args.model, args.manifest_dir, args.parser_version
+    )
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(embeddings))
+    queries = embeddings[order[: args.queries]]
+    vectors = embeddings[order[args.queries :]]
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries")
+
+    exact = {}
+    for k in args.k:
+        exact[k], latencies = brute_force_search(vectors, queries, k)
+        report("brute force", k, latencies, 1.0)
+
+    for m in args.m:
+        index = Index(
+            ndim=vectors.shape[1],
+            metric="cos",
+            connectivity=m,
+            expansion_add=args.ef_construction,
+        )
+        # Start from KNN_RESERVED_SPACE and double the capacity when full, so
+        # that the build time includes the reallocations
+        index.reserve(config.KNN_RESERVED_SPACE)
+        start = time.perf_counter()
+        for key, vector in enumerate(vectors):
+            if len(index) == index.capacity:
+                index.reserve(2 * index.capacity)
+            index.add(key, vector)
+        build_time = time.perf_counter() - start
+        print(
+            f"HNSW M={m} ef_construction={args.ef_construction}: built in "
+            f"{build_time:.1f} s, {index.memory_usage / 2**20:.1f} MiB"
+        )
+        for ef in args.ef:
+            index.expansion_search = ef
+            for k in args.k:
+                results, latencies = hnsw_search(index, queries, k)
+                report(f"  HNSW M={m} ef={ef}", k, latencies, recall(results, exact[k]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Memory and recall@k of the quantised vector index (int8 and binary codes with
+float re-scoring) against exact float32 search, on the chunks of our own
+corpus.
+
+Embeddings and queries are prepared as in `knn_benchmark`, whose embeddings
+file is reused. The float vectors used for re-scoring are memory-mapped from
+`--vectors-dir`. For every kind, the growth of the resident memory of the
+process while the index is built and searched is reported next to the bytes
+of its codes: the anonymous memory (codes, metadata...) stays resident,
+while the pages of the vectors file read by re-scoring are file-backed and
+can be reclaimed by the kernel.
+
+Usage (from pathway_server/):
+    python -m experiments.indexing.quantization_benchmark --oversample 1 4 10
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import config
+from experiments.indexing.knn_benchmark import (
+    brute_force_search,
+    load_embeddings,
+    recall,
+    report,
+)
+from quantized_index import QuantizedVectorIndex
+
+
+def resident_memory() -> dict[str, int]:
+    """Anonymous and file-backed resident bytes of this process (Linux)."""
+    memory = {"RssAnon": 0, "RssFile": 0}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in memory:
+                memory[name] = int(value.split()[0]) * 1024
+    return memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--manifest-dir", default=config.INGEST_MANIFEST_DIR)
+    parser.add_argument("--parser-version", default=None)
+    parser.add_argument("--embeddings", default="MultiCache/knn_benchmark.npy")
+    parser.add_argument("--model", default="text-embedding-3-small")
+    parser.add_argument("--vectors-dir", default="MultiCache/quantization_benchmark")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10])
+    parser.add_argument("--kinds", nargs="+", default=["int8", "binary"])
+    parser.add_argument("--oversample", type=int, nargs="+", default=[1, 2, 4, 10])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embeddings = load_embeddings(
+        args.embeddings, args.model, args.manifest_dir, args.parser_version
+    )
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(embeddings))
+    queries = embeddings[order[: args.queries]]
+    vectors = embeddings[order[args.queries :]]
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries")
+
+    print(f"float32: {vectors.astype(np.float32).nbytes / 2**20:.1f} MiB in RAM")
+    exact = {}
+    for k in args.k:
+        exact[k], latencies = brute_force_search(vectors, queries, k)
+        report("float32", k, latencies, 1.0)
+
+    for kind in args.kinds:
+        memory_before = resident_memory()
+        index = QuantizedVectorIndex(
+            dimensions=vectors.shape[1],
+            kind=kind,
+            vectors_file=os.path.join(args.vectors_dir, f"{kind}.f32"),
+            reserved_space=len(vectors),
+        )
+        index.add(list(range(len(vectors))), vectors)
+        print(
+            f"{kind}: {index.memory_usage / 2**20:.1f} MiB of codes, "
+            f"{os.path.getsize(index.vectors_file) / 2**20:.1f} MiB on disk"
+        )
+        for oversample in args.oversample:
+            for k in args.k:
+                results = []
+                latencies = []
+                for query in queries:
+                    start = time.perf_counter()
+                    matches = index.search(query, k, oversample)
+                    latencies.append(time.perf_counter() - start)
+                    results.append([key for key, _ in matches])
+                report(
+                    f"  {kind} oversample={oversample}",
+                    k,
+                    np.array(latencies),
+                    recall(results, exact[k]),
+                )
+        memory_after = resident_memory()
+        print(
+            f"{kind}: resident memory grew by "
+            f"{(memory_after['RssAnon'] - memory_before['RssAnon']) / 2**20:.1f} MiB "
+            f"anonymous and "
+            f"{(memory_after['RssFile'] - memory_before['RssFile']) / 2**20:.1f} MiB "
+            f"file-backed"
+        )
+        del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+
+import config
+
+_REF_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ImageStore:
+    """
+    Content-addressed store of the chunk images on local disk.
+
+    Every image is saved once under the SHA-256 of its bytes, which is what
+    the parsers put in the `image` metadata of a chunk instead of the base64
+    encoded image itself. The pixels are only read back when asked for, e.g.
+    to show a retrieved chunk to a vision model.
+    """
+
+    def __init__(self, root: str = config.IMAGE_STORE_DIR):
+        self.root = root
+
+    def path(self, ref: str) -> str:
+        # Two levels of fan-out so that no directory gets too large
+        return os.path.join(self.root, ref[:2], ref[2:] + ".png")
+
+    def put(self, data: bytes) -> str:
+        """Save `data` if it is not stored yet and return its reference."""
+        ref = hashlib.sha256(data).hexdigest()
+        path = self.path(ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so that concurrent writers of
+            # the same image never expose a partially written file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return ref
+
+    def put_base64(self, image: str | None) -> str | None:
+        """`put` for a base64 encoded image, None is passed through."""
+        if image is None:
+            return None
+        return self.put(base64.b64decode(image))
+
+    def get(self, ref: str) -> bytes | None:
+        try:
+            with open(self.path(ref), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            print(f"Image {ref} not found in the image store")
+            return None
+
+    def get_base64(self, image: str | None) -> str | None:
+        """
+        Base64 encoded image for the `image` metadata of a chunk. Chunks
+        indexed before the store existed hold the base64 image itself, which
+        is returned unchanged.
+        """
+        if image is None or not is_image_ref(image):
+            return image
+        data = self.get(image)
+        if data is None:
+            return None
+        return base64.b64encode(data).decode("utf-8")
+
+    def get_data_url(self, image: str | None) -> str | None:
+        """`get_base64` as a `data:` URL, ready to be sent to a vision model."""
+        image = self.get_base64(image)
+        if image is None:
+            return None
+        return f"data:image/png;base64,{image}"
+
+
+def is_image_ref(image: str) -> bool:
+    return bool(_REF_PATTERN.match(image))
+
+
+image_store = ImageStore()
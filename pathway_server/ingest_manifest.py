@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import config
+
+
+def _describe(value):
+    """JSON-able description of parser arguments that is stable across runs."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {str(key): _describe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_describe(item) for item in value]
+    # objects such as LLMs or cache strategies are only described by their type
+    return f"{type(value).__module__}.{type(value).__qualname__}"
+
+
+def get_parser_version(parser_cls, parser_kwargs: dict, *prompts: str) -> str:
+    """
+    Identify a parser configuration: the `parser_name` of the parser class
+    (its module is `__main__` in the server scripts, so it cannot tell parsers
+    apart), its constructor arguments, the prompts it uses and
+    `config.INGEST_PARSER_VERSION`, to be bumped whenever the parsing code
+    changes.
+    """
+    description = json.dumps(
+        {
+            "parser": parser_cls.parser_name,
+            "kwargs": _describe(parser_kwargs),
+            "prompts": list(prompts),
+            "version": config.INGEST_PARSER_VERSION,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()[:16]
+
+
+class IngestManifest:
+    """
+    Chunks produced for every PDF, keyed by the SHA-256 of the file contents
+    and the parser version (see `get_parser_version`).
+
+    The manifest lives in one directory shared by the fast, slow1 and slow2
+    servers, so a document that was parsed once, under any name and by any of
+    them, is never parsed again by a parser with the same configuration.
+    """
+
+    def __init__(self, root: str = config.INGEST_MANIFEST_DIR):
+        self.root = root
+
+    def path(self, contents: bytes, parser_version: str) -> str:
+        content_hash = hashlib.sha256(contents).hexdigest()
+        return os.path.join(self.root, parser_version, content_hash + ".json")
+
+    def get(self, contents: bytes, parser_version: str) -> dict | None:
+        """The entry stored for `contents`, or None if it was never parsed."""
+        if not config.INGEST_MANIFEST:
+            return None
+        try:
+            with open(self.path(contents, parser_version), "r") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Error reading the ingest manifest: {e}")
+            return None
+        # JSON turns the (text, metadata) tuples into lists
+        entry["docs"] = [tuple(doc) for doc in entry["docs"]]
+        return entry
+
+    def put(self, contents: bytes, parser_version: str, entry: dict) -> None:
+        """Store `entry`, a dict with at least the `docs` produced for `contents`."""
+        if not config.INGEST_MANIFEST:
+            return
+        path = self.path(contents, parser_version)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so that readers never see a
+            # partially written entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing the ingest manifest: {e}")
+
+    def num_docs(self, parser_version: str) -> int:
+        """Number of chunks produced so far by the parser `parser_version`."""
+        total = 0
+        directory = os.path.join(self.root, parser_version)
+        if not os.path.isdir(directory):
+            return 0
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name), "r") as f:
+                    total += len(json.load(f)["docs"])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error reading the ingest manifest: {e}")
+        return total
+
+
+ingest_manifest = IngestManifest()
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import importlib
+import logging
+import multiprocessing
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(config.INGESTION_LOG_LEVEL)
+
+# Parsers by parser version, filled by `register_parser` in the parent process
+# and in every worker process when the module defining the parsers is imported
+_PARSERS = {}
+
+
+def register_parser(parser) -> None:
+    """Make `parser` available to the worker processes of the pool."""
+    _PARSERS[parser.parser_version] = parser
+
+
+def _init_worker(module_names: list[str]) -> None:
+    # Only the modules defining the parsers (e.g. `parsers`) are imported, the
+    # server scripts keep their document stores behind `__main__` guards
+    for module_name in module_names:
+        importlib.import_module(module_name)
+
+
+def _run_in_worker(parser_version: str, method: str, *args):
+    return getattr(_PARSERS[parser_version], method)(*args)
+
+
+def file_id(contents: bytes) -> str:
+    """Short id of a file, used in the progress reports."""
+    return hashlib.sha256(contents).hexdigest()[:12]
+
+
+class IngestionPool:
+    """
+    Parses PDFs in a pool of worker processes, so that several documents are
+    parsed at once and the CPU-bound parsing never blocks the event loop on
+    which the parsers make their LLM calls.
+
+    At most `max_workers` parsing steps run at once and `max_pending` more
+    are queued for the workers; further ones wait in `run`. This bounds the
+    copies of the files sent to the workers, not the memory of a bulk upload:
+    the connector has already read every file and handed its bytes to the
+    parser UDF by then. A parser can split the parsing of a document into
+    several steps (`run`), e.g. to make its LLM calls on the event loop
+    between two steps in the workers. With `max_workers=0`, or for a parser
+    whose `parse_in_worker` is False, the steps run in threads of the calling
+    process instead.
+
+    The progress of every file is logged at `config.INGESTION_LOG_LEVEL`,
+    whatever the level of the root logger, and the files in flight are listed
+    in `progress`.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = config.INGESTION_WORKERS,
+        max_pending: int = config.INGESTION_MAX_PENDING,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.progress = {}
+        self._executor = None
+        self._slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Forking the multithreaded pathway engine is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(
+                    sorted({type(parser).__module__ for parser in _PARSERS.values()}),
+                ),
+            )
+        return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # Semaphores cannot be shared across event loops
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(
+                max(self.max_workers, 1) + self.max_pending
+            )
+        return slots
+
+    def report(self, contents: bytes, status: str, **info) -> None:
+        """Record and log a new `status` of the file `contents`."""
+        id = file_id(contents)
+        entry = self.progress.setdefault(
+            id, {"size": len(contents), "started_at": time.time()}
+        )
+        entry.update(status=status, **info)
+        elapsed = time.time() - entry["started_at"]
+        details = "".join(f", {key}={value}" for key, value in info.items())
+        logger.info(
+            f"Ingestion of {id} ({entry['size']} bytes): {status} "
+            f"after {elapsed:.1f}s{details}"
+        )
+        if status in ("done", "failed"):
+            del self.progress[id]
+
+    async def run(self, parser, contents: bytes, method: str, *args):
+        """
+        `parser.<method>(*args)`, a step of the parsing of the PDF `contents`,
+        run by a worker process, or a thread if `parser.parse_in_worker` is
+        False. The step is logged as the status of the file.
+        """
+        self.report(contents, "waiting")
+        async with self._get_slots():
+            self.report(contents, method)
+            try:
+                if self.max_workers == 0 or not parser.parse_in_worker:
+                    return await asyncio.to_thread(getattr(parser, method), *args)
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._get_executor(),
+                    _run_in_worker,
+                    parser.parser_version,
+                    method,
+                    *args,
+                )
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory), start a new pool for the
+                # next documents
+                self._executor = None
+                self.report(contents, "failed", error=repr(e))
+                raise
+            except Exception as e:
+                self.report(contents, "failed", error=repr(e))
+                raise
+
+    async def parse(self, parser, contents: bytes) -> list[dict]:
+        """
+        Nodes of the PDF `contents`, as returned by `parser.parse_nodes`,
+        parsed by a worker process, or a thread if `parser.parse_in_worker`
+        is False.
+        """
+        nodes = await self.run(parser, contents, "parse_nodes", contents)
+        self.report(contents, "parsed", nodes=len(nodes))
+        return nodes
+
+
+ingestion_pool = IngestionPool()
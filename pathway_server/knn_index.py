@@ -0,0 +1,288 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import dataclass, field
+
+import jmespath
+import pathway as pw
+from pathway.stdlib.indexing import BruteForceKnnFactory, UsearchKnnFactory
+from pathway.stdlib.indexing.colnames import _INDEX_REPLY
+from pathway.stdlib.indexing.data_index import InnerIndex
+from pathway.stdlib.indexing.nearest_neighbors import (
+    KnnIndexFactory,
+    _calculate_embeddings,
+)
+from pathway.stdlib.ml.classifiers import _knn_lsh
+
+import config
+from ingest_manifest import ingest_manifest
+from quantized_index import QuantizedVectorIndex
+
+logger = logging.getLogger(__name__)
+
+
+def get_reserved_space(parser_version: str | None = None) -> int:
+    """
+    Initial capacity of the KNN index: `config.KNN_RESERVED_SPACE`, or more if
+    the ingest manifest shows the corpus is larger.
+
+    Both index kinds grow when full, but the HNSW graph is reallocated at every
+    growth, so reserving the size of the known corpus up front avoids a series
+    of reallocations while the documents are (re)loaded at startup.
+    """
+    reserved_space = config.KNN_RESERVED_SPACE
+    if parser_version is not None:
+        num_docs = ingest_manifest.num_docs(parser_version)
+        reserved_space = max(
+            reserved_space, int(num_docs * config.KNN_RESERVED_SPACE_HEADROOM)
+        )
+    return reserved_space
+
+
+def _jmespath_filter(metadata_filter: str, metadata: dict) -> bool:
+    """Evaluate a metadata filter on `metadata` the way Pathway's indexes do."""
+    try:
+        return (
+            jmespath.search(metadata_filter, metadata, options=_knn_lsh._glob_options)
+            is True
+        )
+    except jmespath.exceptions.JMESPathError:
+        logger.exception("Incorrect JMESPath expression for metadata filter")
+        return False
+
+
+def _metadata_dict(metadata) -> dict:
+    if metadata is None:
+        return {}
+    if isinstance(metadata, pw.Json):
+        metadata = metadata.value
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+    return metadata if isinstance(metadata, dict) else {}
+
+
+def _vectors_file() -> str | None:
+    """
+    A file of `config.QUANTIZED_INDEX_VECTORS_DIR` for the float vectors of one
+    quantised index, removed when the process exits. None to keep them in RAM.
+    """
+    if config.QUANTIZED_INDEX_VECTORS_DIR is None:
+        return None
+    os.makedirs(config.QUANTIZED_INDEX_VECTORS_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(
+        prefix=f"vectors_{os.getpid()}_",
+        suffix=".f32",
+        dir=config.QUANTIZED_INDEX_VECTORS_DIR,
+    )
+    os.close(fd)
+    atexit.register(lambda: os.path.exists(path) and os.remove(path))
+    return path
+
+
+@dataclass(frozen=True, kw_only=True)
+class QuantizedKnn(InnerIndex):
+    """
+    Pathway index over a `QuantizedVectorIndex`.
+
+    The embedded documents are fed to the index by a subscription to the data
+    table, applied at the end of every time of the computation, and queries
+    are answered by a UDF searching the index as it is when the UDF runs.
+    Filtered queries only scan the (company, year) partitions they select (see
+    `QuantizedVectorIndex`), other filters are evaluated with JMESPath.
+
+    The score is the cosine similarity minus 1, so that the `dist` of the
+    document store (minus the score) is the cosine distance, as with the
+    brute force index.
+
+    Limitations:
+        - The subscription runs apart from the query UDF, so a query at time t
+          may be answered before the updates of time t are applied: it can
+          miss the documents added at t, or return the ones deleted at t.
+          Both variants answer each query once; `query` does not revise its
+          answers when the documents change later.
+        - It relies on Pathway internals (`_calculate_embeddings`,
+          `_INDEX_REPLY` and the `_glob_options` of JMESPath), which may
+          change between Pathway versions: check it when upgrading Pathway.
+    """
+
+    dimensions: int
+    reserved_space: int
+    kind: str = config.QUANTIZED_INDEX_KIND
+    oversample: int = config.QUANTIZED_INDEX_OVERSAMPLE
+    embedder: pw.UDF | None = None
+
+    # data column after applying embeddings, and the index fed from it
+    _data_column: pw.ColumnReference = field(init=False)
+    _index: QuantizedVectorIndex = field(init=False)
+    _lock: threading.Lock = field(init=False)
+
+    def __post_init__(self):
+        _data_column = _calculate_embeddings(self.data_column, self.embedder)
+        object.__setattr__(self, "_data_column", _data_column)
+        object.__setattr__(
+            self,
+            "_index",
+            QuantizedVectorIndex(
+                dimensions=self.dimensions,
+                kind=self.kind,
+                vectors_file=_vectors_file(),
+                reserved_space=self.reserved_space,
+                oversample=self.oversample,
+                filter_fallback=_jmespath_filter,
+            ),
+        )
+        object.__setattr__(self, "_lock", threading.Lock())
+
+        columns = {"vector": _data_column}
+        if self.metadata_column is not None:
+            columns["metadata"] = self.metadata_column
+        data = _data_column.table.select(**columns)
+
+        # An updated row is removed and added within one time, in any order
+        removed = []
+        added = {}
+
+        def on_change(key, row, time, is_addition):
+            if is_addition:
+                added[key] = row
+            else:
+                removed.append(key)
+
+        def on_time_end(time):
+            with self._lock:
+                self._index.remove(removed)
+                if added:
+                    self._index.add(
+                        list(added),
+                        [row["vector"] for row in added.values()],
+                        [_metadata_dict(row.get("metadata")) for row in added.values()],
+                    )
+            removed.clear()
+            added.clear()
+
+        pw.io.subscribe(data, on_change=on_change, on_time_end=on_time_end)
+
+    def query(
+        self,
+        query_column: pw.ColumnReference,
+        number_of_matches: pw.ColumnExpression | int = 3,
+        metadata_filter: pw.ColumnExpression | None = None,
+    ) -> pw.Table:
+        """
+        Same as `query_as_of_now`: the answers are not updated when the
+        documents change (see the limitations of the class).
+        """
+        return self.query_as_of_now(query_column, number_of_matches, metadata_filter)
+
+    def query_as_of_now(
+        self,
+        query_column: pw.ColumnReference,
+        number_of_matches: pw.ColumnExpression | int = 3,
+        metadata_filter: pw.ColumnExpression | None = None,
+    ) -> pw.Table:
+        query_column = _calculate_embeddings(query_column, self.embedder)
+
+        @pw.udf
+        def search(
+            query, k: int, metadata_filter: str | None = None
+        ) -> list[tuple[pw.Pointer, float]]:
+            with self._lock:
+                matches = self._index.search(
+                    query, k, metadata_filter=metadata_filter
+                )
+            return [(key, similarity - 1.0) for key, similarity in matches]
+
+        if metadata_filter is None:
+            reply = search(query_column, number_of_matches)
+        else:
+            reply = search(query_column, number_of_matches, metadata_filter)
+        return query_column.table.select(**{_INDEX_REPLY: reply})
+
+
+@dataclass(kw_only=True)
+class QuantizedKnnFactory(KnnIndexFactory):
+    """
+    Factory of `QuantizedKnn` indices.
+
+    Args:
+        reserved_space (int): initial capacity (in the number of entries) of the index
+        kind (str): "int8" or "binary" codes, see `QuantizedVectorIndex`
+        oversample (int): candidates re-scored exactly per requested match
+    """
+
+    reserved_space: int = 400
+    kind: str = config.QUANTIZED_INDEX_KIND
+    oversample: int = config.QUANTIZED_INDEX_OVERSAMPLE
+
+    def build_inner_index(
+        self,
+        data_column: pw.ColumnReference,
+        metadata_column: pw.ColumnExpression | None = None,
+    ) -> InnerIndex:
+        assert isinstance(
+            self.dimensions, int
+        ), "`dimensions` is not set, this may indicate something is wrong with embedder."
+
+        return QuantizedKnn(
+            data_column,
+            metadata_column,
+            dimensions=self.dimensions,
+            reserved_space=self.reserved_space,
+            kind=self.kind,
+            oversample=self.oversample,
+            embedder=self.embedder,
+        )
+
+
+def make_knn_index(
+    embedder,
+    parser_version: str | None = None,
+    dimensions: int = config.KNN_DIMENSIONS,
+    kind: str = config.KNN_INDEX,
+):
+    """
+    KNN retriever factory of the document stores.
+
+    Args:
+        embedder: Embedder of the documents and queries
+        parser_version (str): Version of the parser producing the documents,
+            used to size the index from the ingest manifest
+        dimensions (int): Dimension of the embeddings
+        kind (str): "brute_force" for exact search, "hnsw" for approximate
+            search with an HNSW graph (usearch) tuned by `config.HNSW_*`, or
+            "quantized" for a `QuantizedVectorIndex` tuned by
+            `config.QUANTIZED_INDEX_*`
+
+    Returns:
+        BruteForceKnnFactory | UsearchKnnFactory | QuantizedKnnFactory
+    """
+    reserved_space = get_reserved_space(parser_version)
+    if kind == "brute_force":
+        return BruteForceKnnFactory(
+            reserved_space=reserved_space,
+            embedder=embedder,
+            metric=pw.engine.BruteForceKnnMetricKind.COS,
+            dimensions=dimensions,
+        )
+    if kind == "hnsw":
+        return UsearchKnnFactory(
+            reserved_space=reserved_space,
+            embedder=embedder,
+            metric=pw.engine.USearchMetricKind.COS,
+            dimensions=dimensions,
+            connectivity=config.HNSW_CONNECTIVITY,
+            expansion_add=config.HNSW_EXPANSION_ADD,
+            expansion_search=config.HNSW_EXPANSION_SEARCH,
+        )
+    if kind == "quantized":
+        return QuantizedKnnFactory(
+            reserved_space=reserved_space,
+            embedder=embedder,
+            dimensions=dimensions,
+            kind=config.QUANTIZED_INDEX_KIND,
+            oversample=config.QUANTIZED_INDEX_OVERSAMPLE,
+        )
+    raise ValueError(f"Unknown KNN index kind: {kind}")
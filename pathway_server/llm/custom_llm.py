@@ -1,6 +1,10 @@
+import json
+import time
 from typing import (
     Any,
+    AsyncIterator,
     Dict,
+    Iterator,
     Optional,
     Type,
     Union,
@@ -14,6 +18,7 @@ from langchain_core.language_models.base import LanguageModelInput
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import BaseMessage
 from langchain_core.runnables import RunnableConfig, ensure_config
+from langchain_core.runnables.config import get_config_list
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_mistralai import ChatMistralAI
@@ -21,9 +26,20 @@ import config
 from config import SIMULATE_ERRORS
 from utils import log_message
 from .model_wrappers import ChatGemini, Llama
+from .provider_health import BACKOFF, is_provider_error, provider_health
+from .response_cache import llm_response_cache, request_key
+from .single_flight import llm_single_flight
 from dotenv import load_dotenv
 load_dotenv()
 
+
+def _schema_key(schema: Union[Dict, Type[BaseModel]]) -> Any:
+    """Hashable key of a structured output schema."""
+    if isinstance(schema, dict):
+        return json.dumps(schema, sort_keys=True, default=str)
+    return schema
+
+
 class LLM(BaseChatModel):
     openai: Optional[ChatOpenAI] = None
     anthropic: Optional[ChatAnthropic] = None
@@ -37,6 +53,11 @@ class LLM(BaseChatModel):
     num_retries: int = Field(default=2, description="Number of retries for each model")
 
     _schema_given: Optional[Union[Dict, Type[BaseModel]]] = None
+    # Structured runnable of every (provider, schema), shared by all the copies
+    # made by `with_structured_output`
+    _structured_runnables: Dict[Any, Any] = {}
+    # Call site name under which responses are cached, see `with_cache`
+    _cache_call_site: Optional[str] = None
 
     def instanciate_models(self) -> None:
         """
@@ -58,6 +79,12 @@ class LLM(BaseChatModel):
             except Exception as e:
                 setattr(self, attr, None)
                 log_message(f"Failed to instantiate model {attr}: {e}")
+            else:
+                model = getattr(self, attr)
+                # Cheapest call checking that a provider in backoff is back
+                provider_health.register_probe(
+                    attr, lambda model=model: model.invoke("Reply with OK.", None)
+                )
         self._models = [
             self.openai,
             self.anthropic,
@@ -93,8 +120,160 @@ class LLM(BaseChatModel):
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
+        self._structured_runnables = {}
         self.instanciate_models()
-        
+
+    def _get_runnable(self, model: Any, model_name: str) -> Any:
+        """
+        The runnable to call for `model`: its structured output runnable for
+        the schema given, built once per provider and schema.
+        """
+        if not self._schema_given:
+            # `Llama` only wraps the invoke of its Replicate model
+            return model.model if isinstance(model, Llama) else model
+        key = (model_name, _schema_key(self._schema_given))
+        runnable = self._structured_runnables.get(key)
+        if runnable is None:
+            runnable = model.with_structured_output(self._schema_given)
+            self._structured_runnables[key] = runnable
+        return runnable
+
+    def _runnables(self) -> Iterator[tuple[str, Any]]:
+        """
+        (name, runnable) of every available model, in fallback order: the
+        healthy providers first, then the degraded ones, then the ones backing
+        off (see `provider_health.ProviderHealthRegistry`).
+        """
+        models = dict(zip(self._model_names, self._models))
+        for model_name in provider_health.order(self._model_names):
+            model = models[model_name]
+            if SIMULATE_ERRORS[model_name]:
+                raise RuntimeError(f"Simulating error in `{model_name}`")
+
+            if model is None:
+                continue
+
+            yield model_name, self._get_runnable(model, model_name)
+
+    def _attempts(self, model_name: str) -> Iterator[int]:
+        """Attempts on `model_name`, without retrying once it backs off."""
+        for attempt in range(self.num_retries):
+            if attempt > 0 and provider_health.state(model_name) == BACKOFF:
+                log_message(f"{model_name} backs off, skipping its retries")
+                return
+            yield attempt
+
+    def _record(
+        self, model_name: str, start: float, error: Optional[Exception] = None
+    ) -> None:
+        """
+        Record the outcome of a call to `model_name` started at `start`. An
+        error that is not the provider's fault (e.g. an answer that does not
+        parse into the schema) is retried like the others, but the provider
+        did answer, so it counts as a success.
+        """
+        if error is None or not is_provider_error(error):
+            provider_health.record_success(model_name, time.monotonic() - start)
+        else:
+            provider_health.record_failure(model_name, error)
+
+    def _caching(self) -> bool:
+        return (
+            llm_response_cache is not None
+            and self._cache_call_site is not None
+            and bool(self._schema_given)
+        )
+
+    def _cache_key(self, model_name: str, input_given: LanguageModelInput) -> str:
+        model = self._models[self._model_names.index(model_name)]
+        return llm_response_cache.key(model_name, model, self._schema_given, input_given)
+
+    def _cache_get(self, input_given: LanguageModelInput) -> Any:
+        """
+        Cached response to `input_given` of any model, preferring the models
+        in fallback order, or None.
+        """
+        if not self._caching():
+            return None
+        keys = [
+            self._cache_key(model_name, input_given)
+            for model, model_name in zip(self._models, self._model_names)
+            if model is not None
+        ]
+        return llm_response_cache.get(keys, self._cache_call_site, self._schema_given)
+
+    def _cache_put(
+        self, model_name: str, input_given: LanguageModelInput, response: Any
+    ) -> None:
+        if self._caching():
+            llm_response_cache.put(
+                self._cache_key(model_name, input_given),
+                self._cache_call_site,
+                response,
+            )
+
+    def _flight_key(
+        self, model_name: str, input_given: LanguageModelInput, kwargs: dict
+    ) -> Optional[str]:
+        """Key of a call for `llm_single_flight`, None if it cannot be shared."""
+        if llm_single_flight is None:
+            return None
+        model = self._models[self._model_names.index(model_name)]
+        try:
+            key = request_key(model_name, model, self._schema_given, input_given)
+        except Exception:
+            # inputs other than a string, prompt value or list of messages
+            return None
+        return f"{key}:{sorted(kwargs.items())!r}" if kwargs else key
+
+    def _call(
+        self,
+        model_name: str,
+        runnable: Any,
+        input_given: LanguageModelInput,
+        config: RunnableConfig,
+        kwargs: dict,
+    ) -> Any:
+        """
+        `runnable.invoke`, shared with the identical calls to `model_name`
+        already in flight.
+        """
+
+        def call() -> Any:
+            start = time.monotonic()
+            try:
+                response = runnable.invoke(input_given, config, **kwargs)
+            except Exception as e:
+                self._record(model_name, start, e)
+                raise
+            self._record(model_name, start)
+            return response
+
+        key = self._flight_key(model_name, input_given, kwargs)
+        return call() if key is None else llm_single_flight.do(key, call)
+
+    async def _acall(
+        self,
+        model_name: str,
+        runnable: Any,
+        input_given: LanguageModelInput,
+        config: RunnableConfig,
+        kwargs: dict,
+    ) -> Any:
+        """Async `_call`."""
+
+        async def call() -> Any:
+            start = time.monotonic()
+            try:
+                response = await runnable.ainvoke(input_given, config, **kwargs)
+            except Exception as e:
+                self._record(model_name, start, e)
+                raise
+            self._record(model_name, start)
+            return response
+
+        key = self._flight_key(model_name, input_given, kwargs)
+        return await (call() if key is None else llm_single_flight.ado(key, call))
 
     @override
     def invoke(
@@ -107,28 +286,274 @@ class LLM(BaseChatModel):
     ) -> BaseMessage:
         config = ensure_config(config)
 
-        for model, model_name in zip(self._models, self._model_names):
-            if SIMULATE_ERRORS[model_name]:
-                raise RuntimeError(f"Simulating error in `{model_name}`")
+        response = self._cache_get(input_given)
+        if response is not None:
+            return response
 
-            if model is None:
-                continue
+        for model_name, runnable in self._runnables():
+            for attempt in self._attempts(model_name):
+                try:
+                    log_message(f"Attempt {attempt + 1} using {model_name}")
+                    response = self._call(
+                        model_name, runnable, input_given, config, kwargs
+                    )
+                except Exception as e:
+                    log_message(f"{model_name} failed on attempt {attempt + 1}: {e}")
+                    continue
+                self._cache_put(model_name, input_given, response)
+                return response
+
+        raise RuntimeError("All models failed, and user chose not to retry.")
+
+    @override
+    async def ainvoke(
+        self,
+        input_given: LanguageModelInput,
+        config: Optional[RunnableConfig] = None,
+        *,
+        stop: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> BaseMessage:
+        config = ensure_config(config)
 
-            for attempt in range(self.num_retries):  # Retry twice for each model
+        response = self._cache_get(input_given)
+        if response is not None:
+            return response
+
+        for model_name, runnable in self._runnables():
+            for attempt in self._attempts(model_name):
                 try:
                     log_message(f"Attempt {attempt + 1} using {model_name}")
-                    if self._schema_given:
-                        # print(f"using {model}")
-                        return model.with_structured_output(self._schema_given).invoke(
-                            input_given, config, **kwargs
-                        )  # type: ignore
-                    else:
-                        return model.invoke(input_given, config, **kwargs)
+                    response = await self._acall(
+                        model_name, runnable, input_given, config, kwargs
+                    )
                 except Exception as e:
-                    log_message(f"{model} failed on attempt {attempt + 1}: {e}")
+                    log_message(f"{model_name} failed on attempt {attempt + 1}: {e}")
+                    continue
+                self._cache_put(model_name, input_given, response)
+                return response
 
         raise RuntimeError("All models failed, and user chose not to retry.")
 
+    def _start_batch(self, inputs):
+        """
+        Results of a batch with the cached responses filled in, and the
+        inputs left to run.
+        """
+        results: list[Any] = [None] * len(inputs)
+        pending = []
+        for i, input_given in enumerate(inputs):
+            results[i] = self._cache_get(input_given)
+            if results[i] is None:
+                pending.append(i)
+        return results, pending
+
+    def _collect_batch(
+        self, model_name, attempt, start, inputs, pending, outputs, results, errors
+    ):
+        """
+        Store the `outputs` of the `pending` inputs in `results`, and return
+        the inputs that failed, to be retried. The batch counts as one call
+        for the health of the provider, failed if all its inputs failed.
+        """
+        failed = []
+        for i, output in zip(pending, outputs):
+            if isinstance(output, Exception):
+                errors[i] = output
+                failed.append(i)
+            else:
+                results[i] = output
+                self._cache_put(model_name, inputs[i], output)
+        self._record(
+            model_name, start, errors[failed[0]] if len(failed) == len(pending) else None
+        )
+        if failed:
+            log_message(
+                f"{model_name} failed on attempt {attempt + 1} for {len(failed)} "
+                f"of {len(pending)} inputs: {errors[failed[0]]}"
+            )
+        return failed
+
+    def _finish_batch(self, pending, results, errors, return_exceptions):
+        if pending and not return_exceptions:
+            raise RuntimeError("All models failed, and user chose not to retry.")
+        for i in pending:
+            results[i] = errors.get(
+                i, RuntimeError("All models failed, and user chose not to retry.")
+            )
+        return results
+
+    @override
+    def batch(
+        self,
+        inputs: list[LanguageModelInput],
+        config: Optional[Union[RunnableConfig, list[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> list[Any]:
+        """
+        Run all the inputs as one batch on the first model, then only the ones
+        that failed on the retries and the next models.
+        """
+        configs = get_config_list(config, len(inputs))
+        results, pending = self._start_batch(inputs)
+        errors: dict[int, Exception] = {}
+
+        for model_name, runnable in self._runnables():
+            for attempt in self._attempts(model_name):
+                if not pending:
+                    return results
+                log_message(
+                    f"Attempt {attempt + 1} using {model_name} for {len(pending)} inputs"
+                )
+                start = time.monotonic()
+                try:
+                    outputs = runnable.batch(
+                        [inputs[i] for i in pending],
+                        [configs[i] for i in pending],
+                        return_exceptions=True,
+                        **kwargs,
+                    )
+                except Exception as e:
+                    outputs = [e] * len(pending)
+                pending = self._collect_batch(
+                    model_name,
+                    attempt,
+                    start,
+                    inputs,
+                    pending,
+                    outputs,
+                    results,
+                    errors,
+                )
+
+        return self._finish_batch(pending, results, errors, return_exceptions)
+
+    @override
+    async def abatch(
+        self,
+        inputs: list[LanguageModelInput],
+        config: Optional[Union[RunnableConfig, list[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> list[Any]:
+        """Async `batch`."""
+        configs = get_config_list(config, len(inputs))
+        results, pending = self._start_batch(inputs)
+        errors: dict[int, Exception] = {}
+
+        for model_name, runnable in self._runnables():
+            for attempt in self._attempts(model_name):
+                if not pending:
+                    return results
+                log_message(
+                    f"Attempt {attempt + 1} using {model_name} for {len(pending)} inputs"
+                )
+                start = time.monotonic()
+                try:
+                    outputs = await runnable.abatch(
+                        [inputs[i] for i in pending],
+                        [configs[i] for i in pending],
+                        return_exceptions=True,
+                        **kwargs,
+                    )
+                except Exception as e:
+                    outputs = [e] * len(pending)
+                pending = self._collect_batch(
+                    model_name,
+                    attempt,
+                    start,
+                    inputs,
+                    pending,
+                    outputs,
+                    results,
+                    errors,
+                )
+
+        return self._finish_batch(pending, results, errors, return_exceptions)
+
+    @override
+    def stream(
+        self,
+        input_given: LanguageModelInput,
+        config: Optional[RunnableConfig] = None,
+        *,
+        stop: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[Any]:
+        """
+        Stream from the first model that starts answering. A model failing
+        after its first chunk was yielded cannot be replaced, so the error is
+        raised.
+        """
+        config = ensure_config(config)
+
+        for model_name, runnable in self._runnables():
+            for attempt in self._attempts(model_name):
+                started = False
+                start = time.monotonic()
+                try:
+                    log_message(f"Attempt {attempt + 1} using {model_name}")
+                    for chunk in runnable.stream(input_given, config, **kwargs):
+                        if not started:
+                            # The latency of a stream is that of its first chunk
+                            self._record(model_name, start)
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    self._record(model_name, start, e)
+                    if started:
+                        raise
+                    log_message(f"{model_name} failed on attempt {attempt + 1}: {e}")
+
+        raise RuntimeError("All models failed, and user chose not to retry.")
+
+    @override
+    async def astream(
+        self,
+        input_given: LanguageModelInput,
+        config: Optional[RunnableConfig] = None,
+        *,
+        stop: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[Any]:
+        """Async `stream`."""
+        config = ensure_config(config)
+
+        for model_name, runnable in self._runnables():
+            for attempt in self._attempts(model_name):
+                started = False
+                start = time.monotonic()
+                try:
+                    log_message(f"Attempt {attempt + 1} using {model_name}")
+                    async for chunk in runnable.astream(input_given, config, **kwargs):
+                        if not started:
+                            # The latency of a stream is that of its first chunk
+                            self._record(model_name, start)
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    self._record(model_name, start, e)
+                    if started:
+                        raise
+                    log_message(f"{model_name} failed on attempt {attempt + 1}: {e}")
+
+        raise RuntimeError("All models failed, and user chose not to retry.")
+
+    def with_cache(self, call_site: str) -> "LLM":
+        """
+        Copy of this LLM caching its structured responses on disk under
+        `call_site`, for deterministic calls that recur verbatim (see
+        `response_cache.LLMResponseCache`).
+        """
+        new_instance = self.model_copy(deep=False)
+        new_instance._cache_call_site = call_site
+        return new_instance
+
     @override
     def with_structured_output(
         self,
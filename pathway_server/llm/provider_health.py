@@ -0,0 +1,241 @@
+import threading
+import time
+from typing import Callable
+
+import config
+from utils import log_message
+
+HEALTHY = "healthy"
+DEGRADED = "degraded"
+BACKOFF = "backoff"
+
+_RANKS = {HEALTHY: 0, DEGRADED: 1, BACKOFF: 2}
+
+# Words of the exception class names of transport errors, timeouts and 5xx
+_PROVIDER_ERROR_WORDS = (
+    "Timeout",
+    "Connection",
+    "Transport",
+    "ServerError",
+    "Unavailable",
+    "Overloaded",
+)
+
+
+def _status_code(error: Exception) -> int | None:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+
+def is_rate_limit(error: Exception) -> bool:
+    return (
+        _status_code(error) == 429
+        or "RateLimit" in type(error).__name__
+        or "rate limit" in str(error).lower()
+    )
+
+
+def is_provider_error(error: Exception) -> bool:
+    """
+    Whether `error` is the provider's fault: a rate limit, a 5xx answer, a
+    timeout or a transport error. Other errors, e.g. a structured output that
+    does not parse or validate, or a rejected request, say nothing about the
+    health of the provider.
+    """
+    status_code = _status_code(error)
+    if isinstance(status_code, int) and status_code >= 500:
+        return True
+    if is_rate_limit(error) or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # The clients' own classes, e.g. openai.APIConnectionError (and its
+    # APITimeoutError), httpx.TransportError or anthropic.InternalServerError
+    return any(
+        word in cls.__name__
+        for cls in type(error).__mro__
+        for word in _PROVIDER_ERROR_WORDS
+    )
+
+
+def retry_after(error: Exception) -> float | None:
+    """The delay asked for by the `Retry-After` header of a rate-limit error."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderHealth:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.error_rate = 0.0
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.backoff_until = None
+        self.backoff = None
+        self.last_error = None
+
+
+class ProviderHealthRegistry:
+    """
+    Health of every LLM provider, shared by all the `LLM` instances and their
+    `with_structured_output` copies.
+
+    Every call updates the error rate and latency of its provider (both
+    exponentially weighted moving averages). Only errors for which
+    `is_provider_error` holds count as failures. A provider is:
+    - "backoff" after `LLM_HEALTH_FAILURES_BEFORE_BACKOFF` consecutive
+      failures or a rate-limit error, until a background probe succeeds. The
+      first probe is sent once the backoff delay (the `Retry-After` of a
+      rate-limit error, or exponential) is over.
+    - "degraded" if its error rate is above `LLM_HEALTH_MAX_ERROR_RATE` or
+      its latency above `LLM_HEALTH_SLOW_LATENCY`.
+    - "healthy" otherwise.
+    `order` puts the healthy providers first, then the degraded ones, and the
+    ones in backoff last, so they are only called when all the others failed.
+    """
+
+    def __init__(self):
+        self._health: dict[str, ProviderHealth] = {}
+        self._probes: dict[str, Callable[[], object]] = {}
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def _get(self, name: str) -> ProviderHealth:
+        health = self._health.get(name)
+        if health is None:
+            health = self._health[name] = ProviderHealth()
+        return health
+
+    def register_probe(self, name: str, probe: Callable[[], object]) -> None:
+        """Set the cheap call used to check whether `name` is back."""
+        with self._lock:
+            self._probes[name] = probe
+
+    def state(self, name: str) -> str:
+        with self._lock:
+            return self._state(self._get(name))
+
+    def _state(self, health: ProviderHealth) -> str:
+        if health.backoff_until is not None:
+            return BACKOFF
+        if health.error_rate > config.LLM_HEALTH_MAX_ERROR_RATE or (
+            health.ewma_latency is not None
+            and health.ewma_latency > config.LLM_HEALTH_SLOW_LATENCY
+        ):
+            return DEGRADED
+        return HEALTHY
+
+    def order(self, names: list[str]) -> list[str]:
+        """`names` sorted by health, keeping the given order among equals."""
+        with self._lock:
+            ranks = {name: _RANKS[self._state(self._get(name))] for name in names}
+        return sorted(names, key=lambda name: ranks[name])
+
+    def record_success(self, name: str, latency: float) -> None:
+        alpha = config.LLM_HEALTH_EWMA_ALPHA
+        with self._lock:
+            health = self._get(name)
+            health.requests += 1
+            health.error_rate *= 1 - alpha
+            health.ewma_latency = (
+                latency
+                if health.ewma_latency is None
+                else alpha * latency + (1 - alpha) * health.ewma_latency
+            )
+            health.consecutive_failures = 0
+            if health.backoff_until is not None:
+                log_message(f"LLM provider {name} is back")
+                health.backoff_until = None
+                health.backoff = None
+
+    def record_failure(self, name: str, error: Exception) -> None:
+        alpha = config.LLM_HEALTH_EWMA_ALPHA
+        with self._lock:
+            health = self._get(name)
+            health.requests += 1
+            health.errors += 1
+            health.error_rate = alpha + (1 - alpha) * health.error_rate
+            health.consecutive_failures += 1
+            health.last_error = repr(error)
+            rate_limited = is_rate_limit(error)
+            if rate_limited or (
+                health.consecutive_failures
+                >= config.LLM_HEALTH_FAILURES_BEFORE_BACKOFF
+            ):
+                self._start_backoff(name, health, retry_after(error) if rate_limited else None)
+
+    def _start_backoff(self, name, health: ProviderHealth, delay: float | None):
+        if delay is None:
+            health.backoff = min(
+                2 * health.backoff if health.backoff else config.LLM_HEALTH_BACKOFF_BASE,
+                config.LLM_HEALTH_BACKOFF_MAX,
+            )
+            delay = health.backoff
+        health.backoff_until = time.monotonic() + delay
+        log_message(f"LLM provider {name} backs off for {delay:.0f}s: {health.last_error}")
+        if self._prober is None or not self._prober.is_alive():
+            self._prober = threading.Thread(target=self._probe_loop, daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        """Probe the providers in backoff once their delay is over, until all
+        of them are back."""
+        while True:
+            time.sleep(config.LLM_HEALTH_PROBE_INTERVAL)
+            with self._lock:
+                now = time.monotonic()
+                due = [
+                    name
+                    for name, health in self._health.items()
+                    if health.backoff_until is not None and health.backoff_until <= now
+                ]
+                waiting = any(
+                    health.backoff_until is not None for health in self._health.values()
+                )
+                if not waiting:
+                    self._prober = None
+                    return
+            for name in due:
+                probe = self._probes.get(name)
+                if probe is None:
+                    # Nothing to probe with, let the next call try it again
+                    with self._lock:
+                        self._health[name].backoff_until = None
+                    continue
+                start = time.monotonic()
+                try:
+                    probe()
+                except Exception as e:
+                    with self._lock:
+                        health = self._health[name]
+                        health.last_error = repr(e)
+                        self._start_backoff(name, health, None)
+                    continue
+                self.record_success(name, time.monotonic() - start)
+
+    def statistics(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                name: {
+                    "state": self._state(health),
+                    "requests": health.requests,
+                    "errors": health.errors,
+                    "error_rate": health.error_rate,
+                    "ewma_latency": health.ewma_latency,
+                    "backoff_remaining": (
+                        max(health.backoff_until - now, 0.0)
+                        if health.backoff_until is not None
+                        else None
+                    ),
+                    "last_error": health.last_error,
+                }
+                for name, health in self._health.items()
+            }
+
+
+provider_health = ProviderHealthRegistry()
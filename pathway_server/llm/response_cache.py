@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from pydantic import BaseModel
+
+import config
+from utils import log_message
+
+
+def _message_text(message: Any) -> tuple[str, str]:
+    if isinstance(message, (tuple, list)):
+        role, content = message
+    else:
+        role, content = message.type, message.content
+    # Whitespace differences do not change the answer
+    return str(role), " ".join(str(content).split())
+
+
+def normalize_prompt(input: Any) -> list[tuple[str, str]]:
+    """(role, content) of every message of an LLM input, whitespace collapsed."""
+    if isinstance(input, str):
+        return [("human", " ".join(input.split()))]
+    if hasattr(input, "to_messages"):
+        input = input.to_messages()
+    return [_message_text(message) for message in input]
+
+
+def describe_schema(schema: Any) -> Any:
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        return schema.model_json_schema()
+    if isinstance(schema, dict):
+        return schema
+    return repr(schema)
+
+
+def describe_model(model: Any) -> str:
+    return str(getattr(model, "model_name", None) or getattr(model, "model", ""))
+
+
+def request_key(provider: str, model: Any, schema: Any, input: Any) -> str:
+    """Hash of the provider, model, output schema and normalised prompt."""
+    description = json.dumps(
+        {
+            "provider": provider,
+            "model": describe_model(model),
+            "schema": describe_schema(schema),
+            "prompt": normalize_prompt(input),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent cache of structured LLM responses, in sqlite.
+
+    Responses are keyed on the provider and model that produced them, the
+    output schema and the normalised prompt. Only call sites that opt in
+    with `LLM.with_cache` use it, each with its own time to live
+    (`config.LLM_RESPONSE_CACHE_TTLS`). Above `max_entries` entries, the
+    least recently used ones are evicted. The size is only checked every
+    `eviction_interval` insertions and the last access of an entry is only
+    updated once it is `access_resolution` seconds old, so it may briefly
+    exceed `max_entries` and the order of recent entries is approximate.
+    Hits and misses are counted per call site, see `statistics`.
+
+    The database is shared by the server processes, in WAL mode. A database
+    error (e.g. still locked after `timeout` seconds) or a response that no
+    longer deserialises is logged and treated as a miss, or the write is
+    skipped, so that it never fails the LLM call.
+    """
+
+    def __init__(
+        self,
+        db_file: str = config.LLM_RESPONSE_CACHE_FILE,
+        max_entries: int = config.LLM_RESPONSE_CACHE_MAX_ENTRIES,
+        ttls: dict = config.LLM_RESPONSE_CACHE_TTLS,
+        timeout: float = config.LLM_RESPONSE_CACHE_TIMEOUT,
+        access_resolution: float = config.LLM_RESPONSE_CACHE_ACCESS_RESOLUTION,
+        eviction_interval: int = config.LLM_RESPONSE_CACHE_EVICTION_INTERVAL,
+    ):
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.access_resolution = access_resolution
+        self.eviction_interval = eviction_interval
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict[str, int]] = {}
+        self.evictions = 0
+        if os.path.dirname(db_file):
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self._conn = sqlite3.connect(
+            db_file, timeout=timeout, check_same_thread=False
+        )
+        # Readers do not block the writer of another process
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                call_site TEXT,
+                response TEXT,
+                created_at REAL,
+                last_access REAL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access "
+            "ON responses (last_access)"
+        )
+        self._conn.commit()
+
+    def ttl(self, call_site: str) -> float:
+        return self.ttls.get(call_site, self.ttls["default"])
+
+    def key(self, provider: str, model: Any, schema: Any, input: Any) -> str:
+        return request_key(provider, model, schema, input)
+
+    def _count(self, call_site: str, outcome: str) -> None:
+        stats = self._stats.setdefault(call_site, {"hits": 0, "misses": 0})
+        stats[outcome] += 1
+
+    def get(self, keys: list[str], call_site: str, schema: Any) -> Any:
+        """
+        The response cached under the first of `keys` that is present and not
+        expired, or None.
+        """
+        try:
+            response = self._get(keys, call_site)
+            if response is not None and (
+                isinstance(schema, type) and issubclass(schema, BaseModel)
+            ):
+                response = schema.model_validate(response)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            log_message(f"Error reading the cached LLM response of {call_site}: {e}")
+            response = None
+        with self._lock:
+            self._count(call_site, "misses" if response is None else "hits")
+        return response
+
+    def _get(self, keys: list[str], call_site: str) -> Any:
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT response, created_at, last_access FROM responses "
+                    "WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    continue
+                if now - row[1] > self.ttl(call_site):
+                    self._write("DELETE FROM responses WHERE key = ?", (key,))
+                    continue
+                if now - row[2] > self.access_resolution:
+                    self._write(
+                        "UPDATE responses SET last_access = ? WHERE key = ?",
+                        (now, key),
+                    )
+                return json.loads(row[0])
+        return None
+
+    def _write(self, statement: str, parameters: tuple) -> None:
+        """Run a write statement and commit it, rolled back on error."""
+        try:
+            self._conn.execute(statement, parameters)
+            self._conn.commit()
+        except sqlite3.Error:
+            self._conn.rollback()
+            raise
+
+    def put(self, key: str, call_site: str, response: Any) -> None:
+        try:
+            if isinstance(response, BaseModel):
+                response = response.model_dump(mode="json")
+            response = json.dumps(response)
+        except (TypeError, ValueError) as e:
+            log_message(f"Error caching the LLM response of {call_site}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._write(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key, call_site, response, now, now),
+                )
+                self._puts += 1
+                if self._puts % self.eviction_interval != 0:
+                    return
+                excess = (
+                    self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                    - self.max_entries
+                )
+                if excess > 0:
+                    self._write(
+                        "DELETE FROM responses WHERE key IN (SELECT key FROM "
+                        "responses ORDER BY last_access LIMIT ?)",
+                        (excess,),
+                    )
+                    self.evictions += excess
+            except sqlite3.Error as e:
+                log_message(f"Error caching the LLM response of {call_site}: {e}")
+
+    def statistics(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            call_sites = {}
+            for call_site, stats in self._stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                call_sites[call_site] = {
+                    **stats,
+                    "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+                }
+            return {
+                "size": size,
+                "evictions": self.evictions,
+                "call_sites": call_sites,
+            }
+
+
+llm_response_cache = LLMResponseCache() if config.LLM_RESPONSE_CACHE else None
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable
+
+import config
+
+
+class SingleFlight:
+    """
+    Deduplication of identical calls in flight: the first caller of a key runs
+    the call, the callers arriving with the same key before it returns wait
+    for it and all of them get its result (or exception).
+
+    Sync calls are shared across threads and async calls across the tasks of
+    an event loop. An async call runs in its own task, so cancelling the
+    caller that started it does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}
+        self._tasks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key: str, call: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                self.calls += 1
+                future = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = call()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def _get_tasks(self) -> dict[str, asyncio.Task]:
+        # Tasks cannot be awaited from another event loop
+        loop = asyncio.get_running_loop()
+        tasks = self._tasks.get(loop)
+        if tasks is None:
+            tasks = self._tasks[loop] = {}
+        return tasks
+
+    async def ado(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        tasks = self._get_tasks()
+        task = tasks.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            self.calls += 1
+            task = tasks[key] = asyncio.ensure_future(call())
+
+            def done(task: asyncio.Task) -> None:
+                del tasks[key]
+                if not task.cancelled():
+                    # retrieved, even if all the callers were cancelled
+                    task.exception()
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    def statistics(self) -> dict:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "shared_rate": self.shared / (self.calls + self.shared)
+            if self.calls + self.shared
+            else 0.0,
+        }
+
+
+llm_single_flight = SingleFlight() if config.LLM_SINGLE_FLIGHT else None
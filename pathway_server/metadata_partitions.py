@@ -0,0 +1,145 @@
+import json
+import re
+
+import numpy as np
+
+import config
+
+# `key == \`value\`` as built by the client, or `key == 'value'` once the
+# document store has turned the JSON literals into raw strings
+_CONDITION_PATTERN = re.compile(
+    r"^\s*([\w ]+?)\s*==\s*(?:`([^`]*)`|'((?:[^'\\]|\\.)*)')\s*$"
+)
+_ESCAPE_PATTERN = re.compile(r"\\(.)")
+
+
+def _typed(value) -> tuple:
+    """
+    Hashable form of a JSON value such that two values are equal if and only
+    if JMESPath's `==` finds them equal: `2021` and `"2021"` differ, and so do
+    `1` and `true`, while `2021` and `2021.0` are equal.
+    """
+    if isinstance(value, bool):
+        return ("boolean", value)
+    if isinstance(value, (int, float)):
+        return ("number", value)
+    if isinstance(value, str):
+        return ("string", value)
+    return ("json", json.dumps(value, sort_keys=True))
+
+
+def _literal(value: str):
+    """Value of a JMESPath `literal`: JSON, or a string if it is not valid JSON."""
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def parse_filter(metadata_filter: str | None) -> list[list[tuple[str, tuple]]] | None:
+    """
+    Clauses of a metadata filter built by `nodes.convert_metadata_to_jmespath`,
+    i.e. `key == \\`value\\`` conditions joined by `||` inside parentheses and
+    by `&&` outside. The form the Pathway document store passes to its index
+    is read too: the whole filter in parentheses and `'value'` raw strings.
+    Every clause is the list of (key, value) conditions of which at least one
+    must hold, the values typed as JMESPath reads them (see `_typed`): a JSON
+    literal keeps its type, a raw string is a string. None if there is no
+    filter.
+
+    Raises:
+        ValueError: if the filter is not of that form
+    """
+    if metadata_filter is None or metadata_filter.strip() == "":
+        return None
+    clauses = []
+    for part in metadata_filter.split("&&"):
+        # the values are quoted, so the parentheses are the outer ones
+        part = part.strip().lstrip("(").rstrip(")").strip()
+        if part == "":
+            # a list of values that were all unknown
+            continue
+        clause = []
+        for condition in part.split("||"):
+            match = _CONDITION_PATTERN.match(condition)
+            if match is None:
+                raise ValueError(f"Unsupported metadata filter: {metadata_filter}")
+            if match.group(2) is not None:
+                value = _literal(match.group(2))
+            else:
+                value = _ESCAPE_PATTERN.sub(r"\1", match.group(3))
+            clause.append((match.group(1).strip(), _typed(value)))
+        clauses.append(clause)
+    return clauses
+
+
+def matches(clauses: list[list[tuple[str, tuple]]] | None, metadata: dict) -> bool:
+    """Whether `metadata` satisfies the clauses of `parse_filter`."""
+    if clauses is None:
+        return True
+    return all(
+        any(_typed(metadata.get(key)) == value for key, value in clause)
+        for clause in clauses
+    )
+
+
+class PartitionIndex:
+    """
+    Posting lists of the rows of a vector index, per value of each partition
+    key (by default `company_name` and `year`).
+
+    `rows` turns a filter into the rows it can match, so that a filtered
+    search only scans the matching (company, year) partitions instead of
+    evaluating the filter on every vector.
+    """
+
+    def __init__(self, keys: tuple[str, ...] = config.INDEX_PARTITION_KEYS):
+        self.keys = keys
+        self._postings: dict[tuple[str, tuple], set[int]] = {}
+
+    def add(self, row: int, metadata: dict) -> None:
+        for key in self.keys:
+            if key in metadata:
+                self._postings.setdefault((key, _typed(metadata[key])), set()).add(
+                    row
+                )
+
+    def remove(self, row: int, metadata: dict) -> None:
+        """Remove `row`, added with `metadata`, from its posting lists."""
+        for key in self.keys:
+            if key in metadata:
+                condition = (key, _typed(metadata[key]))
+                postings = self._postings.get(condition)
+                if postings is None:
+                    continue
+                postings.discard(row)
+                if len(postings) == 0:
+                    del self._postings[condition]
+
+    def is_partition_clause(self, clause: list[tuple[str, tuple]]) -> bool:
+        return len({key for key, _ in clause}) == 1 and clause[0][0] in self.keys
+
+    def rows(self, clauses: list[list[tuple[str, tuple]]] | None) -> np.ndarray | None:
+        """
+        Sorted rows that can satisfy `clauses`, using only the clauses on a
+        single partition key. None if no clause constrains a partition key, in
+        which case the whole index must be searched.
+        """
+        rows = None
+        for clause in clauses or []:
+            if not self.is_partition_clause(clause):
+                continue
+            clause_rows = np.unique(
+                np.concatenate(
+                    [
+                        np.fromiter(self._postings.get(condition, ()), dtype=np.int64)
+                        for condition in clause
+                    ]
+                )
+            )
+            rows = (
+                clause_rows
+                if rows is None
+                else np.intersect1d(rows, clause_rows, assume_unique=True)
+            )
+        return rows
@@ -1,13 +1,28 @@
 import pathway as pw
 from pathway.xpacks.llm.document_store import DocumentStore
-from pathway.xpacks.llm.servers import DocumentStoreServer
+from document_store_server import BatchDocumentStoreServer
 import aiohttp
 import aiohttp_cors
+import asyncio
 import random
-import requests
-import json
 import os
+import time
 import multiprocessing
+import config
+
+# Headers that only make sense for a single connection and must not be
+# forwarded by the proxy
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
 
 
 class MultiDocumentServer:
@@ -30,75 +45,204 @@ class MultiDocumentServer:
         self.document_store2 = document_store2
         self.server1_cache_dir = server1_cache_dir
         self.server2_cache_dir = server2_cache_dir
+        self.server1_url = f"http://{self.host}:{self.server1_port}"
+        self.server2_url = f"http://{self.host}:{self.server2_port}"
+        # Filled in by the background health checker, read by the handlers
+        self.server_status = {self.server1_url: False, self.server2_url: False}
+        # Load and latency of every server, used for routing and `/v1/proxy_stats`
+        self.server_stats = {
+            url: {
+                "in_flight": 0,
+                "ewma_latency": None,
+                "requests": 0,
+                "errors": 0,
+            }
+            for url in self.server_status
+        }
+        self.session = None
+        self._health_check_task = None
+        self._recheck = None
 
-    def check_server_status(self, url):
+    async def check_server_status(self, url):
         stat_url = url + "/v1/statistics"
         try:
-            response = requests.post(
+            async with self.session.post(
                 stat_url,
                 json={},
-                headers={"Content-Type": "application/json"},
-                timeout=2,
-            )
-            responses = response.json()
+                timeout=aiohttp.ClientTimeout(
+                    total=config.MULTI_SERVER_HEALTH_CHECK_TIMEOUT
+                ),
+            ) as response:
+                await response.json(content_type=None)
             return True
         except Exception as e:
             print(f"Error: {e}")
             return False
 
-    async def handle_request(self, request):
-        server1_url = f"http://{self.host}:{self.server1_port}"
-        server2_url = f"http://{self.host}:{self.server2_port}"
+    async def refresh_server_status(self):
+        statuses = await asyncio.gather(
+            *[self.check_server_status(url) for url in self.server_status]
+        )
+        for url, status in zip(list(self.server_status), statuses):
+            if self.server_status[url] != status:
+                print(f"Server {url} is {'up' if status else 'down'}")
+            self.server_status[url] = status
 
-        server1_status = self.check_server_status(server1_url)
-        server2_status = self.check_server_status(server2_url)
+    async def _health_check_loop(self):
+        while True:
+            await self.refresh_server_status()
+            try:
+                await asyncio.wait_for(
+                    self._recheck.wait(),
+                    timeout=config.MULTI_SERVER_HEALTH_CHECK_INTERVAL,
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._recheck.clear()
 
-        if server1_status and server2_status:
-            print("Both servers are up")
-            remote_url = (
-                random.choice([server1_url, server2_url]) + request.rel_url.path_qs
-            )
-            print(f"Selected server: {remote_url}")
-        elif server1_status:
-            print("Server 1 is up")
-            remote_url = server1_url + request.rel_url.path_qs
-        elif server2_status:
-            print("Server 2 is up")
-            remote_url = server2_url + request.rel_url.path_qs
+    def mark_server_down(self, url):
+        self.server_status[url] = False
+        self._recheck.set()
+
+    async def on_startup(self, app):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=config.MULTI_SERVER_CONNECTION_LIMIT
+            ),
+            timeout=aiohttp.ClientTimeout(total=config.MULTI_SERVER_TIMEOUT),
+            # pass the upstream bytes through untouched
+            auto_decompress=False,
+        )
+        self._recheck = asyncio.Event()
+        await self.refresh_server_status()
+        self._health_check_task = asyncio.create_task(self._health_check_loop())
+
+    async def on_cleanup(self, app):
+        self._health_check_task.cancel()
+        try:
+            await self._health_check_task
+        except asyncio.CancelledError:
+            pass
+        await self.session.close()
+
+    def get_active_servers(self):
+        return [url for url, status in self.server_status.items() if status]
+
+    def select_server(self, servers):
+        """
+        Pick the server to send the next request to, following
+        `config.MULTI_SERVER_ROUTING_POLICY`:
+            - "random": uniformly among the healthy servers
+            - "least_loaded": fewest in-flight requests, ties broken by latency
+            - "ewma": lowest EWMA latency weighted by the in-flight requests
+        Servers without a latency sample yet are tried first under "ewma".
+        """
+        policy = config.MULTI_SERVER_ROUTING_POLICY
+        if policy == "random" or len(servers) == 1:
+            return random.choice(servers)
+
+        def latency(url):
+            ewma = self.server_stats[url]["ewma_latency"]
+            return 0.0 if ewma is None else ewma
+
+        if policy == "least_loaded":
+            key = lambda url: (self.server_stats[url]["in_flight"], latency(url))
+        elif policy == "ewma":
+            key = lambda url: latency(url) * (self.server_stats[url]["in_flight"] + 1)
+        else:
+            raise ValueError(f"Unknown routing policy: {policy}")
+
+        best = min(key(url) for url in servers)
+        return random.choice([url for url in servers if key(url) == best])
+
+    def record_latency(self, url, latency):
+        stats = self.server_stats[url]
+        if stats["ewma_latency"] is None:
+            stats["ewma_latency"] = latency
         else:
+            alpha = config.MULTI_SERVER_EWMA_ALPHA
+            stats["ewma_latency"] = alpha * latency + (1 - alpha) * stats["ewma_latency"]
+
+    async def handle_request(self, request):
+        servers = self.get_active_servers()
+        if len(servers) == 0:
             print("Both servers are down")
             return aiohttp.web.Response(status=500, text="Both servers are down")
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector()) as session:
-            # Send the request to the remote URL using the same method
-            body = await request.read()
-            async with session.request(
-                request.method, remote_url, headers=request.headers, data=body
-            ) as resp:
-                if resp.content_type == "application/json":
-                    print("JSON response")
-                    response_json = await resp.json()  # Parse JSON response
-                    return aiohttp.web.Response(
+        headers = {
+            key: value
+            for key, value in request.headers.items()
+            if key.lower() not in HOP_BY_HOP_HEADERS
+        }
+        # Requests are small JSON bodies, reading them once lets us retry on the
+        # other server if the selected one turns out to be down
+        body = await request.read()
+
+        while len(servers) > 0:
+            server_url = self.select_server(servers)
+            servers.remove(server_url)
+            remote_url = server_url + request.rel_url.path_qs
+            stats = self.server_stats[server_url]
+            stats["in_flight"] += 1
+            stats["requests"] += 1
+            response = None
+            try:
+                start = time.perf_counter()
+                async with self.session.request(
+                    request.method, remote_url, headers=headers, data=body
+                ) as resp:
+                    # Time to the response headers, i.e. how long the server
+                    # took to answer, independent of the response size
+                    latency = time.perf_counter() - start
+                    if resp.status >= 500:
+                        stats["errors"] += 1
+                        latency = max(latency, config.MULTI_SERVER_ERROR_PENALTY)
+                    self.record_latency(server_url, latency)
+                    response = aiohttp.web.StreamResponse(
                         status=resp.status,
-                        body=json.dumps(
-                            response_json
-                        ),  # Convert dict back to string (for returning as body)
-                        headers=resp.headers,
-                    )
-                else:
-                    # Handle non-JSON responses (like text, html, etc.)
-                    text = await resp.text()
-                    print("Non-JSON response")
-                    return aiohttp.web.Response(
-                        status=resp.status, text=text, headers=resp.headers
+                        headers={
+                            key: value
+                            for key, value in resp.headers.items()
+                            if key.lower() not in HOP_BY_HOP_HEADERS
+                        },
                     )
+                    await response.prepare(request)
+                    async for chunk in resp.content.iter_any():
+                        await response.write(chunk)
+                    await response.write_eof()
+                    return response
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                stats["errors"] += 1
+                # Failed requests count as slow ones, so that the routing moves
+                # away from the server even before it is marked down
+                self.record_latency(
+                    server_url,
+                    max(time.perf_counter() - start, config.MULTI_SERVER_ERROR_PENALTY),
+                )
+                # Part of the answer was already sent, it cannot be retried
+                if response is not None and response.prepared:
+                    raise
+                print(f"Error: {e!r}")
+                self.mark_server_down(server_url)
+            finally:
+                stats["in_flight"] -= 1
 
-    async def handle_health_check(self, request):
-        server1_url = f"http://{self.host}:{self.server1_port}"
-        server2_url = f"http://{self.host}:{self.server2_port}"
+        return aiohttp.web.Response(status=502, text="No server could be reached")
 
-        server1_status = self.check_server_status(server1_url)
-        server2_status = self.check_server_status(server2_url)
+    async def handle_proxy_stats(self, request):
+        return aiohttp.web.json_response(
+            {
+                "policy": config.MULTI_SERVER_ROUTING_POLICY,
+                "servers": {
+                    url: {"up": self.server_status[url], **self.server_stats[url]}
+                    for url in self.server_status
+                },
+            }
+        )
+
+    async def handle_health_check(self, request):
+        server1_status = self.server_status[self.server1_url]
+        server2_status = self.server_status[self.server2_url]
 
         if server1_status and server2_status:
             return aiohttp.web.Response(status=200, text="both")
@@ -111,7 +255,7 @@ class MultiDocumentServer:
 
     def run_server1(self):
         # Running server1 with its own cache backend in a separate process
-        server1 = DocumentStoreServer(
+        server1 = BatchDocumentStoreServer(
             host=self.host,
             port=self.server1_port,
             document_store=self.document_store1,
@@ -123,7 +267,7 @@ class MultiDocumentServer:
 
     def run_server2(self):
         # Running server1 with its own cache backend in a separate process
-        server2 = DocumentStoreServer(
+        server2 = BatchDocumentStoreServer(
             host=self.host,
             port=self.server2_port,
             document_store=self.document_store2,
@@ -142,10 +286,14 @@ class MultiDocumentServer:
         process2.start()
 
         app = aiohttp.web.Application()
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
         app.router.add_route("*", "/v1/statistics", self.handle_request)
         app.router.add_route("*", "/v1/retrieve", self.handle_request)
+        app.router.add_route("*", "/v1/retrieve_batch", self.handle_request)
         app.router.add_route("*", "/v1/inputs", self.handle_request)
         app.router.add_route("*", "/v1/health", self.handle_health_check)
+        app.router.add_route("GET", "/v1/proxy_stats", self.handle_proxy_stats)
 
         aiohttp_cors.setup(app)
         aiohttp.web.run_app(app, host=self.host, port=self.proxy_port)
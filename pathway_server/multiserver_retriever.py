@@ -4,14 +4,149 @@ from typing import Optional
 from pathway.xpacks.llm.vector_store import VectorStoreClient
 from typing import Any, Optional
 
-import requests
 import json
+import threading
+import time
 import config
 import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
 from langchain_core.documents import Document
 from retriever import PathwayVectorStoreClient
 
 
+class ServerHealthMonitor:
+    """
+    Keeps the status of a set of vector store servers fresh in a background
+    thread, so that the query path reads a cached status instead of probing
+    the servers inline.
+
+    Every `interval` seconds each server is probed on `/v1/statistics` (is it
+    up) and `/v1/health` (which backends a multiserver proxy can reach). A
+    failure reported by the query path marks the server down and triggers an
+    immediate re-probe.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        session,
+        interval: float = config.VECTOR_STORE_HEALTH_CHECK_INTERVAL,
+        timeout: float = config.VECTOR_STORE_HEALTH_CHECK_TIMEOUT,
+    ):
+        self.urls = urls
+        self.session = session
+        self.interval = interval
+        self.timeout = timeout
+        # Until the first probe completes, servers are assumed to be up
+        self._status = {
+            url: {"up": True, "health": None, "checked_at": None} for url in urls
+        }
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="vector-store-health", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _probe(self, url):
+        try:
+            response = self.session.post(
+                url + "/v1/statistics",
+                json={},
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout,
+            )
+            response.json()
+            up = True
+        except Exception:
+            up = False
+
+        health = None
+        if up:
+            try:
+                response = self.session.post(
+                    url + "/v1/health",
+                    json={},
+                    headers={"Content-Type": "application/json"},
+                    timeout=self.timeout,
+                )
+                if response.status_code != 404:
+                    health = response.text
+            except Exception:
+                pass
+        else:
+            health = "none"
+        return up, health
+
+    def refresh(self):
+        """Probe every server once and update the cached status."""
+        for url in self.urls:
+            up, health = self._probe(url)
+            with self._lock:
+                if self._status[url]["up"] != up:
+                    print(f"Server {url} is {'up' if up else 'down'}")
+                self._status[url] = {
+                    "up": up,
+                    "health": health,
+                    "checked_at": time.time(),
+                }
+
+    def report_failure(self, url):
+        """Mark `url` down until the next probe and schedule that probe now."""
+        with self._lock:
+            self._status[url] = {**self._status[url], "up": False, "health": "none"}
+        self._wake.set()
+
+    def is_up(self, url) -> bool:
+        self.start()
+        with self._lock:
+            return self._status[url]["up"]
+
+    def get_health(self, url) -> str | None:
+        """Last `/v1/health` answer of `url`, or None if unknown."""
+        self.start()
+        with self._lock:
+            return self._status[url]["health"]
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {url: dict(status) for url, status in self._status.items()}
+
+
+def deduplicate_documents(docs: list[Document]) -> list[Document]:
+    """Drop documents with the same text and source file, keeping the first."""
+    seen = set()
+    unique_docs = []
+    for doc in docs:
+        key = (doc.page_content, doc.metadata.get("path"))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique_docs.append(doc)
+    return unique_docs
+
+
 class CustomPathwayVectorStoreClient:
     def __init__(
         self,
@@ -28,28 +163,28 @@ class CustomPathwayVectorStoreClient:
         self.url1 = server1_url
         self.url2 = server2_url
         self.timeout = timeout
+        self.session = PathwayVectorStoreClient.get_session()
+        self.health_monitor = ServerHealthMonitor(
+            [server1_url, server2_url], self.session
+        )
+        # Recent similarity_search latencies per server, used to pick the
+        # hedging delay
+        self.latencies = {
+            server1_url: deque(maxlen=config.VECTOR_STORE_HEDGE_WINDOW),
+            server2_url: deque(maxlen=config.VECTOR_STORE_HEDGE_WINDOW),
+        }
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=config.VECTOR_STORE_HEDGE_MAX_WORKERS,
+            thread_name_prefix="vector-store-hedge",
+        )
 
     def check_server_status(self, url):
-        stat_url = url + "/v1/statistics"
-        try:
-            response = requests.post(
-                stat_url,
-                json={},
-                headers={"Content-Type": "application/json"},
-                timeout=5,
-            )
-            responses = response.json()
-            return True
-        except Exception as e:
-            print(f"Error: {e}")
-            return False
+        return self.health_monitor.is_up(url)
 
     def get_active_url(self):
         if self.check_server_status(self.url1):
-            print("Server 1 is active")
             return self.url1
         elif self.check_server_status(self.url2):
-            print("Server 2 is active")
             return self.url2
         else:
             print("Both servers are inactive")
@@ -81,34 +216,95 @@ class CustomPathwayVectorStoreClient:
             data["metadata_filter"] = metadata_filter
         if filepath_globpattern is not None:
             data["filepath_globpattern"] = filepath_globpattern
-        url = self.get_active_url() + "/v1/retrieve"
-        response = requests.post(
-            url,
-            data=json.dumps(data),
-            headers=self._get_request_headers(),
-            timeout=self.timeout,
-        )
-
-        responses = response.json()
+        active_url = self.get_active_url()
+        try:
+            response = self.session.post(
+                active_url + "/v1/retrieve",
+                data=json.dumps(data),
+                headers=self._get_request_headers(),
+                timeout=self.timeout,
+            )
+            responses = response.json()
+        except Exception:
+            self.health_monitor.report_failure(active_url)
+            raise
         return sorted(responses, key=lambda x: x["dist"])
 
-    def similarity_search(self, query: str, k: int = 4, **kwargs: Any):
+    def get_hedge_delay(self, url) -> float:
+        """
+        Seconds to wait for `url` before sending the same query to the other
+        server: the `config.VECTOR_STORE_HEDGE_PERCENTILE` percentile of its
+        recent latencies, or `config.VECTOR_STORE_HEDGE_DELAY` until enough
+        samples were collected.
+        """
+        latencies = list(self.latencies[url])
+        if len(latencies) < config.VECTOR_STORE_HEDGE_MIN_SAMPLES:
+            return config.VECTOR_STORE_HEDGE_DELAY
+        return float(np.percentile(latencies, config.VECTOR_STORE_HEDGE_PERCENTILE))
+
+    def _timed_similarity_search(self, client, url, query, k, kwargs):
+        start = time.perf_counter()
         try:
-            response = requests.post(
-                self.url1 + "/v1/health",
-                json={},
-                headers={"Content-Type": "application/json"},
-                timeout=5,
+            ret = client.similarity_search(query, k, **kwargs)
+        except Exception:
+            self.health_monitor.report_failure(url)
+            raise
+        self.latencies[url].append(time.perf_counter() - start)
+        return ret
+
+    def _hedged_similarity_search(self, query: str, k: int, **kwargs: Any):
+        """
+        Query server 1 and, if it has not answered within the hedging delay (or
+        failed), server 2 as well. The first successful answer is returned and
+        the other request is cancelled if it has not started yet, otherwise its
+        result is dropped.
+        """
+        primary = self._hedge_executor.submit(
+            self._timed_similarity_search, self.client1, self.url1, query, k, kwargs
+        )
+        done, _ = wait([primary], timeout=self.get_hedge_delay(self.url1))
+        if primary in done and primary.exception() is None:
+            return primary.result()
+
+        secondary = self._hedge_executor.submit(
+            self._timed_similarity_search, self.client2, self.url2, query, k, kwargs
+        )
+        pending = {primary, secondary}
+        deadline = time.monotonic() + self.timeout
+        while len(pending) > 0:
+            done, pending = wait(
+                pending,
+                timeout=max(deadline - time.monotonic(), 0),
+                return_when=FIRST_COMPLETED,
             )
-            text = response.text
-            print(f"Server 1: {text}")
-        except Exception as e:
-            print(f"Error: {e}")
-            text = "none"
+            if len(done) == 0:
+                print("Error: hedged similarity search timed out")
+                break
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                print(f"Error: {future.exception()}")
+        for other in pending:
+            other.cancel()
+        return []
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any):
+        # "both" / "server1" / "server2" / "none" as answered by the multiserver
+        # proxy on its last health check, None if it has not been probed yet
+        text = self.health_monitor.get_health(self.url1) or "unknown"
+
+        # Server 1 alone is enough, server 2 is only there to cut the tail
+        # latency when server 1 is slow
+        if config.VECTOR_STORE_HEDGING and text == "both":
+            return self._hedged_similarity_search(query, k, **kwargs)
 
         try:
             if text != "none":
-                ret1 = self.client1.similarity_search(query, k, **kwargs)
+                ret1 = self._timed_similarity_search(
+                    self.client1, self.url1, query, k, kwargs
+                )
             else:
                 ret1 = []
         except Exception as e:
@@ -117,14 +313,16 @@ class CustomPathwayVectorStoreClient:
 
         try:
             if text != "both":
-                ret2 = self.client2.similarity_search(query, k, **kwargs)
+                ret2 = self._timed_similarity_search(
+                    self.client2, self.url2, query, k, kwargs
+                )
             else:
                 ret2 = []
         except Exception as e:
             print(f"Error: {e}")
             ret2 = []
 
-        return ret1 + ret2
+        return deduplicate_documents(ret1 + ret2)
 
     # Make an alias
     __call__ = query
@@ -133,7 +331,7 @@ class CustomPathwayVectorStoreClient:
         """Fetch basic statistics about the vector store."""
 
         url = self.get_active_url() + "/v1/statistics"
-        response = requests.post(
+        response = self.session.post(
             url,
             json={},
             headers=self._get_request_headers(),
@@ -158,7 +356,7 @@ class CustomPathwayVectorStoreClient:
                 will be searched for this query.
         """
         url = self.get_active_url() + "/v1/inputs"
-        response = requests.post(
+        response = self.session.post(
             url,
             json={
                 "metadata_filter": metadata_filter,
@@ -1,4 +1,4 @@
-from .document_grader import grade_documents
+from .document_grader import grade_documents, agrade_documents
 from .document_reranker import rerank_documents
 
 # from .document_retriever import retrieve_documents, retrieve_documents_with_metadata
@@ -6,6 +6,9 @@ from .document_retriever import (
     retrieve_documents,
     retrieve_documents_with_metadata,
     retrieve_documents_with_quant_qual,
+    aretrieve_documents,
+    aretrieve_documents_with_metadata,
+    aretrieve_documents_with_quant_qual,
 )
 from .answer_generator import (
     generate_answer,
@@ -25,7 +28,8 @@ from .question_decomposer import (
     combine_answer_v2,
     combine_answer_v3,
     check_sufficient,
-    cache_retriever_node
+    cache_retriever_node,
+    acache_retriever_node,
 )
 from .question_rewriter import rewrite_question, rewrite_with_hyde
 from .web_searcher import search_web
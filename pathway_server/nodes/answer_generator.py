@@ -41,6 +41,7 @@ import state, config, nodes
 from llm import llm
 import uuid
 from utils import log_message, send_logs, tree_log
+from context_packer import pack_context, truncate_tokens
 from config import LOGGING_SETTINGS
 
 
@@ -176,6 +177,23 @@ def generate_answer_with_citation_state(state: state.InternalRAGState):
     documents = state["documents"]
     image_url = state.get("image_url", "")
     image_desc = state.get("image_desc", "")
+    # The rank of each document in its own result list, before the metadata
+    # is stripped (see `nodes.document_retriever.with_retrieval_rank`)
+    ranks = {
+        id(doc): doc.metadata.get("retrieval_rank", i)
+        for i, doc in enumerate(documents)
+    }
+    context = pack_context(
+        "generate_answer_with_citation_state",
+        question,
+        remove_unnecessary_metadata_for_generation(documents),
+        text=lambda doc: doc.page_content,
+        rank=lambda doc: ranks[id(doc)],
+        truncate=lambda doc, max_tokens: Document(
+            page_content=truncate_tokens(doc.page_content, max_tokens),
+            metadata=doc.metadata,
+        ),
+    )
 
     if image_url == "":
         chat_prompt_template = ChatPromptTemplate.from_messages(
@@ -185,7 +203,7 @@ def generate_answer_with_citation_state(state: state.InternalRAGState):
                     content=[
                         {
                             "type": "text",
-                            "text": f"Context: {remove_unnecessary_metadata_for_generation(documents)}",
+                            "text": f"Context: {context}",
                         },
                         {"type": "text", "text": f"Question: {question}"},
                     ]
@@ -201,7 +219,7 @@ def generate_answer_with_citation_state(state: state.InternalRAGState):
                     content=[
                         {
                             "type": "text",
-                            "text": f"Context: {remove_unnecessary_metadata_for_generation(documents)} \nImage description being shared may or may not be relevant to the question.",
+                            "text": f"Context: {context} \nImage description being shared may or may not be relevant to the question.",
                         },
                         {"type": "text", "text": {f"Image Description: {image_desc}"}},
                         {"type": "text", "text": f"Question: {question}"},
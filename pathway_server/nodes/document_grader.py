@@ -29,12 +29,14 @@ It includes functionality to determine if the retrieved documents are relevant t
    - A helper function that grades a single document based on the user’s question and the document’s content. It returns the grade and reason.
 
 7. **grade_documents**:
-   - The main function that grades a set of documents in parallel using `ThreadPoolExecutor` to improve performance. 
+   - The main function that grades a set of documents as one batch of LLM calls (`document_grader.batch`).
    - It filters out irrelevant documents and collects the reasons for irrelevance.
    - It logs the process and sends logs to the server.
+   - `agrade_documents` is its async variant, grading the batch with `abatch`.
 
 ### Parallel Document Grading:
-- **Concurrency** is achieved by using the `ThreadPoolExecutor` to grade multiple documents concurrently, improving efficiency when dealing with many documents.
+- **Concurrency** is achieved by sending all the documents to the LLM wrapper as one batch, which runs them concurrently and
+  only retries (or falls back to the next provider for) the documents whose grading failed.
 
 ### Logging:
 - The module includes logging functionality to keep track of the document grading process. Logs are sent to the server, and a tree structure is maintained for tracking the flow of the execution.
@@ -53,7 +55,6 @@ It includes functionality to determine if the retrieved documents are relevant t
 4. The filtered documents and reasons for irrelevance are returned, along with updated state information.
 
 ### Dependencies:
-- **concurrent.futures**: Used for parallel execution of document grading tasks.
 - **pydantic**: For structured data validation and creation of input and output models.
 - **langchain_core**: Used to create and process prompts for document grading.
 - **uuid**: To generate unique identifiers for logging.
@@ -63,7 +64,6 @@ It includes functionality to determine if the retrieved documents are relevant t
 
 """
 
-from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
 from prompt import prompts
@@ -101,7 +101,9 @@ grade_prompt = ChatPromptTemplate.from_messages(
         ("human", "Retrieved document: \n\n {document} \n\n User question: {question}"),
     ]
 )
-document_grader = grade_prompt | llm.with_structured_output(DocumentGrade)
+document_grader = grade_prompt | llm.with_structured_output(DocumentGrade).with_cache(
+    "document_grader"
+)
 
 
 def grade_document(question, document):
@@ -114,6 +116,14 @@ def grade_document(question, document):
     return {"grade": score.binary_score, "reason": score.reason, "document": document}
 
 
+def _grader_inputs(state: state.InternalRAGState):
+    question = state["original_question"]
+    return [
+        {"question": question, "document": document.page_content}
+        for document in state["documents"]
+    ]
+
+
 def grade_documents(state: state.InternalRAGState):
     """
     Determines whether the retrieved documents are relevant to the question and collects reasons for irrelevance.
@@ -125,15 +135,25 @@ def grade_documents(state: state.InternalRAGState):
         state (dict): Updates documents key with only filtered relevant documents and includes reasons for irrelevance.
     """
 
-    question = state["original_question"]
+    # Sending all chunks for relevance grading as one batch to improve efficiency
+    scores = document_grader.batch(_grader_inputs(state))
+    return _grade_documents_output(state, scores)
+
+
+async def agrade_documents(state: state.InternalRAGState):
+    """Async `grade_documents`."""
+    scores = await document_grader.abatch(_grader_inputs(state))
+    return _grade_documents_output(state, scores)
+
+
+def _grade_documents_output(state: state.InternalRAGState, scores):
     documents = state["documents"]
     doc_grading_retries = state.get("doc_grading_retries", 0)
 
-    # Sending all chunks for relevance grading parallely to improve efficiency
-    with ThreadPoolExecutor() as executor:
-        results = list(
-            executor.map(lambda doc: grade_document(question, doc), documents)
-        )
+    results = [
+        {"grade": score.binary_score, "reason": score.reason, "document": document}
+        for score, document in zip(scores, documents)
+    ]
 
     filtered_docs = [res["document"] for res in results if res["grade"] == "yes"]
     reasons = [res["reason"] for res in results if res["grade"] == "no"]
@@ -24,15 +24,22 @@ fallback strategies and retries.
    - Retrieves documents based on both the question and additional metadata filters (e.g., metadata about documents).
    - Uses metadata filtering to narrow down document retrieval and supports retries if no documents are retrieved initially.
 
-5. **retriever_helper**:
-   - A helper function to retrieve documents using specific filters, either with or without metadata filtering.
-
-6. **retrieve_documents_with_quant_qual**:
+5. **retrieve_documents_with_quant_qual**:
    - Retrieves documents based on quantitative or qualitative question types.
    - It handles the retrieval differently based on the question's category, using different metadata types (e.g., tables, key-value pairs).
-   - Uses concurrent execution for optimized retrieval, especially for handling tables and key-value data types.
+   - Sends one over-fetched search per question with the company/year filter only, then slices the results
+     client-side into the text, table and key-value buckets by their `table` / `is_table_value` metadata.
+
+6. **collapse_near_duplicates**:
+   - Drops retrieved chunks that are near-duplicates (same `dup_group`) of a better ranked one, e.g. boilerplate repeated in
+     the filings of several years, unless the year filter of the query tells the copies apart.
 
-7. **Logging**:
+7. **Async variants**:
+   - `aretrieve_documents`, `aretrieve_documents_with_metadata` and `aretrieve_documents_with_quant_qual` share the
+     preparation and logging of their sync counterparts but query through `async_retriever`, so graphs run with
+     `ainvoke`/`astream` keep every retrieval on the event loop.
+
+8. **Logging**:
    - The module includes detailed logging at each retrieval step, ensuring that the system's state can be tracked and analyzed for debugging and performance monitoring.
    - Logs the process, metadata filters, and documents retrieved at each step of the workflow.
 
@@ -48,7 +55,8 @@ fallback strategies and retries.
 3. **Quantitative and Qualitative Retrieval**:
    - The `retrieve_documents_with_quant_qual` function retrieves documents based on whether the question is quantitative (involving tables, key-value pairs) or qualitative.
    - For quantitative questions, it retrieves documents with different metadata types (e.g., tables, key-value pairs) and processes them accordingly.
-   - This function also handles concurrent retrieval requests to optimize the process.
+   - A single over-fetched search per question (and its HyDE rewrite) is partitioned into the document types; a
+     type that comes out short is searched again on its own so the result matches per-type searches.
 
 4. **Fallback and Retry Logic**:
    - Several fallback mechanisms are in place to ensure the system retrieves relevant documents, even if initial attempts fail.
@@ -67,7 +75,7 @@ fallback strategies and retries.
    - If no documents are retrieved, retries occur based on the retry counters.
 
 3. **Quantitative and Qualitative Handling**:
-   - The system differentiates between quantitative and qualitative questions and applies appropriate retrieval strategies, including concurrent requests for different types of data (e.g., table data, key-value pairs).
+   - The system differentiates between quantitative and qualitative questions and applies appropriate retrieval strategies, batching the searches for different types of data (e.g., table data, key-value pairs) into one request.
 
 4. **Logging**:
    - The retrieval process is logged, and the log tree helps track the document retrieval flow from start to finish.
@@ -81,21 +89,20 @@ fallback strategies and retries.
 - **copy**: For copying metadata and avoiding unintended modifications to the original metadata.
 - **state**: For accessing and managing the internal state of the retrieval system.
 - **config**: For configuration settings such as retry limits and metadata filters.
-- **retriever**: For querying the document retrieval system (e.g., BM25-based retrieval).
+- **retriever**: For querying the document retrieval system (e.g., BM25-based retrieval), synchronously or through the asyncio client.
 - **utils.send_logs**: For sending logs to a logging server for monitoring and debugging.
 - **nodes**: For logging node transitions and metadata conversion during document retrieval.
-- **concurrent.futures**: For handling parallel document retrieval in a multithreaded manner, especially for processing multiple types of data (e.g., tables, key-value pairs).
 
 """
 
 import re
 from copy import copy
+from langchain_core.documents import Document
 import state, config, nodes
-from retriever import retriever
+from retriever import retriever, async_retriever
 from utils import log_message
 from .quant_qual import qq_classifier
 import uuid
-import concurrent.futures
 from utils import send_logs
 from config import LOGGING_SETTINGS
 
@@ -128,7 +135,7 @@ def clean_question_for_bm25(question: str) -> str:
     return re.sub(r"[^a-zA-Z0-9\-\$\s\n\?]", "", question)
 
 
-def retrieve_documents(state: state.InternalRAGState):
+def _prepare_retrieve_documents(state: state.InternalRAGState):
     question_group_id = state.get("question_group_id", 1)
     log_message(
         f"------RETRIEVING DOCUMENTS------", f"question_group{question_group_id}"
@@ -152,26 +159,66 @@ def retrieve_documents(state: state.InternalRAGState):
             f"------RETRIEVING DOCUMENTS USING HYDE------",
             f"question_group{question_group_id}",
         )
-        questions = question.split("xxxxxxxxxx")
-        docs1 = retriever.similarity_search(
-            questions[0],
-            config.NUM_DOCS_TO_RETRIEVE,
-        )
+        questions = question.split("xxxxxxxxxx")[:2]
         log_message(
             f"------RETRIEVING DOCUMENTS USING REWRITING------",
             f"question_group{question_group_id}",
         )
-        docs2 = retriever.similarity_search(
-            questions[1],
-            config.NUM_DOCS_TO_RETRIEVE,
-        )
-        docs = docs1 + docs2
     else:
-        docs = retriever.similarity_search(
-            question,
-            config.NUM_DOCS_TO_RETRIEVE,
+        questions = [question]
+
+    queries = [(q, config.NUM_DOCS_TO_RETRIEVE, None) for q in questions]
+    return question, queries
+
+
+def collapse_near_duplicates(docs, metadata_filter=None):
+    """
+    Keep only the best ranked chunk of every near-duplicate group
+    (`dup_group` metadata set at indexing), such as the same boilerplate in
+    the 10-Ks of several years. `docs` concatenates the lists of several
+    searches, so the kept chunk is the one with the lowest `retrieval_rank`
+    (see `with_retrieval_rank`), the first one on a tie. When the metadata
+    filter selects on the year, the copies of different years are kept, as
+    the question tells them apart.
+    """
+    if not config.RETRIEVAL_COLLAPSE_NEAR_DUPLICATES:
+        return docs
+    keep_years = "year" in (metadata_filter or "")
+    best = {}
+    for i, doc in enumerate(docs):
+        dup_group = doc.metadata.get("dup_group")
+        if dup_group is None:
+            continue
+        key = (dup_group, doc.metadata.get("year") if keep_years else None)
+        rank = doc.metadata.get("retrieval_rank", float("inf"))
+        if key not in best or rank < best[key][0]:
+            best[key] = (rank, i)
+    kept = {i for _, i in best.values()}
+    return [
+        doc
+        for i, doc in enumerate(docs)
+        if doc.metadata.get("dup_group") is None or i in kept
+    ]
+
+
+def with_retrieval_rank(docs: list[Document]) -> list[Document]:
+    """
+    Copies of the result list `docs` with their position in it as their
+    `retrieval_rank` metadata. The lists of several searches (text, tables,
+    key-values, HyDE rewrite...) are concatenated, so that the answer
+    generation ranks every document within its own list.
+    """
+    return [
+        Document(
+            page_content=doc.page_content,
+            metadata={**doc.metadata, "retrieval_rank": rank},
         )
+        for rank, doc in enumerate(docs)
+    ]
 
+
+def _retrieve_documents_output(state: state.InternalRAGState, question, docs):
+    docs = collapse_near_duplicates(docs)
     if len(docs) == 0:
         state["metadata_retries"] += 1
     state["documents"] = docs
@@ -179,14 +226,25 @@ def retrieve_documents(state: state.InternalRAGState):
     return state
 
 
-def retrieve_documents_with_metadata(state: state.InternalRAGState):
-    """Retrieve documents using the specified method."""
-    question_group_id = state.get("question_group_id", 1)
-    log_message(
-        f"------RETRIEVING DOCUMENTS------", f"question_group{question_group_id}"
-    )
+def retrieve_documents(state: state.InternalRAGState):
+    question, queries = _prepare_retrieve_documents(state)
+    docs = []
+    for results in retriever.similarity_search_batch(queries):
+        docs += with_retrieval_rank(results)
+    return _retrieve_documents_output(state, question, docs)
 
-    question = clean_question_for_bm25(state["question"])
+
+async def aretrieve_documents(state: state.InternalRAGState):
+    """Async version of `retrieve_documents`, used when the graph is awaited."""
+    question, queries = _prepare_retrieve_documents(state)
+    docs = []
+    for results in await async_retriever.asimilarity_search_batch(queries):
+        docs += with_retrieval_rank(results)
+    return _retrieve_documents_output(state, question, docs)
+
+
+def _get_metadata_for_retrieval(state: state.InternalRAGState):
+    """Apply the metadata fallback rules and return the metadata to filter on."""
     metadata = state["metadata"]
     documents = state.get("documents", ["None"])
     metadata_filters = state.get("metadata_filters", copy(config.METADATA_FILTER_INIT))
@@ -209,21 +267,47 @@ def retrieve_documents_with_metadata(state: state.InternalRAGState):
     if len(source_files) != 0:
         metadata["path"] = source_files
 
+    return metadata, metadata_filters, metadata_retries, doc_grading_retries
+
+
+def _prepare_retrieve_documents_with_metadata(state: state.InternalRAGState):
+    question_group_id = state.get("question_group_id", 1)
+    log_message(
+        f"------RETRIEVING DOCUMENTS------", f"question_group{question_group_id}"
+    )
+
+    question = clean_question_for_bm25(state["question"])
+    metadata, metadata_filters, metadata_retries, doc_grading_retries = (
+        _get_metadata_for_retrieval(state)
+    )
+
     # split the question even if it doesn't contain the delimiter as that will just yield the original question
     questions = question.split("xxxxxxxxxx")
-    docs = []
     formatted_metadata = nodes.convert_metadata_to_jmespath(metadata)
     log_message(f"\n\nformatted metadata :\n\n {formatted_metadata} \n\n")
-    for question in questions:
-        docs.extend(
-            retriever.similarity_search(
-                question,
-                config.NUM_DOCS_TO_RETRIEVE,
-                metadata_filter=formatted_metadata or None,
-            )
-        )
 
-    original_question = state.get("original_question", question)
+    return {
+        "questions": questions,
+        "queries": [
+            (question, config.NUM_DOCS_TO_RETRIEVE, formatted_metadata)
+            for question in questions
+        ],
+        "formatted_metadata": formatted_metadata,
+        "metadata_filters": metadata_filters,
+        "metadata_retries": metadata_retries,
+        "doc_grading_retries": doc_grading_retries,
+    }
+
+
+def _retrieve_documents_with_metadata_output(
+    state: state.InternalRAGState, retrieval, batch_results
+):
+    docs = []
+    for results in batch_results:
+        docs.extend(with_retrieval_rank(results))
+    docs = collapse_near_duplicates(docs, retrieval["formatted_metadata"])
+
+    original_question = state.get("original_question", retrieval["questions"][-1])
 
     ###### log_tree part
     id = str(uuid.uuid4())
@@ -246,10 +330,10 @@ def retrieve_documents_with_metadata(state: state.InternalRAGState):
         "documents": docs,
         "documents_after_metadata_filter": docs,
         "original_question": original_question,
-        "formatted_metadata": formatted_metadata,
-        "metadata_retries": metadata_retries,
-        "doc_grading_retries": doc_grading_retries,
-        "metadata_filters": metadata_filters,
+        "formatted_metadata": retrieval["formatted_metadata"],
+        "metadata_retries": retrieval["metadata_retries"],
+        "doc_grading_retries": retrieval["doc_grading_retries"],
+        "metadata_filters": retrieval["metadata_filters"],
         "prev_node_rewrite": prev_node_rewrite,
         "prev_node": child_node,
         "log_tree": log_tree,
@@ -269,18 +353,23 @@ def retrieve_documents_with_metadata(state: state.InternalRAGState):
     return output_state
 
 
-def retriever_helper(retriever, question, num_docs, filter):
-    docs = []
-    if filter == "":
-        docs = retriever.similarity_search(question, num_docs)
-    else:
-        docs = retriever.similarity_search(question, num_docs, metadata_filter=filter)
-    return docs
+def retrieve_documents_with_metadata(state: state.InternalRAGState):
+    """Retrieve documents using the specified method."""
+    retrieval = _prepare_retrieve_documents_with_metadata(state)
+    batch_results = retriever.similarity_search_batch(retrieval["queries"])
+    return _retrieve_documents_with_metadata_output(state, retrieval, batch_results)
 
 
-def retrieve_documents_with_quant_qual(state: state.InternalRAGState):
-    """Retrieve documents using the specified method."""
+async def aretrieve_documents_with_metadata(state: state.InternalRAGState):
+    """Async version of `retrieve_documents_with_metadata`."""
+    retrieval = _prepare_retrieve_documents_with_metadata(state)
+    batch_results = await async_retriever.asimilarity_search_batch(
+        retrieval["queries"]
+    )
+    return _retrieve_documents_with_metadata_output(state, retrieval, batch_results)
 
+
+def _prepare_retrieve_documents_with_quant_qual(state: state.InternalRAGState):
     question_group_id = state.get("question_group_id", 1)
     log_message(
         f"------RETRIEVING DOCUMENTS------", f"question_group{question_group_id}"
@@ -288,122 +377,150 @@ def retrieve_documents_with_quant_qual(state: state.InternalRAGState):
     # print(f"------RETRIEVING DOCUMENTS------")
 
     question = clean_question_for_bm25(state["question"])
-    metadata = state["metadata"]
-    documents = state.get("documents", ["None"])
-    metadata_filters = state.get("metadata_filters", copy(config.METADATA_FILTER_INIT))
-    metadata_retries = state.get("metadata_retries", 0)
-    doc_grading_retries = state.get("doc_grading_retries", 0)
-    answer_grading_retries = state.get("answer_generation_retries", 0)
+    metadata, metadata_filters, metadata_retries, doc_grading_retries = (
+        _get_metadata_for_retrieval(state)
+    )
+
+    # Metadata each document type must have, used as JMESPath filters for the
+    # per-type searches and as client-side predicates for the sliced one
+    conditions_text = {"table": "False"}
+    conditions_table = {"table": "True"}
+    conditions_kv = {"is_table_value ": "True"}
+    conditions = {"is_table_value": "False", "table": "False"}
+
+    base_filter = nodes.convert_metadata_to_jmespath(metadata)
+    metadata_text = nodes.convert_metadata_to_jmespath({**metadata, **conditions_text})
+    metadata_table = nodes.convert_metadata_to_jmespath(
+        {**metadata, **conditions_table}
+    )
+    metadata_kv = nodes.convert_metadata_to_jmespath({**metadata, **conditions_kv})
+    formatted_metadata = nodes.convert_metadata_to_jmespath({**metadata, **conditions})
 
-    # state["metadata_retries"] = metadata_retries
-    # state["doc_grading_retries"] = doc_grading_retries
-    # state["metadata_filters"] = metadata_filters
+    ## Retrieval using rewriting and hyde
+    questions = question.split("xxxxxxxxxx")
 
-    if (
-        metadata_filters != config.METADATA_FILTER_INIT
-        and not metadata_retries
-        and not doc_grading_retries
-        and not answer_grading_retries
-    ):
-        metadata_filters = config.METADATA_FILTER_INIT
-    metadata_filters = metadata_fallback(
-        metadata_filters, documents, metadata_retries, doc_grading_retries
+    ## Routing
+    cat = state["category"]
+    if cat == "Quantitative":
+        ## Quantitative
+        if config.WORKFLOW_SETTINGS["with_table_for_quant_qual"]:
+            search_plan = [
+                (config.NUM_DOCS_TO_RETRIEVE, metadata_text, conditions_text),
+                (config.NUM_DOCS_TO_RETRIEVE_TABLE, metadata_table, conditions_table),
+                (config.NUM_DOCS_TO_RETRIEVE_KV, metadata_kv, conditions_kv),
+            ]
+        else:
+            search_plan = [
+                (config.NUM_DOCS_TO_RETRIEVE, formatted_metadata, conditions),
+                (config.NUM_DOCS_TO_RETRIEVE_KV, metadata_kv, conditions_kv),
+            ]
+    else:
+        ## Qualitative
+        search_plan = [(config.NUM_DOCS_TO_RETRIEVE, formatted_metadata, conditions)]
+
+    if len(search_plan) > 1:
+        # One over-fetched search per question with only the company/year
+        # filter, sliced into the document types afterwards
+        fetch_k = config.QUANT_QUAL_OVERFETCH_FACTOR * sum(
+            k for k, _, _ in search_plan
+        )
+        queries = [(question, fetch_k, base_filter) for question in questions]
+    else:
+        fetch_k = None
+        queries = [
+            (question, k, filter)
+            for question in questions
+            for k, filter, _ in search_plan
+        ]
+
+    return {
+        "questions": questions,
+        "category": cat,
+        "search_plan": search_plan,
+        "fetch_k": fetch_k,
+        # every question goes out in one batched request
+        "queries": queries,
+        # used when nothing matches the metadata filters
+        "fallback_query": (questions[-1], config.NUM_DOCS_TO_RETRIEVE, None),
+        "formatted_metadata": formatted_metadata,
+        "metadata_filters": metadata_filters,
+        "metadata_retries": metadata_retries,
+        "doc_grading_retries": doc_grading_retries,
+    }
+
+
+def _matches_conditions(doc, conditions):
+    # JMESPath ignores whitespace around identifiers, so neither does this, but
+    # its `==` is case-sensitive
+    return all(
+        str(doc.metadata.get(key.strip())) == value
+        for key, value in conditions.items()
     )
-    metadata = {k: v for k, v in metadata.items() if k in metadata_filters}
-    source_files = state.get("query_path", [])
-    if len(source_files) != 0:
-        metadata["path"] = source_files
 
-    metadata_text = copy(metadata)
-    metadata_text["table"] = "False"
-    metadata_table = copy(metadata)
-    metadata_table["table"] = "True"
-    metadata_kv = copy(metadata)
-    metadata_kv["is_table_value "] = "True"
 
-    metadata["is_table_value"] = "False"
-    metadata["table"] = "False"
+def _slice_quant_qual_results(retrieval, batch_results):
+    """
+    Partition the over-fetched results of every question into one bucket per
+    entry of the search plan, keeping the `k` closest documents of each.
+
+    Returns the buckets (one list per question, one bucket per plan entry) and
+    the `(question_index, plan_index, query)` searches to run again on their
+    own for buckets that came out short while the store may hold more
+    matching documents than were fetched.
+    """
+    search_plan = retrieval["search_plan"]
+    if retrieval["fetch_k"] is None:
+        return [
+            batch_results[i * len(search_plan) : (i + 1) * len(search_plan)]
+            for i in range(len(retrieval["questions"]))
+        ], []
+
+    buckets = []
+    refills = []
+    for i, (question, results) in enumerate(
+        zip(retrieval["questions"], batch_results)
+    ):
+        question_buckets = []
+        for j, (k, filter, conditions) in enumerate(search_plan):
+            bucket = [doc for doc in results if _matches_conditions(doc, conditions)]
+            bucket = bucket[:k]
+            if len(bucket) < k and len(results) >= retrieval["fetch_k"]:
+                refills.append((i, j, (question, k, filter)))
+            question_buckets.append(bucket)
+        buckets.append(question_buckets)
+    return buckets, refills
 
-    metadata_text = nodes.convert_metadata_to_jmespath(metadata_text)
-    metadata_table = nodes.convert_metadata_to_jmespath(metadata_table)
-    metadata_kv = nodes.convert_metadata_to_jmespath(metadata_kv)
-    formatted_metadata = nodes.convert_metadata_to_jmespath(metadata)
 
-    ## Retrieval using rewriting and hyde
-    questions = question.split("xxxxxxxxxx")
+def _apply_refills(buckets, refills, refill_results):
+    for (i, j, _), docs in zip(refills, refill_results):
+        buckets[i][j] = docs
+    return buckets
+
+
+def _split_quant_qual_results(retrieval, buckets):
     docs = []
     docs_kv = []
+    for results in buckets:
+        for result in results:
+            docs += with_retrieval_rank(result)
+        if retrieval["category"] == "Quantitative":
+            # the key-value search is always the last one in the plan
+            docs_kv += with_retrieval_rank(results[-1])
+    return docs, docs_kv
 
-    for question in questions:
-        ## Routing
-        cat = state["category"]
-        if cat == "Quantitative":
-            ## Quantitative
-            if config.WORKFLOW_SETTINGS["with_table_for_quant_qual"]:
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future_text = executor.submit(
-                        retriever_helper,
-                        retriever,
-                        question,
-                        config.NUM_DOCS_TO_RETRIEVE,
-                        metadata_text,
-                    )
-                    future_table = executor.submit(
-                        retriever_helper,
-                        retriever,
-                        question,
-                        config.NUM_DOCS_TO_RETRIEVE_TABLE,
-                        metadata_table,
-                    )
-                    future_kv = executor.submit(
-                        retriever_helper,
-                        retriever,
-                        question,
-                        config.NUM_DOCS_TO_RETRIEVE_KV,
-                        metadata_kv,
-                    )
-                    docs += (
-                        future_text.result()
-                        + future_table.result()
-                        + future_kv.result()
-                    )
-                    docs_kv += future_kv.result()
-            else:
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future_text_table = executor.submit(
-                        retriever_helper,
-                        retriever,
-                        question,
-                        config.NUM_DOCS_TO_RETRIEVE,
-                        formatted_metadata,
-                    )
-                    future_kv = executor.submit(
-                        retriever_helper,
-                        retriever,
-                        question,
-                        config.NUM_DOCS_TO_RETRIEVE_KV,
-                        metadata_kv,
-                    )
-                    docs += future_text_table.result() + future_kv.result()
-                    docs_kv += future_kv.result()
-        else:
-            ## Qualitative
-            docs += retriever_helper(
-                retriever, question, config.NUM_DOCS_TO_RETRIEVE, formatted_metadata
-            )
 
-    ## Fallback when 0 doc retrieved
-    flag = False
-    if len(docs) == 0:
-        flag = True
-        docs += retriever_helper(retriever, question, config.NUM_DOCS_TO_RETRIEVE, "")
+def _retrieve_documents_with_quant_qual_output(
+    state: state.InternalRAGState, retrieval, docs, docs_kv, fallback_qq_retriever
+):
     # state["documents"] = docs
-    fallback_qq_retriever = flag
     # state["documents_after_metadata_filter"] = docs
-    documents_with_kv = docs_kv
+    docs = collapse_near_duplicates(docs, retrieval["formatted_metadata"])
+    documents_with_kv = collapse_near_duplicates(
+        docs_kv, retrieval["formatted_metadata"]
+    )
     # state["prev_node = nodes.retrieve_documents_with_quant_qual.__name__
-    original_question = state.get("original_question", question)
-    formatted_metadata = formatted_metadata
+    original_question = state.get("original_question", retrieval["questions"][-1])
+    formatted_metadata = retrieval["formatted_metadata"]
 
     ###### log_tree part
     # import uuid , nodes
@@ -432,9 +549,9 @@ def retrieve_documents_with_quant_qual(state: state.InternalRAGState):
         "fallback_qq_retriever": fallback_qq_retriever,
         "original_question": original_question,
         "formatted_metadata": formatted_metadata,
-        "metadata_retries": metadata_retries,
-        "doc_grading_retries": doc_grading_retries,
-        "metadata_filters": metadata_filters,
+        "metadata_retries": retrieval["metadata_retries"],
+        "doc_grading_retries": retrieval["doc_grading_retries"],
+        "metadata_filters": retrieval["metadata_filters"],
         "prev_node": child_node,
         "log_tree": log_tree,
     }
@@ -451,4 +568,59 @@ def retrieve_documents_with_quant_qual(state: state.InternalRAGState):
     ######
 
     return output_state
-    # return output_state
+
+
+def retrieve_documents_with_quant_qual(state: state.InternalRAGState):
+    """Retrieve documents using the specified method."""
+    retrieval = _prepare_retrieve_documents_with_quant_qual(state)
+    batch_results = retriever.similarity_search_batch(retrieval["queries"])
+    buckets, refills = _slice_quant_qual_results(retrieval, batch_results)
+    if len(refills) > 0:
+        refill_results = retriever.similarity_search_batch(
+            [query for _, _, query in refills]
+        )
+        buckets = _apply_refills(buckets, refills, refill_results)
+    docs, docs_kv = _split_quant_qual_results(retrieval, buckets)
+
+    ## Fallback when 0 doc retrieved
+    fallback_qq_retriever = False
+    if len(docs) == 0:
+        fallback_qq_retriever = True
+        docs += with_retrieval_rank(
+            retriever.similarity_search_batch([retrieval["fallback_query"]])[0]
+        )
+
+    return _retrieve_documents_with_quant_qual_output(
+        state, retrieval, docs, docs_kv, fallback_qq_retriever
+    )
+
+
+async def aretrieve_documents_with_quant_qual(state: state.InternalRAGState):
+    """Async version of `retrieve_documents_with_quant_qual`."""
+    retrieval = _prepare_retrieve_documents_with_quant_qual(state)
+    batch_results = await async_retriever.asimilarity_search_batch(
+        retrieval["queries"]
+    )
+    buckets, refills = _slice_quant_qual_results(retrieval, batch_results)
+    if len(refills) > 0:
+        refill_results = await async_retriever.asimilarity_search_batch(
+            [query for _, _, query in refills]
+        )
+        buckets = _apply_refills(buckets, refills, refill_results)
+    docs, docs_kv = _split_quant_qual_results(retrieval, buckets)
+
+    ## Fallback when 0 doc retrieved
+    fallback_qq_retriever = False
+    if len(docs) == 0:
+        fallback_qq_retriever = True
+        docs += with_retrieval_rank(
+            (
+                await async_retriever.asimilarity_search_batch(
+                    [retrieval["fallback_query"]]
+                )
+            )[0]
+        )
+
+    return _retrieve_documents_with_quant_qual_output(
+        state, retrieval, docs, docs_kv, fallback_qq_retriever
+    )
@@ -17,11 +17,15 @@
 # 10. **generate_answer_from_kpis Function**: Compiles calculated KPIs and generates an analysis report by querying an LLM model.
 # 11. **Logging and Server Interaction**: Throughout the script, logging is handled for tracking the workflow and results.
 # 12. **Parallel Execution**: ThreadPoolExecutor is used for parallel processing to retrieve values and calculate KPIs efficiently.
+# 13. **aget_required_values Function**: Async variant of `get_required_values` that retrieves all values concurrently
+#    with the async retriever and LLM, sharing the disk cache of `_get_required_value_with_pw`, when the workflow is
+#    run with `ainvoke`/`astream`.
 
 # This code is intended to be used in a broader workflow to handle financial analysis by calculating and generating answers 
 # from KPIs based on company-specific data over time.
 
 from typing import Optional
+import asyncio
 import json
 import uuid
 from concurrent.futures import ThreadPoolExecutor
@@ -33,7 +37,7 @@ from pathway.udfs import DiskCache
 from prompt import prompts
 import state
 from llm import llm
-from retriever import retriever
+from retriever import retriever, async_retriever
 from nodes.calculator import execute_task_and_get_result
 from utils import send_logs, log_message
 import config
@@ -68,12 +72,22 @@ def retriever_helper(retriever, question, num_docs, filter):
     return docs
 
 
-@pw.udf(cache_strategy=DiskCache())
+def _required_value_question(company_name: str, year: str, key: str) -> str:
+    return f"What is the {key} for {company_name} in the year {year}?"
+
+
+# Shared by the UDF below and `_aget_required_value`, which call the cached
+# functions with the same (company_name, year, key) arguments, so a value is
+# computed once whichever path asks for it first
+_required_value_cache = DiskCache(name="kpi_required_values")
+
+
+@pw.udf(cache_strategy=_required_value_cache)
 def _get_required_value_with_pw(
     company_name: str, year: str, key: str
 ) -> dict[str, str | Optional[str]]:
     """Retrieve the required value based on the input using quantitative and qualitative logic."""
-    question = f"What is the {key} for {company_name} in the year {year}?"
+    question = _required_value_question(company_name, year, key)
 
     docs = []
     # metadata_text = "table == `False`"
@@ -230,7 +244,46 @@ def get_required_kpis(state: state.KPIState):
     return output_state
 
 
-def get_required_values(state: state.KPIState):
+async def _acompute_required_value(
+    company_name: str, year: str, key: str
+) -> dict[str, str | Optional[str]]:
+    """Async `_get_required_value_with_pw`, with the async retriever and LLM."""
+    question = _required_value_question(company_name, year, key)
+    docs = await async_retriever.asimilarity_search(
+        question, config.NUM_DOCS_TO_RETRIEVE
+    )
+    res = await value_llm.ainvoke({"question": question, "docs": docs})
+    return {
+        "company_name": company_name,
+        "year": year,
+        "key": key,
+        "value": res.value,
+    }
+
+
+_acompute_required_value_cached = _required_value_cache.wrap_async(
+    _acompute_required_value
+)
+
+
+async def _aget_required_value(inp: dict[str, str]):
+    """
+    Async counterpart of `_get_required_value`. A value already in the disk
+    cache of `_get_required_value_with_pw` is served from it, otherwise it is
+    computed on the event loop and stored there.
+    """
+    res = await _acompute_required_value_cached(
+        inp["company_name"], inp["year"], inp["key"]
+    )
+    return {
+        "company_name": inp["company_name"],
+        "year": inp["year"],
+        "key": inp["key"],
+        "value": res["value"],
+    }
+
+
+def _get_required_value_inputs(state: state.KPIState):
     log_message(f"---- GETTING REQUIRED VALUES ----", 1)
     kpis_by_company_year = state["analyses_kpis_by_company_year"]
 
@@ -253,14 +306,11 @@ def get_required_values(state: state.KPIState):
                     "year": company_year_pair[1],
                 }
             )
+    return inputs
 
-    with ThreadPoolExecutor() as executor:
-        values = list(
-            executor.map(
-                lambda inp: _get_required_value(inp),
-                inputs,
-            )
-        )
+
+def _get_required_values_output(state: state.KPIState, values):
+    kpis_by_company_year = state["analyses_kpis_by_company_year"]
 
     for value in values:
         if value["value"] is None:
@@ -324,6 +374,27 @@ def get_required_values(state: state.KPIState):
     return output_state
 
 
+def get_required_values(state: state.KPIState):
+    inputs = _get_required_value_inputs(state)
+
+    with ThreadPoolExecutor() as executor:
+        values = list(
+            executor.map(
+                lambda inp: _get_required_value(inp),
+                inputs,
+            )
+        )
+
+    return _get_required_values_output(state, values)
+
+
+async def aget_required_values(state: state.KPIState):
+    """Async version of `get_required_values`, fetching all values concurrently."""
+    inputs = _get_required_value_inputs(state)
+    values = await asyncio.gather(*[_aget_required_value(inp) for inp in inputs])
+    return _get_required_values_output(state, list(values))
+
+
 def calculate_kpis_for_company_year(kpis, values, company_name, year):
     if len(kpis) == 0:
         output_state = {
@@ -79,14 +79,14 @@ metadata_extraction_prompt = ChatPromptTemplate.from_messages(
 )
 metadata_extractor = metadata_extraction_prompt | llm.with_structured_output(
     QueryMetadata
-)
+).with_cache("extract_metadata")
 
 metadata_extraction_with_qq_prompt = ChatPromptTemplate.from_messages(
     [("system", _system_prompt), ("human", "Query: {query}")]
 )
 metadata_extractor_qq = metadata_extraction_with_qq_prompt | llm.with_structured_output(
     QueryMetadata_QQ
-)
+).with_cache("extract_metadata")
 
 
 def extract_metadata_1(state: state.InternalRAGState):
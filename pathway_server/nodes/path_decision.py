@@ -82,7 +82,7 @@ split_decider_first_prompt = ChatPromptTemplate.from_messages(
 
 split_path_first_decider = split_decider_first_prompt | llm.with_structured_output(
     PathDecider
-)
+).with_cache("split_path_decider_1")
 
 
 # splitting path decider to run just before the clarifying questions
@@ -136,7 +136,8 @@ split_decider_second_prompt_normal = ChatPromptTemplate.from_messages(
     ]
 )
 split_path_second_decider_normal = (
-    split_decider_second_prompt_normal | llm.with_structured_output(PathDecider)
+    split_decider_second_prompt_normal
+    | llm.with_structured_output(PathDecider).with_cache("split_path_decider_2")
 )
 
 split_decider_second_prompt_research = ChatPromptTemplate.from_messages(
@@ -146,7 +147,8 @@ split_decider_second_prompt_research = ChatPromptTemplate.from_messages(
     ]
 )
 split_path_second_decider_research = (
-    split_decider_second_prompt_research | llm.with_structured_output(PathDecider)
+    split_decider_second_prompt_research
+    | llm.with_structured_output(PathDecider).with_cache("split_path_decider_2")
 )
 
 
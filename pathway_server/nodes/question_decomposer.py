@@ -4,12 +4,13 @@ from pydantic import BaseModel, Field
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import AIMessage, RemoveMessage
 from utils import log_message
+from context_packer import pack_context
 from config import NUM_PREV_MESSAGES
 import state
 from state import QuestionNode, OverallState
 from llm import llm
 from prompt import prompts
-from retriever import cache_retriever
+from retriever import cache_retriever, async_cache_retriever
 import uuid , nodes 
 from utils import send_logs
 from config import LOGGING_SETTINGS
@@ -276,7 +277,7 @@ question_decomposition_prompt_v5 = ChatPromptTemplate.from_messages(
 
 question_decomposer_v5 = question_decomposition_prompt_v5 | llm.with_structured_output(
     DecomposedQuestions
-)
+).with_cache("question_decomposer_v5")
 
 
 ### 6 - question_decomposer_v6 [REPEATER LAYER 2 AND 3]
@@ -732,9 +733,11 @@ def combine_answer_v3(state: state.OverallState):
     """
 
     # question_trees=state['question_tree_store']
-    qa_pairs = "\n".join(state["qa_pairs"])
-
     original_question = state["question"]
+    qa_pairs = "\n".join(
+        pack_context("combine_answer_v3", original_question, state["qa_pairs"], render=str)
+    )
+
     image_url=state.get("image_url","")
     if state.get("image_url","")!="":
         image_url = f"data:image/jpeg;base64,{image_url}"
@@ -829,6 +832,23 @@ Answers:
 
 cache_answer = cache_answer_prompt | llm.with_structured_output(CacheSufficient)
 
+def _cache_answer_input(query, docs):
+    answers_str=[f"{no}. {i.metadata['answer']}" for no,i in enumerate(docs)]
+    return {
+        "question":query,
+        "answers":'\n'.join(answers_str)
+    }
+
+
+def _cached_answer(docs, index):
+    if index == -1:
+        return "no"
+
+    entry=docs[index]
+    answer=entry.metadata['answer']
+    return answer
+
+
 def cache_retriever_call(query):
     try:
         docs=cache_retriever.similarity_search(
@@ -839,34 +859,28 @@ def cache_retriever_call(query):
     except:
         return 'no'
     #print(docs)
-    answers_str=[f"{no}. {i.metadata['answer']}" for no,i in enumerate(docs)]
-    #print(query)
-    #print(answers_str)
-    index=cache_answer.invoke(
-        {
-            "question":query,
-            "answers":'\n'.join(answers_str)
-        }
-    ).index
+    index=cache_answer.invoke(_cache_answer_input(query, docs)).index
 
-    if index == -1:
-        return "no"
+    return _cached_answer(docs, index)
 
-    else:
-        entry=docs[index]
-        answer=entry.metadata['answer']
-        final=answer
-        #final={'answer':answer}
-    
-    #print('FINAL',final)
 
-    return final
+async def acache_retriever_call(query):
+    """Async version of `cache_retriever_call`."""
+    try:
+        docs=await async_cache_retriever.asimilarity_search(
+            query,
+            config.cache_retriever_DOCS,
+            metadata_filter=nodes.convert_metadata_to_jmespath({"is_cache":"True"})
+            )
+    except:
+        return 'no'
+    index=(await cache_answer.ainvoke(_cache_answer_input(query, docs))).index
+
+    return _cached_answer(docs, index)
     
 #making the node for it
 
-def cache_retriever_node(state:state.InternalRAGState ):
-
-    output=cache_retriever_call(state['question'])
+def _cache_retriever_output(output):
     answer=''
     if output!='No':
         answer=output
@@ -876,3 +890,15 @@ def cache_retriever_node(state:state.InternalRAGState ):
         'final_answer':answer,
         'answer':answer
     }
+
+
+def cache_retriever_node(state:state.InternalRAGState ):
+
+    output=cache_retriever_call(state['question'])
+    return _cache_retriever_output(output)
+
+
+async def acache_retriever_node(state:state.InternalRAGState ):
+
+    output=await acache_retriever_call(state['question'])
+    return _cache_retriever_output(output)
@@ -37,7 +37,9 @@ safety_prompt = ChatPromptTemplate.from_messages(
     ],
 )
 
-query_safety_checker = safety_prompt | llm.with_structured_output(SafetyChecker)
+query_safety_checker = safety_prompt | llm.with_structured_output(
+    SafetyChecker
+).with_cache("check_safety")
 
 
 def check_safety(state: state.OverallState):
@@ -0,0 +1,312 @@
+"""
+PDF parsers of the vector store servers (`vector_store.py`,
+`run_fast_server.py` and `run_multiserver.py`).
+
+They live in their own module so that the workers of `ingestion_pool` only
+import this module to get the parsers, instead of the server scripts with
+their document stores, workflows and LLMs. The LLM extracting the company and
+year of a document is only imported on first use, in the server process.
+`parser` parses its tables with the vision LLM: the layout of a document is
+parsed in the workers, and only the LLM calls are made in the server process
+(see `CustomOpenParse.aparse_nodes`).
+"""
+
+import os
+from io import BytesIO
+
+from langchain.prompts import ChatPromptTemplate
+from pathway.udfs import DiskCache, ExponentialBackoffRetryStrategy
+from pathway.xpacks.llm import llms
+from pathway.xpacks.llm.parsers import OpenParse
+from pydantic import BaseModel, Field
+
+from ingest_manifest import get_parser_version, ingest_manifest
+from ingestion_pool import ingestion_pool, register_parser
+from prompt import prompts
+
+os.environ["TESSDATA_PREFIX"] = "/usr/share/tesseract-ocr/5/tessdata"
+
+
+class FinancialStatementSchema(BaseModel):
+    """
+    The schema for the financial statement metadata.
+    """
+
+    company_name: str = Field(description="The name of the company.")
+    year: str = Field(description="The year of the financial statement.")
+
+
+_system_prompt = prompts.extract_compamy_system_prompt
+company_name_and_year_extractor_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", _system_prompt),
+        ("human", "Text: \n\n {text}"),
+    ]
+)
+_company_name_and_year_extractor = None
+
+
+def get_company_name_and_year_extractor():
+    global _company_name_and_year_extractor
+    if _company_name_and_year_extractor is None:
+        from llm import llm
+
+        _company_name_and_year_extractor = (
+            company_name_and_year_extractor_prompt
+            | llm.with_structured_output(FinancialStatementSchema)
+        )
+    return _company_name_and_year_extractor
+
+
+async def extract_company_name_and_year_from_nodes(
+    nodes: list[dict],
+) -> FinancialStatementSchema:
+    """
+    Extracts the 'Company Name' and 'Year of Report' from a list of nodes
+    (as returned by `CustomOpenParse.parse_nodes`).
+    """
+
+    # Combine text from nodes to form the document content
+    nodes_first_three_pages = []
+    for node in nodes:
+        if 0 <= node["page_no"] < 3:
+            nodes_first_three_pages.append(node)
+    document_text = "\n".join(node["text"] for node in nodes_first_three_pages)
+
+    res = await get_company_name_and_year_extractor().ainvoke(
+        {"text": document_text}
+    )
+
+    return res  # type: ignore
+
+
+class CustomOpenParse(OpenParse):
+    """
+    Custom OpenParse class with modified __wrapped__ behavior.
+    """
+
+    # Identifies the parser in the ingest manifest, see `get_parser_version`
+    parser_name = "open_parse_company_year"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.parser_version = get_parser_version(
+            type(self), kwargs, _system_prompt
+        )
+        # Tables parsed by a vision LLM: the layout is parsed in the workers
+        # and the LLM calls, through the DiskCache of the LLM, are made in the
+        # server process with the server's persistence config
+        table_args = self.doc_parser.table_args
+        self.llm_tables = (
+            isinstance(table_args, dict) and table_args["parsing_algorithm"] == "llm"
+        )
+        # Images parsed by an LLM cannot be split that way: such a parser
+        # runs whole in a thread of the server process instead of the workers
+        self.parse_in_worker = not self.doc_parser.image_args
+        register_parser(self)
+
+    @staticmethod
+    def _load_pdf(contents: bytes):
+        # Import dependencies locally to handle optional imports gracefully
+        try:
+            import openparse
+            from pypdf import PdfReader
+        except ImportError as e:
+            raise ImportError(
+                "Required library not found. Please ensure openparse and pypdf are installed."
+            ) from e
+
+        reader = PdfReader(stream=BytesIO(contents))
+        return openparse.Pdf(file=reader)
+
+    @staticmethod
+    def _node_dicts(nodes) -> list[dict]:
+        return [
+            {
+                "text": node.text,
+                "page_no": node.bbox[0].page if len(node.bbox) > 0 else -1,
+                "variant": str(node.variant),
+            }
+            for node in nodes
+        ]
+
+    def parse_nodes(self, contents: bytes) -> list[dict]:
+        """
+        Parse a PDF into its nodes, as plain dicts with their `text`,
+        `page_no` and `variant`. Runs in the workers of `ingestion_pool`, or
+        in a thread of the server process if not `parse_in_worker`.
+        """
+        # Original document parsing with custom modifications
+        parsed_content = self.doc_parser.parse(self._load_pdf(contents))
+        return self._node_dicts(parsed_content.nodes)
+
+    def parse_layout(self, contents: bytes) -> dict:
+        """
+        First step of `parse_nodes` for tables parsed by an LLM, all of it but
+        the LLM calls: the text elements of the PDF (with PyMuPDF) and the
+        bounding box and base64 PNG image of every table detected. Runs in
+        the workers of `ingestion_pool`.
+        """
+        from openparse import text
+        from openparse.schemas import Bbox
+        from openparse.tables.table_transformers.ml import find_table_bboxes
+        from openparse.tables.utils import (
+            adjust_bbox_with_padding,
+            crop_img_with_padding,
+            doc_to_imgs,
+        )
+        from pathway.xpacks.llm._parser_utils import img_to_b64
+
+        doc = self._load_pdf(contents)
+        # As `CustomDocumentParser.parse` and `_ingest_with_llm` of Pathway
+        text_elements = text.ingest(doc, parsing_method="pymupdf")
+        min_table_confidence = self.doc_parser.table_args.get(
+            "min_table_confidence", 0.7
+        )
+        pdoc = doc.to_pymupdf_doc()
+        pdf_as_imgs = doc_to_imgs(pdoc)
+        tables = []
+        for page_num, img in enumerate(pdf_as_imgs):
+            page = pdoc[page_num]
+            for table_bbox in find_table_bboxes(img, min_table_confidence):
+                padded_bbox = adjust_bbox_with_padding(
+                    bbox=table_bbox.bbox,
+                    page_width=page.rect.width,
+                    page_height=page.rect.height,
+                    padding_pct=0.05,
+                )
+                bbox = Bbox(
+                    page=page_num,
+                    x0=padded_bbox[0],
+                    y0=page.rect.height - padded_bbox[3],
+                    x1=padded_bbox[2],
+                    y1=page.rect.height - padded_bbox[1],
+                    page_width=page.rect.width,
+                    page_height=page.rect.height,
+                )
+                image = img_to_b64(crop_img_with_padding(img, padded_bbox))
+                tables.append((bbox, image))
+        return {"text_elements": text_elements, "tables": tables}
+
+    def build_nodes(self, layout: dict, table_texts: list[str]) -> list[dict]:
+        """
+        Last step of `parse_nodes` for tables parsed by an LLM: the nodes of
+        the `layout` of `parse_layout`, with the `table_texts` parsed by the
+        LLM, through the processing pipeline. Runs in the workers of
+        `ingestion_pool`.
+        """
+        from openparse.schemas import TableElement
+
+        table_elements = [
+            TableElement(bbox=bbox, text=table_text)
+            for (bbox, _), table_text in zip(layout["tables"], table_texts)
+        ]
+        nodes = self.doc_parser._elems_to_nodes(
+            layout["text_elements"]
+        ) + self.doc_parser._elems_to_nodes(table_elements)
+        return self._node_dicts(self.doc_parser.processing_pipeline.run(nodes))
+
+    async def aparse_nodes(self, contents: bytes) -> list[dict]:
+        """
+        The nodes of `parse_nodes`. With tables parsed by an LLM, the layout
+        is parsed by the workers of `ingestion_pool` (`parse_layout`), the
+        tables by the LLM on the event loop, and the nodes are built by the
+        workers (`build_nodes`). Other parsers run `parse_nodes` in a worker,
+        or in a thread if not `parse_in_worker`.
+        """
+        if not (self.llm_tables and self.parse_in_worker):
+            return await ingestion_pool.parse(self, contents)
+
+        from pathway.xpacks.llm._openparse_utils import (
+            _table_args_dict_to_model,
+            parse_image_list,
+        )
+
+        layout = await ingestion_pool.run(self, contents, "parse_layout", contents)
+        ingestion_pool.report(contents, "parsing tables", tables=len(layout["tables"]))
+        table_args = _table_args_dict_to_model(self.doc_parser.table_args)
+        try:
+            table_texts = await parse_image_list(
+                [image for _, image in layout["tables"]],
+                table_args.llm,
+                table_args.prompt,
+                table_args.llm_model,
+            )
+        except Exception as e:
+            ingestion_pool.report(contents, "failed", error=repr(e))
+            raise
+        nodes = await ingestion_pool.run(
+            self, contents, "build_nodes", layout, list(table_texts)
+        )
+        ingestion_pool.report(contents, "parsed", nodes=len(nodes))
+        return nodes
+
+    async def __wrapped__(self, contents: bytes) -> list[tuple[str, dict]]:
+        # Reuse the chunks of an identical file parsed before, by any server
+        entry = ingest_manifest.get(contents, self.parser_version)
+        if entry is not None:
+            return entry["docs"]
+
+        # Parsing is CPU-bound and runs in the worker processes, while the
+        # LLM calls parsing the tables and extracting the company and year
+        # run on the event loop
+        nodes = await self.aparse_nodes(contents)
+        try:
+            extracted_statement_schema = await extract_company_name_and_year_from_nodes(
+                nodes
+            )
+        except Exception as e:
+            ingestion_pool.report(contents, "failed", error=repr(e))
+            raise
+
+        company_name = extracted_statement_schema.company_name.lower().strip()
+        if company_name.endswith(" inc"):
+            company_name = company_name.replace(" inc", "")
+        elif company_name.endswith(" inc."):
+            company_name = company_name.replace(" inc.", "")
+
+        docs = [
+            (
+                node["text"],
+                {
+                    "company_name": company_name,
+                    "year": extracted_statement_schema.year.strip(),
+                    "page_no": node["page_no"],
+                    "variant": node["variant"],
+                },
+            )
+            for node in nodes
+        ]
+
+        ingest_manifest.put(contents, self.parser_version, {"docs": docs})
+        ingestion_pool.report(contents, "done", chunks=len(docs))
+
+        return docs
+
+
+vision_llm = llms.OpenAIChat(
+    model="gpt-4o-mini",
+    cache_strategy=DiskCache(),
+    retry_strategy=ExponentialBackoffRetryStrategy(max_retries=4),
+    verbose=True,
+)
+TABLE_PARSE_PROMPT = prompts.TABLE_PARSE_PROMPT
+# Tables parsed by the vision LLM, used by the slow servers
+parser = CustomOpenParse(
+    table_args={
+        "parsing_algorithm": "llm",
+        "llm": vision_llm,
+        "prompt": TABLE_PARSE_PROMPT,
+    },
+    parse_images=False,
+    cache_strategy=DiskCache(),
+)
+# Tables parsed by PyMuPDF, used by the fast server
+parser_fast = CustomOpenParse(
+    table_args={
+        "parsing_algorithm": "pymupdf",
+        "table_output_format": "markdown",
+    },
+    parse_images=False,
+    cache_strategy=DiskCache(),
+)
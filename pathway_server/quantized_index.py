@@ -0,0 +1,269 @@
+import os
+from typing import Callable
+
+import numpy as np
+
+import config
+from metadata_partitions import PartitionIndex, matches, parse_filter
+
+# Number of set bits of every byte, to compute Hamming distances of packed codes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+# Rows scored at once, bounds the temporary memory of a search
+_SEARCH_BLOCK = 65536
+
+
+class QuantizedVectorIndex:
+    """
+    Cosine KNN index keeping only quantised codes of the vectors in RAM.
+
+    The first pass of a search scores every vector from its code:
+    - "int8": every vector is scaled to [-127, 127] and rounded, 1 byte per
+      dimension (4x smaller than float32), scored against the float query.
+    - "binary": the sign of every component, 1 bit per dimension (32x
+      smaller), scored by Hamming distance.
+    The `k * oversample` best candidates are then re-scored exactly with their
+    float vectors, which are memory-mapped from `vectors_file` so that they
+    stay on disk (or kept in RAM if no file is given).
+
+    Keys can be any hashable. Removed keys are masked out and dropped from
+    the posting lists; once more than `compact_threshold` of the rows are
+    removed, the live rows are moved to the front so that the storage of
+    the removed ones is reused and searches no longer score them.
+
+    A search can be restricted by a metadata filter built by
+    `nodes.convert_metadata_to_jmespath`. The rows of the (company, year)
+    partitions the filter selects are looked up in posting lists, so only
+    those are scored; other conditions are checked on the metadata of the
+    rows left. Without a filter on a partition key, the whole index is
+    scanned. Filters of another form are evaluated on the metadata of every
+    active row by `filter_fallback(metadata_filter, metadata)`, if given.
+    """
+
+    def __init__(
+        self,
+        dimensions: int = config.KNN_DIMENSIONS,
+        kind: str = config.QUANTIZED_INDEX_KIND,
+        vectors_file: str | None = None,
+        reserved_space: int = config.KNN_RESERVED_SPACE,
+        oversample: int = config.QUANTIZED_INDEX_OVERSAMPLE,
+        filter_fallback: Callable[[str, dict], bool] | None = None,
+        compact_threshold: float = config.QUANTIZED_INDEX_COMPACT_THRESHOLD,
+    ):
+        if kind not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantisation kind: {kind}")
+        self.dimensions = dimensions
+        self.kind = kind
+        self.vectors_file = vectors_file
+        self.oversample = oversample
+        self.filter_fallback = filter_fallback
+        self.compact_threshold = compact_threshold
+        self._keys = []
+        self._rows = {}
+        self._size = 0
+        self._capacity = 0
+        self._codes = None
+        self._scales = None
+        self._active = None
+        self._vectors = None
+        self._metadata = []
+        self._partitions = PartitionIndex()
+        self._reserve(max(reserved_space, 1))
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def memory_usage(self) -> int:
+        """Bytes of RAM held by the codes, excluding the float vectors on disk."""
+        nbytes = self._codes.nbytes + self._scales.nbytes + self._active.nbytes
+        if self.vectors_file is None:
+            nbytes += self._vectors.nbytes
+        return nbytes
+
+    def _code_width(self) -> int:
+        if self.kind == "binary":
+            return (self.dimensions + 7) // 8
+        return self.dimensions
+
+    def _reserve(self, capacity: int):
+        """Grow the storage to `capacity` vectors, keeping the ones added."""
+        codes = np.zeros(
+            (capacity, self._code_width()),
+            dtype=np.uint8 if self.kind == "binary" else np.int8,
+        )
+        scales = np.zeros(capacity, dtype=np.float32)
+        active = np.zeros(capacity, dtype=bool)
+        if self._codes is not None:
+            codes[: self._size] = self._codes[: self._size]
+            scales[: self._size] = self._scales[: self._size]
+            active[: self._size] = self._active[: self._size]
+        self._codes, self._scales, self._active = codes, scales, active
+
+        if self.vectors_file is None:
+            vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            if self._vectors is not None:
+                vectors[: self._size] = self._vectors[: self._size]
+            self._vectors = vectors
+        else:
+            if self._vectors is not None:
+                self._vectors.flush()
+            if os.path.dirname(self.vectors_file):
+                os.makedirs(os.path.dirname(self.vectors_file), exist_ok=True)
+            # Extending the file keeps the rows already written
+            with open(self.vectors_file, "ab") as f:
+                f.truncate(capacity * self.dimensions * 4)
+            self._vectors = np.memmap(
+                self.vectors_file,
+                dtype=np.float32,
+                mode="r+",
+                shape=(capacity, self.dimensions),
+            )
+        self._capacity = capacity
+
+    def _quantize(self, vectors: np.ndarray):
+        if self.kind == "binary":
+            return np.packbits(vectors > 0, axis=1), np.ones(len(vectors))
+        max_abs = np.abs(vectors).max(axis=1)
+        max_abs[max_abs == 0] = 1
+        codes = np.round(vectors / max_abs[:, None] * 127).astype(np.int8)
+        return codes, max_abs / 127
+
+    def add(self, keys: list, vectors, metadata: list[dict] | None = None) -> None:
+        """Add (or replace) the vectors of `keys`, with their `metadata`."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        vectors = vectors / norms
+
+        self.remove([key for key in keys if key in self._rows])
+        if self._size + len(vectors) > self._capacity:
+            self._reserve(max(2 * self._capacity, self._size + len(vectors)))
+
+        rows = slice(self._size, self._size + len(vectors))
+        self._codes[rows], self._scales[rows] = self._quantize(vectors)
+        self._vectors[rows] = vectors
+        self._active[rows] = True
+        if metadata is None:
+            metadata = [{} for _ in keys]
+        for row, (key, key_metadata) in enumerate(
+            zip(keys, metadata), start=self._size
+        ):
+            self._keys.append(key)
+            self._rows[key] = row
+            self._metadata.append(key_metadata)
+            self._partitions.add(row, key_metadata)
+        self._size += len(vectors)
+
+    def remove(self, keys: list) -> None:
+        for key in keys:
+            row = self._rows.pop(key, None)
+            if row is not None:
+                self._active[row] = False
+                self._partitions.remove(row, self._metadata[row])
+                self._keys[row] = None
+                self._metadata[row] = None
+        if self._size - len(self) > self.compact_threshold * self._size:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Move the live rows to the front, reclaiming the removed ones."""
+        live = np.flatnonzero(self._active[: self._size])
+        # Every live row moves to a lower (or the same) row, so copying block
+        # by block in order never overwrites a row not yet copied, and the
+        # memory-mapped vectors are not all loaded at once
+        for start in range(0, len(live), _SEARCH_BLOCK):
+            end = min(start + _SEARCH_BLOCK, len(live))
+            block = live[start:end]
+            self._codes[start:end] = self._codes[block]
+            self._scales[start:end] = self._scales[block]
+            self._vectors[start:end] = self._vectors[block]
+        self._active[: len(live)] = True
+        self._active[len(live) : self._size] = False
+        self._keys = [self._keys[row] for row in live]
+        self._metadata = [self._metadata[row] for row in live]
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+        self._partitions = PartitionIndex(self._partitions.keys)
+        for row, metadata in enumerate(self._metadata):
+            self._partitions.add(row, metadata)
+        self._size = len(live)
+
+    def _approximate_scores(self, query: np.ndarray, rows: np.ndarray | None):
+        """First-pass scores of `rows` (all the rows if None)."""
+        num_rows = self._size if rows is None else len(rows)
+        scores = np.empty(num_rows, dtype=np.float32)
+        if self.kind == "binary":
+            query_code = np.packbits(query > 0)
+        for start in range(0, num_rows, _SEARCH_BLOCK):
+            end = min(start + _SEARCH_BLOCK, num_rows)
+            block = slice(start, end) if rows is None else rows[start:end]
+            if self.kind == "binary":
+                distances = _POPCOUNT[self._codes[block] ^ query_code].sum(
+                    axis=1, dtype=np.int32
+                )
+                scores[start:end] = -distances
+            else:
+                scores[start:end] = (
+                    self._codes[block].astype(np.float32) @ query
+                ) * self._scales[block]
+        return scores
+
+    def _filter_rows(self, metadata_filter: str | None) -> np.ndarray | None:
+        """Active rows matching `metadata_filter`, None for all the rows."""
+        try:
+            clauses = parse_filter(metadata_filter)
+        except ValueError:
+            if self.filter_fallback is None:
+                raise
+            rows = np.flatnonzero(self._active[: self._size])
+            return np.array(
+                [
+                    row
+                    for row in rows
+                    if self.filter_fallback(metadata_filter, self._metadata[row])
+                ],
+                dtype=np.int64,
+            )
+        rows = self._partitions.rows(clauses)
+        if rows is None:
+            if clauses is None and len(self) == self._size:
+                return None
+            rows = np.arange(self._size)
+        rows = rows[self._active[rows]]
+        if clauses is not None and not all(
+            self._partitions.is_partition_clause(clause) for clause in clauses
+        ):
+            rows = np.array(
+                [row for row in rows if matches(clauses, self._metadata[row])],
+                dtype=np.int64,
+            )
+        return rows
+
+    def search(
+        self,
+        query,
+        k: int,
+        oversample: int | None = None,
+        metadata_filter: str | None = None,
+    ):
+        """
+        The `k` nearest keys of `query` matching `metadata_filter` with their
+        cosine similarity, best first.
+        """
+        rows = self._filter_rows(metadata_filter)
+        num_rows = self._size if rows is None else len(rows)
+        if num_rows == 0 or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(self.dimensions)
+        query = query / (np.linalg.norm(query) or 1)
+        k = min(k, num_rows)
+        num_candidates = min(k * (oversample or self.oversample), num_rows)
+
+        scores = self._approximate_scores(query, rows)
+        candidates = np.argpartition(-scores, num_candidates - 1)[:num_candidates]
+        if rows is not None:
+            candidates = rows[candidates]
+        # Sorted rows read the memory-mapped vectors sequentially
+        candidates.sort()
+        exact = self._vectors[candidates] @ query
+        best = np.argsort(-exact)[:k]
+        return [(self._keys[candidates[i]], float(exact[i])) for i in best]
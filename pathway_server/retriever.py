@@ -1,33 +1,763 @@
-from typing import Optional
+import asyncio
+import copy
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Optional
 
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
 from langchain_community.vectorstores import PathwayVectorClient
+from langchain_core.documents import Document
 from pathway.xpacks.llm.vector_store import VectorStoreClient
 
 import config
 
 
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to a store whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker guarding one vector store endpoint.
+
+    After `failure_threshold` consecutive failures the circuit opens and every
+    request fails immediately with `CircuitOpenError`. Once `reset_timeout`
+    seconds have passed it half-opens and lets up to `half_open_max_calls`
+    probe requests through: a successful probe closes the circuit, a failed
+    one opens it again.
+
+    Breakers are shared per URL (see `get_circuit_breaker`), so the sync and
+    async clients of the same store trip together while an outage of the
+    cache store does not affect the vector store.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = config.VECTOR_STORE_CIRCUIT_BREAKER_FAILURES,
+        reset_timeout: float = config.VECTOR_STORE_CIRCUIT_BREAKER_RESET_TIMEOUT,
+        half_open_max_calls: int = config.VECTOR_STORE_CIRCUIT_BREAKER_PROBES,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.reset_timeout
+        ):
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+        return self._state
+
+    def before_call(self) -> None:
+        """Raise `CircuitOpenError` if the request must not be sent."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if (
+                state == self.HALF_OPEN
+                and self._probes_in_flight < self.half_open_max_calls
+            ):
+                self._probes_in_flight += 1
+                return
+            self._rejected += 1
+        raise CircuitOpenError(f"Circuit open for `{self.name}`")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                print(f"Circuit for `{self.name}` closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probes_in_flight = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (
+                state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                print(f"Circuit for `{self.name}` opened")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probes_in_flight = 0
+
+    def statistics(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "rejected": self._rejected,
+            }
+
+
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """Return the circuit breaker of the store at `url`, creating it if needed."""
+    with _circuit_breakers_lock:
+        if url not in _circuit_breakers:
+            _circuit_breakers[url] = CircuitBreaker(url)
+        return _circuit_breakers[url]
+
+
+class PooledVectorStoreClient(VectorStoreClient):
+    """
+    VectorStoreClient that sends every request through a shared keep-alive
+    session instead of opening a new connection per call, guarded by the
+    circuit breaker of its URL.
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        url: Optional[str] = None,
+        timeout: int = config.VECTOR_STORE_TIMEOUT,
+        session: Optional[requests.Session] = None,
+    ):
+        super().__init__(host, port, url, timeout)
+        self.session = session or requests.Session()
+        self.circuit_breaker = get_circuit_breaker(self.url)
+
+    def _post(self, route: str, **kwargs) -> requests.Response:
+        self.circuit_breaker.before_call()
+        try:
+            response = self.session.post(
+                self.url + route,
+                headers=self._get_request_headers(),
+                timeout=self.timeout,
+                **kwargs,
+            )
+        except requests.RequestException:
+            self.circuit_breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+        return response
+
+    def query(
+        self,
+        query: str,
+        k: int = 3,
+        metadata_filter: str | None = None,
+        filepath_globpattern: str | None = None,
+    ) -> list[dict]:
+        data = {"query": query, "k": k}
+        if metadata_filter is not None:
+            data["metadata_filter"] = metadata_filter
+        if filepath_globpattern is not None:
+            data["filepath_globpattern"] = filepath_globpattern
+        response = self._post("/v1/retrieve", data=json.dumps(data))
+        responses = response.json()
+        return sorted(responses, key=lambda x: x["dist"])
+
+    # Make an alias
+    __call__ = query
+
+    def query_batch(
+        self,
+        queries: list[tuple[str, int, str | None]],
+    ) -> list[list[dict]]:
+        """
+        Perform many queries in one request to `/v1/retrieve_batch`.
+
+        Args:
+            queries: list of `(query, k, metadata_filter)` triples, the filter
+                being a JMESPath string or None.
+
+        Returns:
+            One list of results per query, in the order the queries were given.
+            Falls back to one `/v1/retrieve` call per query if the server does
+            not serve the batch route.
+        """
+        data = {
+            "queries": [
+                {"query": query, "k": k, "metadata_filter": metadata_filter}
+                for query, k, metadata_filter in queries
+            ]
+        }
+        response = self._post("/v1/retrieve_batch", data=json.dumps(data))
+        if response.status_code == 404:
+            return [
+                self.query(query, k, metadata_filter)
+                for query, k, metadata_filter in queries
+            ]
+        responses = response.json()
+        return [sorted(results, key=lambda x: x["dist"]) for results in responses]
+
+    def get_vectorstore_statistics(self):
+        """Fetch basic statistics about the vector store."""
+        response = self._post("/v1/statistics", json={})
+        return response.json()
+
+    def get_input_files(
+        self,
+        metadata_filter: str | None = None,
+        filepath_globpattern: str | None = None,
+    ):
+        """Fetch information on documents in the the vector store."""
+        response = self._post(
+            "/v1/inputs",
+            json={
+                "metadata_filter": metadata_filter,
+                "filepath_globpattern": filepath_globpattern,
+            },
+        )
+        return response.json()
+
+    def _get_request_headers(self):
+        return {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+
+class RetrievalCache:
+    """
+    Thread-safe LRU cache of raw retrieval results with a time to live.
+
+    Entries are keyed on `(query, k, metadata_filter, filepath_globpattern)`,
+    see `PathwayVectorStoreClient._cache_key`. Results are deep-copied on the
+    way in and out so callers are free to modify the returned metadata.
+
+    Caches are shared per URL (see `get_retrieval_cache`), so the sync and
+    async clients of the same store reuse each other's results. The cache is
+    emptied when the version of the store given to `set_store_version`
+    changes.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = config.VECTOR_STORE_CACHE_MAXSIZE,
+        ttl: float = config.VECTOR_STORE_CACHE_TTL,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._store_version = None
+        self._store_version_checked_at = None
+
+    def get(self, key) -> list[dict] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            results = entry[1]
+        return copy.deepcopy(results)
+
+    def put(self, key, results: list[dict]) -> None:
+        results = copy.deepcopy(results)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def should_validate(self) -> bool:
+        """
+        Whether the store must be asked for its version, at most once every
+        `config.VECTOR_STORE_CACHE_VALIDATION_INTERVAL` seconds.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if (
+                self._store_version_checked_at is not None
+                and now - self._store_version_checked_at
+                < config.VECTOR_STORE_CACHE_VALIDATION_INTERVAL
+            ):
+                return False
+            self._store_version_checked_at = now
+            return True
+
+    def set_store_version(self, statistics: dict) -> None:
+        """Drop the cached results if `/v1/statistics` reports a change."""
+        version = (
+            statistics.get("file_count"),
+            statistics.get("last_modified"),
+            statistics.get("last_indexed"),
+        )
+        with self._lock:
+            if version == self._store_version:
+                return
+            self._store_version = version
+        self.clear()
+
+    def statistics(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+_retrieval_caches: dict[str, RetrievalCache] = {}
+_retrieval_caches_lock = threading.Lock()
+
+
+def get_retrieval_cache(url: str) -> RetrievalCache:
+    """Return the result cache of the store at `url`, creating it if needed."""
+    with _retrieval_caches_lock:
+        if url not in _retrieval_caches:
+            _retrieval_caches[url] = RetrievalCache()
+        return _retrieval_caches[url]
+
+
 class PathwayVectorStoreClient(PathwayVectorClient):
+    # One session per process, shared by every client so that connections to
+    # the same host are reused across `retriever`, `cache_retriever` and the
+    # multiserver clients.
+    _session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+
     def __init__(
         self,
         host: Optional[str] = None,
         port: Optional[int] = None,
         url: Optional[str] = None,
         timeout: int = config.VECTOR_STORE_TIMEOUT,
+        cache: bool = config.VECTOR_STORE_CACHE,
     ):
         super().__init__(host, port, url)
 
-        self.client = VectorStoreClient(host, port, url, timeout)
-    
-    
+        self.client = PooledVectorStoreClient(
+            host, port, url, timeout, session=self.get_session()
+        )
+        # Results of identical retrievals are reused until the store reports
+        # a change in its documents (see `_validate_cache`)
+        self.cache = get_retrieval_cache(self.client.url) if cache else None
+
+    @classmethod
+    def get_session(cls) -> requests.Session:
+        """Return the process-wide pooled session, creating it on first use."""
+        with cls._session_lock:
+            if cls._session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=config.VECTOR_STORE_POOL_CONNECTIONS,
+                    pool_maxsize=config.VECTOR_STORE_POOL_MAXSIZE,
+                    pool_block=config.VECTOR_STORE_POOL_BLOCK,
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                cls._session = session
+            return cls._session
+
+    @classmethod
+    def pool_statistics(cls) -> dict[str, dict[str, int]]:
+        """
+        Per-host statistics of the shared connection pool.
+
+        Returns:
+            A mapping from `host:port` to the number of connections opened,
+            requests sent, idle keep-alive connections and the pool size.
+        """
+        stats = {}
+        if cls._session is None:
+            return stats
+        pools = cls._session.get_adapter("http://").poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            idle_connections = 0
+            if pool.pool:
+                # urllib3 fills the queue with None placeholders up to maxsize,
+                # only the other entries are open keep-alive connections
+                with pool.pool.mutex:
+                    idle_connections = sum(
+                        conn is not None for conn in pool.pool.queue
+                    )
+            stats[f"{pool.host}:{pool.port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle_connections": idle_connections,
+                "maxsize": pool.pool.maxsize if pool.pool else 0,
+            }
+        return stats
+
+    @staticmethod
+    def _cache_key(
+        query: str,
+        k: int,
+        metadata_filter: str | None,
+        filepath_globpattern: str | None = None,
+    ) -> tuple:
+        # Whitespace does not change the meaning of a query or a JMESPath filter
+        query = " ".join(query.split())
+        metadata_filter = " ".join((metadata_filter or "").split()) or None
+        return (query, k, metadata_filter, filepath_globpattern)
 
-    def similarity_search(self, *args, **kwargs):
+    def _validate_cache(self) -> None:
+        """
+        Drop the cached results if the documents of the store changed, as
+        reported by `/v1/statistics`. The store is asked at most once every
+        `config.VECTOR_STORE_CACHE_VALIDATION_INTERVAL` seconds.
+        """
+        if not self.cache.should_validate():
+            return
+        try:
+            statistics = self.client.get_vectorstore_statistics()
+        except Exception as e:
+            print(f"Error: {e}")
+            return
+        self.cache.set_store_version(statistics)
+
+    def cache_statistics(self) -> dict:
+        """Hit/miss counters of the result cache, empty if it is disabled."""
+        if self.cache is None:
+            return {}
+        return self.cache.statistics()
+
+    def _query(
+        self,
+        query: str,
+        k: int,
+        metadata_filter: str | None,
+        filepath_globpattern: str | None,
+    ) -> list[dict]:
+        if self.cache is None:
+            return self.client.query(query, k, metadata_filter, filepath_globpattern)
+        self._validate_cache()
+        key = self._cache_key(query, k, metadata_filter, filepath_globpattern)
+        rets = self.cache.get(key)
+        if rets is None:
+            rets = self.client.query(query, k, metadata_filter, filepath_globpattern)
+            self.cache.put(key, rets)
+        return rets
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        metadata_filter: str | None = None,
+        filepath_globpattern: str | None = None,
+        **kwargs: Any,
+    ) -> list[Document]:
         # Check config for RETRIEVER_FALL_BACK
         if config.SIMULATE_ERRORS["retriever"]:
             raise ValueError("Simulating error in `retriever`")
+        rets = self._query(query, k, metadata_filter, filepath_globpattern)
+        return [
+            Document(page_content=ret["text"], metadata=ret["metadata"])
+            for ret in rets
+        ]
+
+    def similarity_search_batch(
+        self, queries: list[tuple[str, int, str | None]]
+    ) -> list[list[Document]]:
+        """
+        Run several similarity searches in a single round trip.
+
+        Args:
+            queries: list of `(query, k, metadata_filter)` triples. An empty
+                filter (`""` or None) searches the whole store.
+
+        Returns:
+            One list of documents per query, in the same order. Only the
+            queries missing from the result cache are sent to the store.
+        """
+        if config.SIMULATE_ERRORS["retriever"]:
+            raise ValueError("Simulating error in `retriever`")
+        if len(queries) == 0:
+            return []
+        queries = [
+            (query, k, metadata_filter or None) for query, k, metadata_filter in queries
+        ]
+
+        if self.cache is None:
+            rets = self.client.query_batch(queries)
         else:
-            # Call the parent class's similarity_search method
-            return super().similarity_search(*args, **kwargs)
-    
+            self._validate_cache()
+            keys = [self._cache_key(*query) for query in queries]
+            rets = [self.cache.get(key) for key in keys]
+            missing = [i for i, ret in enumerate(rets) if ret is None]
+            if len(missing) > 0:
+                fetched = self.client.query_batch([queries[i] for i in missing])
+                for i, ret in zip(missing, fetched):
+                    self.cache.put(keys[i], ret)
+                    rets[i] = ret
+
+        return [
+            [
+                Document(page_content=ret["text"], metadata=ret["metadata"])
+                for ret in results
+            ]
+            for results in rets
+        ]
+
+
+class AsyncPathwayVectorStoreClient:
+    """
+    asyncio counterpart of `PathwayVectorStoreClient` built on aiohttp, so that
+    many retrievals can be in flight on a single event loop. Results are
+    cached in the same `RetrievalCache` as the sync client of the store.
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        url: Optional[str] = None,
+        timeout: int = config.VECTOR_STORE_TIMEOUT,
+        cache: bool = config.VECTOR_STORE_CACHE,
+    ):
+        self.url = url or f"http://{host}:{port}"
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # aiohttp sessions can only be used on the loop they were created on,
+        # every loop gets its own session and the generator closing it
+        self._sessions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.circuit_breaker = get_circuit_breaker(self.url)
+        self.cache = get_retrieval_cache(self.url) if cache else None
+
+    @staticmethod
+    async def _session_closer(session: aiohttp.ClientSession):
+        """
+        Async generator closing `session` when it is finalised. Started on the
+        loop of the session, it is finalised by `loop.shutdown_asyncgens()`
+        (as `asyncio.run` does before closing the loop), so the session of a
+        short-lived loop is closed with it instead of leaking its connector.
+        """
+        try:
+            yield
+        finally:
+            await session.close()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session, closer = self._sessions.get(loop, (None, None))
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=config.ASYNC_VECTOR_STORE_CONNECTION_LIMIT
+                ),
+                timeout=self.timeout,
+                headers={"Content-Type": "application/json"},
+            )
+            # the loop only keeps a weak reference to its async generators
+            closer = self._session_closer(session)
+            await closer.asend(None)
+            self._sessions[loop] = (session, closer)
+        return session
+
+    async def _apost(
+        self, route: str, not_found_ok: bool = False, **kwargs
+    ) -> tuple[int, Any]:
+        """
+        POST to `route`, returning the status and the decoded JSON body.
+
+        Raises:
+            aiohttp.ClientResponseError: if the status is not 2xx, except for
+                a 404 when `not_found_ok`, which gives a None body
+        """
+        self.circuit_breaker.before_call()
+        error = None
+        body = None
+        session = await self._get_session()
+        try:
+            async with session.post(self.url + route, **kwargs) as response:
+                status = response.status
+                if status == 404 and not_found_ok:
+                    pass
+                elif status >= 400:
+                    error = aiohttp.ClientResponseError(
+                        response.request_info,
+                        response.history,
+                        status=status,
+                        message=response.reason or "",
+                        headers=response.headers,
+                    )
+                else:
+                    body = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError):
+            self.circuit_breaker.record_failure()
+            raise
+        if status >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+        if error is not None:
+            raise error
+        return status, body
+
+    async def aquery(
+        self,
+        query: str,
+        k: int = 3,
+        metadata_filter: str | None = None,
+        filepath_globpattern: str | None = None,
+    ) -> list[dict]:
+        data = {"query": query, "k": k}
+        if metadata_filter is not None:
+            data["metadata_filter"] = metadata_filter
+        if filepath_globpattern is not None:
+            data["filepath_globpattern"] = filepath_globpattern
+        _, responses = await self._apost("/v1/retrieve", data=json.dumps(data))
+        return sorted(responses, key=lambda x: x["dist"])
+
+    async def aquery_batch(
+        self, queries: list[tuple[str, int, str | None]]
+    ) -> list[list[dict]]:
+        data = {
+            "queries": [
+                {"query": query, "k": k, "metadata_filter": metadata_filter}
+                for query, k, metadata_filter in queries
+            ]
+        }
+        status, responses = await self._apost(
+            "/v1/retrieve_batch", not_found_ok=True, data=json.dumps(data)
+        )
+        if status == 404:
+            return list(
+                await asyncio.gather(
+                    *[
+                        self.aquery(query, k, metadata_filter)
+                        for query, k, metadata_filter in queries
+                    ]
+                )
+            )
+        return [sorted(results, key=lambda x: x["dist"]) for results in responses]
+
+    async def _avalidate_cache(self) -> None:
+        """Async `PathwayVectorStoreClient._validate_cache`."""
+        if not self.cache.should_validate():
+            return
+        try:
+            statistics = await self.aget_vectorstore_statistics()
+        except Exception as e:
+            print(f"Error: {e}")
+            return
+        self.cache.set_store_version(statistics)
+
+    def cache_statistics(self) -> dict:
+        """Hit/miss counters of the result cache, empty if it is disabled."""
+        if self.cache is None:
+            return {}
+        return self.cache.statistics()
+
+    async def _aquery(
+        self,
+        query: str,
+        k: int,
+        metadata_filter: str | None,
+        filepath_globpattern: str | None,
+    ) -> list[dict]:
+        if self.cache is None:
+            return await self.aquery(query, k, metadata_filter, filepath_globpattern)
+        await self._avalidate_cache()
+        key = PathwayVectorStoreClient._cache_key(
+            query, k, metadata_filter, filepath_globpattern
+        )
+        rets = self.cache.get(key)
+        if rets is None:
+            rets = await self.aquery(query, k, metadata_filter, filepath_globpattern)
+            self.cache.put(key, rets)
+        return rets
+
+    async def asimilarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        metadata_filter: str | None = None,
+        filepath_globpattern: str | None = None,
+        **kwargs: Any,
+    ) -> list[Document]:
+        if config.SIMULATE_ERRORS["retriever"]:
+            raise ValueError("Simulating error in `retriever`")
+        rets = await self._aquery(query, k, metadata_filter, filepath_globpattern)
+        return [
+            Document(page_content=ret["text"], metadata=ret["metadata"])
+            for ret in rets
+        ]
+
+    async def asimilarity_search_batch(
+        self, queries: list[tuple[str, int, str | None]]
+    ) -> list[list[Document]]:
+        """Async version of `PathwayVectorStoreClient.similarity_search_batch`."""
+        if config.SIMULATE_ERRORS["retriever"]:
+            raise ValueError("Simulating error in `retriever`")
+        if len(queries) == 0:
+            return []
+        queries = [
+            (query, k, metadata_filter or None) for query, k, metadata_filter in queries
+        ]
+
+        if self.cache is None:
+            rets = await self.aquery_batch(queries)
+        else:
+            await self._avalidate_cache()
+            keys = [PathwayVectorStoreClient._cache_key(*query) for query in queries]
+            rets = [self.cache.get(key) for key in keys]
+            missing = [i for i, ret in enumerate(rets) if ret is None]
+            if len(missing) > 0:
+                fetched = await self.aquery_batch([queries[i] for i in missing])
+                for i, ret in zip(missing, fetched):
+                    self.cache.put(keys[i], ret)
+                    rets[i] = ret
+        return [
+            [
+                Document(page_content=ret["text"], metadata=ret["metadata"])
+                for ret in results
+            ]
+            for results in rets
+        ]
+
+    async def aget_vectorstore_statistics(self) -> dict:
+        """Fetch basic statistics about the vector store."""
+        _, statistics = await self._apost("/v1/statistics", json={})
+        return statistics
+
+    async def aclose(self) -> None:
+        """Close the session opened on the running event loop, if any."""
+        _, closer = self._sessions.pop(asyncio.get_running_loop(), (None, None))
+        if closer is not None:
+            await closer.aclose()
 
 
 retriever = PathwayVectorStoreClient(
@@ -37,3 +767,11 @@ retriever = PathwayVectorStoreClient(
 cache_retriever = PathwayVectorStoreClient(
     url=f"http://{config.CACHE_STORE_HOST}:{config.CACHE_STORE_PORT}"
 )
+
+async_retriever = AsyncPathwayVectorStoreClient(
+    url=f"http://{config.VECTOR_STORE_HOST}:{config.VECTOR_STORE_PORT}",
+)
+
+async_cache_retriever = AsyncPathwayVectorStoreClient(
+    url=f"http://{config.CACHE_STORE_HOST}:{config.CACHE_STORE_PORT}"
+)
@@ -1,11 +1,11 @@
 from pathway.xpacks.llm.document_store import DocumentStore
-from pathway.xpacks.llm.servers import DocumentStoreServer
-from pathway.stdlib.indexing import BruteForceKnnFactory
 from pathway.udfs import DiskCache
 from pathway.xpacks.llm import embedders
 import pathway as pw
 from dotenv import load_dotenv
 import config
+from document_store_server import BatchDocumentStoreServer
+from knn_index import make_knn_index
 from langchain_core.documents import Document
 
 load_dotenv()
@@ -13,12 +13,7 @@ load_dotenv()
 # Initialize Embedder and KNN Index
 embedder = embedders.OpenAIEmbedder(cache_strategy=DiskCache())
 
-knn_index = BruteForceKnnFactory(
-    reserved_space=1000,
-    embedder=embedder,
-    metric=pw.engine.BruteForceKnnMetricKind.COS,
-    dimensions=1536,
-)
+knn_index = make_knn_index(embedder)
 
 
 # Define schema to match JSON structure
@@ -82,7 +77,7 @@ vector_store = DocumentStore(
 )
 
 # Run the server
-server = DocumentStoreServer(
+server = BatchDocumentStoreServer(
     host=config.CACHE_STORE_HOST,
     port=config.CACHE_STORE_PORT,
     document_store=vector_store,
@@ -1,4 +1,5 @@
 from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableLambda
 
 import state
 from nodes import kpi as kpis_nodes
@@ -8,7 +9,7 @@ graph = StateGraph(state.KPIState)
 
 # fmt: off
 graph.add_node(kpis_nodes.get_required_kpis.__name__, kpis_nodes.get_required_kpis)
-graph.add_node(kpis_nodes.get_required_values.__name__, kpis_nodes.get_required_values)
+graph.add_node(kpis_nodes.get_required_values.__name__, RunnableLambda(kpis_nodes.get_required_values, afunc=kpis_nodes.aget_required_values))
 graph.add_node(kpis_nodes.calculate_kpis.__name__, kpis_nodes.calculate_kpis)
 graph.add_node(kpis_nodes.generate_answer_from_kpis.__name__, kpis_nodes.generate_answer_from_kpis)
 
@@ -1,4 +1,5 @@
 from langgraph.graph import END, StateGraph, START
+from langchain_core.runnables import RunnableLambda
 
 import state, nodes, edges
 from config import WORKFLOW_SETTINGS
@@ -14,7 +15,7 @@ graph.add_node(nodes.generate_answer_with_citation_state.__name__, nodes.generat
 
 
 if WORKFLOW_SETTINGS['semantic_cache']:
-    graph.add_node(nodes.cache_retriever_node.__name__, nodes.cache_retriever_node)
+    graph.add_node(nodes.cache_retriever_node.__name__, RunnableLambda(nodes.cache_retriever_node, afunc=nodes.acache_retriever_node))
 
 
 if WORKFLOW_SETTINGS["assess_graded_documents"] or WORKFLOW_SETTINGS["assess_metadata_filters"] or WORKFLOW_SETTINGS["check_hallucination"] or WORKFLOW_SETTINGS["grade_answer"]:
@@ -43,9 +44,9 @@ else:
 if WORKFLOW_SETTINGS["metadata_filtering"]:
     graph.add_node(nodes.extract_metadata.__name__, nodes.extract_metadata)
     if WORKFLOW_SETTINGS["metadata_filtering_with_quant_qual"]:
-        graph.add_node("retriever", nodes.retrieve_documents_with_quant_qual)
+        graph.add_node("retriever", RunnableLambda(nodes.retrieve_documents_with_quant_qual, afunc=nodes.aretrieve_documents_with_quant_qual))
     else:
-        graph.add_node("retriever", nodes.retrieve_documents_with_metadata)
+        graph.add_node("retriever", RunnableLambda(nodes.retrieve_documents_with_metadata, afunc=nodes.aretrieve_documents_with_metadata))
     
     if WORKFLOW_SETTINGS['semantic_cache']:
         graph.add_edge(START, nodes.cache_retriever_node.__name__)
@@ -95,12 +96,12 @@ else:
     else:
         graph.add_edge(START, "retriever")
 
-    graph.add_node("retriever", nodes.retrieve_documents)
+    graph.add_node("retriever", RunnableLambda(nodes.retrieve_documents, afunc=nodes.aretrieve_documents))
 
 
 
 if WORKFLOW_SETTINGS["grade_documents"]:
-    graph.add_node(nodes.grade_documents.__name__, nodes.grade_documents)
+    graph.add_node(nodes.grade_documents.__name__, RunnableLambda(nodes.grade_documents, afunc=nodes.agrade_documents))
 
     if not WORKFLOW_SETTINGS["assess_metadata_filters"]:
         graph.add_edge("retriever", nodes.grade_documents.__name__)